@@ -22,10 +22,10 @@ import logging
 import json
 import shutil
 import tarfile
+import time
 
 import requests
 from fabric.contrib.files import append
-from fabric.context_managers import settings, hide
 from fabric.operations import os, get, run
 from fabric.tasks import execute
 from fabric.api import env, runs_once, task
@@ -35,6 +35,8 @@ from prestoadmin.prestoclient import PrestoClient
 from prestoadmin.server import get_presto_version, get_catalog_info_from
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.host_facts import get_host_facts, get_presto_package, \
+    JAVA, PLATFORM
 from prestoadmin.util.local_config_util import get_log_directory
 from prestoadmin.util.remote_config_util import lookup_server_log_file,\
     lookup_launcher_log_file,  lookup_port, lookup_catalog_directory
@@ -193,7 +195,7 @@ def system_info():
     _LOGGER.debug('Gathered node information in file: ' + node_info_file_name)
 
     catalog_file_name = os.path.join(downloaded_sys_info_loc, 'catalog_info.txt')
-    client = PrestoClient(env.host, env.user)
+    client = PrestoClient(fabricapi.get_coordinator_endpoints(), env.user)
     catalog_info = get_catalog_info_from(client)
 
     with open(catalog_file_name, 'w') as out_file:
@@ -222,6 +224,8 @@ def get_system_info(download_location):
            prestoadmin.__version__ + '\n')
     append(version_file_name, 'Presto server version: ' +
            get_presto_version() + '\n')
+    append(version_file_name, 'Presto server package: ' +
+           get_presto_package_information() + '\n')
 
     _LOGGER.debug('Gathered version information in file: ' + version_file_name)
 
@@ -235,14 +239,26 @@ def get_catalog_configs(dest_path):
 
 
 def get_platform_information():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        platform_info = run('uname -a')
-        _LOGGER.debug('platform info: ' + platform_info)
-        return platform_info
+    facts = get_host_facts(env.host)
+    platform_info = facts[PLATFORM] if facts else ''
+    _LOGGER.debug('platform info: ' + platform_info)
+    return platform_info
+
+
+def get_presto_package_information():
+    presto_package = get_presto_package(env.host)
+    if presto_package is None:
+        return ''
+    package_info = '%s-%s' % (presto_package['name'], presto_package['version'])
+    if presto_package['install_time'] is not None:
+        package_info += ' installed ' + time.strftime(
+            '%Y-%m-%d %H:%M:%S UTC',
+            time.gmtime(presto_package['install_time']))
+    return package_info
 
 
 def get_java_version():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        version = run('java -version')
-        _LOGGER.debug('java version: ' + version)
-        return version
+    facts = get_host_facts(env.host)
+    version = facts[JAVA] if facts else ''
+    _LOGGER.debug('java version: ' + version)
+    return version
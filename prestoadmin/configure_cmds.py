@@ -17,6 +17,7 @@ Module for various configuration management tasks using presto-admin
 """
 import logging
 import os
+import time
 from StringIO import StringIO
 from contextlib import closing
 
@@ -32,10 +33,25 @@ from prestoadmin.util import constants
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.constants import CONFIG_PROPERTIES, LOG_PROPERTIES, \
     JVM_CONFIG, NODE_PROPERTIES
+from prestoadmin.util import host_facts
+from prestoadmin.util.host_facts import forget_host_facts, get_host_facts
+from prestoadmin.util.output_format import get_output_format, \
+    print_records, elapsed_ms, TEXT
 
 __all__ = ['show']
 
 ALL_CONFIG = [CONFIG_PROPERTIES, LOG_PROPERTIES, JVM_CONFIG, NODE_PROPERTIES]
+CONFIG_TYPES = {'node': NODE_PROPERTIES,
+                'jvm': JVM_CONFIG,
+                'config': CONFIG_PROPERTIES,
+                'log': LOG_PROPERTIES}
+# The configuration files are part of the facts gathered from every host
+CONFIG_FACTS = {NODE_PROPERTIES: host_facts.NODE_PROPERTIES,
+                JVM_CONFIG: host_facts.JVM_CONFIG,
+                CONFIG_PROPERTIES: host_facts.CONFIG_PROPERTIES,
+                LOG_PROPERTIES: host_facts.LOG_PROPERTIES}
+# Fields of the machine readable output of configuration show
+CONFIGURATION_FIELDS = ['host', 'file', 'path', 'key', 'value', 'fetch_ms']
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -110,6 +126,7 @@ def gather_config_directory():
 def deploy_config_directory(tarfile):
     sudo('tar -C "%s" -x -v -f "%s" ; rm "%s"' %
          (constants.REMOTE_CONF_DIR, tarfile, tarfile))
+    forget_host_facts(env.host)
 
 
 def configuration_fetch(file_name, config_destination, should_warn=True):
@@ -149,23 +166,64 @@ def show(config_type=None):
 
     Parameters:
         config_type: [node|jvm|config|log]
+        --format -              (optional) text, json or csv. json and csv
+                                print a record per property, or per option
+                                of jvm.config, with the fields host, file,
+                                path, key, value and fetch_ms. In json
+                                there is a document per host, each on its
+                                own line. Defaults to text.
     """
     file_name = ''
-    if config_type is None:
+    if config_type is not None:
+        file_name = CONFIG_TYPES.get(config_type.lower(), '')
+        if not file_name:
+            abort("Invalid Argument. Possible values: node, jvm, config, log")
+
+    output_format = get_output_format()
+    if output_format != TEXT:
+        print_configuration_records(output_format, file_name)
+    elif config_type is None:
         configuration_show(NODE_PROPERTIES)
         configuration_show(JVM_CONFIG)
         configuration_show(CONFIG_PROPERTIES)
         configuration_show(LOG_PROPERTIES, should_warn=False)
     else:
-        if config_type.lower() == 'node':
-            file_name = NODE_PROPERTIES
-        elif config_type.lower() == 'jvm':
-            file_name = JVM_CONFIG
-        elif config_type.lower() == 'config':
-            file_name = CONFIG_PROPERTIES
-        elif config_type.lower() == 'log':
-            file_name = LOG_PROPERTIES
-        else:
-            abort("Invalid Argument. Possible values: node, jvm, config, log")
-
         configuration_show(file_name)
+
+
+def print_configuration_records(output_format, file_name=None):
+    """
+    Prints the configuration of env.host as records, read from the facts
+    gathered from the host instead of fetching every file separately.
+    """
+    started = time.time()
+    facts = get_host_facts(env.host)
+    fetch_ms = elapsed_ms(started)
+    if facts is None:
+        warn('Could not read the configuration of %s' % env.host)
+        return
+
+    records = []
+    for name in [file_name] if file_name else \
+            [NODE_PROPERTIES, JVM_CONFIG, CONFIG_PROPERTIES, LOG_PROPERTIES]:
+        path = os.path.join(constants.REMOTE_CONF_DIR, name)
+        content = facts[CONFIG_FACTS[name]]
+        if content is None:
+            if file_name or name != LOG_PROPERTIES:
+                warn("No configuration file found for %s at %s"
+                     % (env.host, path))
+            continue
+        if isinstance(content, dict):
+            entries = sorted(content.items())
+        else:
+            entries = [(option, None) for option in content]
+        for key, value in entries:
+            records.append({'host': env.host, 'file': name, 'path': path,
+                            'key': key, 'value': value,
+                            'fetch_ms': fetch_ms})
+
+    # The task runs once per host, the csv header is only printed once
+    print_records(output_format, 'configuration show', CONFIGURATION_FIELDS,
+                  records, {'fetch': fetch_ms}, started,
+                  header=not env.get('configuration_header_printed'))
+    env.configuration_header_printed = True
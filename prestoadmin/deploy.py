@@ -28,6 +28,7 @@ from fabric.api import env
 
 from prestoadmin.util import constants
 from prestoadmin.standalone.config import PRESTO_STANDALONE_USER_GROUP
+from prestoadmin.util.host_facts import forget_host_facts
 import coordinator as coord
 import prestoadmin.util.fabricapi as util
 import workers as w
@@ -61,6 +62,7 @@ def configure_presto(conf, remote_dir):
     deploy(dict((name, output_format(content)) for (name, content)
                 in conf.iteritems() if name != "node.properties"), remote_dir)
     deploy_node_properties(output_format(conf['node.properties']), remote_dir)
+    forget_host_facts(env.host)
 
 
 def output_format(conf):
@@ -28,10 +28,12 @@ from fabric.task_utils import crawl, parse_kwargs
 from fabric.utils import error
 import fabric.api
 import fabric.operations
+import fabric.sftp
 import fabric.tasks
 from fabric.network import needs_host, to_dict, disconnect_all
 
 from prestoadmin.util import exception
+from prestoadmin.util.throttle import throttled
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,6 +41,8 @@ old_warn = fabric.utils.warn
 old_abort = fabric.utils.abort
 old_run = fabric.operations.run
 old_sudo = fabric.operations.sudo
+old_sftp_put = fabric.sftp.SFTP.put
+old_sftp_get = fabric.sftp.SFTP.get
 
 
 # Need to monkey patch Fabric's warn method in order to print out
@@ -102,6 +106,23 @@ def log_output(out):
                  out.stderr)
 
 
+# Monkey patch the sftp transfers of put and get so that they stay within
+# the bandwidth limits.
+def sftp_put(self, local_path, remote_path, *args, **kwargs):
+    name = local_path if isinstance(local_path, basestring) else remote_path
+    with throttled(self, 'Sent', name):
+        return old_sftp_put(self, local_path, remote_path, *args, **kwargs)
+
+
+def sftp_get(self, remote_path, local_path, *args, **kwargs):
+    with throttled(self, 'Received', remote_path):
+        return old_sftp_get(self, remote_path, local_path, *args, **kwargs)
+
+
+fabric.sftp.SFTP.put = sftp_put
+fabric.sftp.SFTP.get = sftp_get
+
+
 # Monkey patch _execute and execute so that we can handle errors differently
 def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
     """
@@ -17,14 +17,14 @@ Commands for running scripts on a cluster
 """
 import logging
 from fabric.operations import put, sudo
-from fabric.decorators import task
-from fabric.api import env
+from fabric.decorators import task, runs_once
 from os import path
 
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.constants import REMOTE_COPY_DIR
-from prestoadmin.plugin import write
+from prestoadmin.plugin import write_to_cluster
+from prestoadmin.util.fabricapi import get_host_list
 
 _LOGGER = logging.getLogger(__name__)
 __all__ = ['run', 'copy']
@@ -49,6 +49,7 @@ def run(script, remote_dir='/tmp'):
 
 
 @task
+@runs_once
 @requires_config(StandaloneConfig)
 def copy(local_file, remote_dir=REMOTE_COPY_DIR):
     """
@@ -57,6 +58,8 @@ def copy(local_file, remote_dir=REMOTE_COPY_DIR):
     Parameters:
         local_file - The path to the file
         remote_dir - Where to put the file on the cluster.  Default is /tmp.
+        --tree - (Optional) Copy the file to a few nodes only and let the
+                 nodes relay it to each other.
     """
-    _LOGGER.info('copying file to %s' % env.host)
-    write(local_file, remote_dir)
+    _LOGGER.info('copying file to %s' % ', '.join(get_host_list()))
+    write_to_cluster(local_file, remote_dir)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Install bundles for server install.
+
+Instead of copying the rpm, then every configuration file and catalog
+with a few ssh commands each, and then polling for the presto user,
+server install sends every host one tar with the rpm, the configuration
+of the host's role, the catalogs and a script that installs them all. The
+script runs in a single sudo and reports every step on a line starting
+with RESULT_MARKER.
+
+The rpm is left out of the bundle for hosts that already have an
+identical copy in the packages directory, e.g. from --tree, --pull or an
+earlier attempt. Bundles larger than the chunk size are uploaded in
+resumable chunks. The bundles are built so that the same content always
+gives the same file, which lets an interrupted upload resume on the next
+run.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
+
+from fabric.api import env, put, sudo
+from fabric.context_managers import settings, hide
+from fabric.decorators import parallel
+from fabric.tasks import execute
+from fabric.utils import abort
+
+from prestoadmin import catalog
+from prestoadmin.coordinator import Coordinator
+from prestoadmin.deploy import output_format, escape_single_quotes
+from prestoadmin.package import get_local_sha256
+from prestoadmin.standalone.config import PRESTO_STANDALONE_USER, \
+    PRESTO_STANDALONE_USER_GROUP
+from prestoadmin.util import constants
+from prestoadmin.util.chunked_upload import needs_chunks, prepare_chunks, \
+    upload_in_chunks
+from prestoadmin.util.fabricapi import get_coordinator_role
+from prestoadmin.util.host_facts import forget_host_facts
+from prestoadmin.util.local_config_util import get_catalog_directory
+from prestoadmin.workers import Worker
+
+_LOGGER = logging.getLogger(__name__)
+
+REMOTE_BUNDLE_DIR = os.path.join(constants.REMOTE_PACKAGES_PATH, 'bundles')
+RESULT_MARKER = '#presto-admin-result:'
+SCRIPT_NAME = 'install.sh'
+NODE_PROPERTIES = 'node.properties'
+# The rpm creates the presto user; how long to wait for it, in seconds
+PRESTO_USER_WAIT = 3
+
+INSTALL_SCRIPT = '''#!/bin/sh
+# Installs the Presto rpm, configuration and catalogs of this bundle
+cd "$(dirname "$0")" || exit 1
+
+result() {
+    echo "%(marker)s$1 $2 $(echo "$3" | tr '\\n' ' ')"
+}
+
+fail() {
+    result "$1" failed "$2"
+    exit 1
+}
+
+if [ -f 'rpm/%(rpm_name)s' ]; then
+    mkdir -p '%(packages_dir)s' &&
+        mv 'rpm/%(rpm_name)s' '%(rpm_path)s' ||
+        fail rpm 'could not move the rpm to %(packages_dir)s'
+fi
+%(java8_home)s
+output=$(rpm -i %(nodeps)s'%(rpm_path)s' 2>&1) || fail rpm "$output"
+result rpm ok '%(rpm_name)s'
+
+waited=0
+until getent passwd %(user)s >/dev/null; do
+    [ $waited -ge %(user_wait)d ] &&
+        fail presto_user 'the rpm did not create the %(user)s user'
+    sleep 1
+    waited=$((waited + 1))
+done
+result presto_user ok "${waited}s"
+
+# Keep the node.id of an earlier install
+node_id=$(grep -s 'node.id' '%(conf_dir)s/node.properties' | head -n 1)
+[ -n "$node_id" ] || node_id="node.id=$(uuidgen)" ||
+    fail configs 'could not generate a node.id'
+{ echo "$node_id"; cat etc/node.properties; } > etc/node.properties.new &&
+    mv etc/node.properties.new etc/node.properties ||
+    fail configs 'could not write node.properties'
+mkdir -p '%(conf_dir)s' || fail configs 'could not create %(conf_dir)s'
+for path in etc/*; do
+    install -o %(user)s -g %(group)s -m 600 "$path" '%(conf_dir)s/' ||
+        fail configs "could not install $path"
+done
+result configs ok "$(ls etc)"
+
+install -d -o %(user)s -g %(group)s -m 755 '%(catalog_dir)s' ||
+    fail catalogs 'could not create %(catalog_dir)s'
+for path in catalog/*; do
+    [ -f "$path" ] || continue
+    install -o %(user)s -g %(group)s -m 600 "$path" '%(catalog_dir)s/' ||
+        fail catalogs "could not install $path"
+done
+result catalogs ok "$(ls catalog)"
+'''
+
+
+def install_bundles(local_path, hosts):
+    """
+    Installs the rpm at local_path, the configuration and the catalogs on
+    hosts with one bundle per host.
+
+    Returns:
+        A dict of host to the results of its install, see parse_results
+    """
+    if not hosts:
+        return {}
+    with settings(hide('running')):
+        deployed = execute(prepare_host, local_path, hosts=hosts)
+    confs = get_role_confs(hosts)
+    catalog_files = get_catalog_files()
+
+    directory = tempfile.mkdtemp(prefix='presto-admin-bundles-')
+    try:
+        bundles = {}
+        built = {}
+        for host in hosts:
+            role = 'coordinator' if host in get_coordinator_role() \
+                else 'workers'
+            key = (role, deployed.get(host) is not True)
+            if key not in built:
+                built[key] = build_bundle(directory, local_path, confs[role],
+                                          catalog_files, include_rpm=key[1])
+                prepare_chunks(built[key])
+            bundles[host] = built[key]
+        return execute(install_bundle, bundles, hosts=hosts)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@parallel
+def prepare_host(local_path):
+    """
+    Creates the bundle directory on env.host.
+
+    Returns:
+        Whether env.host has a copy of the rpm identical to local_path
+    """
+    rpm_path = os.path.join(constants.REMOTE_PACKAGES_PATH,
+                            os.path.basename(local_path))
+    with settings(hide('stdout')):
+        result = sudo('install -d -m 700 %s && (sha256sum %s 2>/dev/null '
+                      '|| true)' % (REMOTE_BUNDLE_DIR, rpm_path))
+    remote_checksum = result.split()[0] if result.split() else None
+    return remote_checksum == get_local_sha256(local_path)
+
+
+def get_role_confs(hosts):
+    confs = {}
+    if any(host in get_coordinator_role() for host in hosts):
+        confs['coordinator'] = Coordinator().get_conf()
+    if any(host not in get_coordinator_role() for host in hosts):
+        confs['workers'] = Worker().get_conf()
+    return confs
+
+
+def get_catalog_files():
+    """
+    Returns the names of the files in the local catalog directory, checked
+    like catalog add does.
+    """
+    catalog_dir = get_catalog_directory()
+    if not os.path.isdir(catalog_dir):
+        _LOGGER.info('No catalog directory found, not adding catalogs.')
+        return []
+    filenames = sorted(os.listdir(catalog_dir))
+    if not catalog.validate(filenames):
+        return []
+    return filenames
+
+
+def build_bundle(directory, local_path, conf, catalog_files,
+                 include_rpm=True):
+    """
+    Writes a bundle with the rpm at local_path, if include_rpm, the
+    configuration conf and the catalog_files to directory.
+
+    Returns:
+        The path of the bundle
+    """
+    rpm_name = os.path.basename(local_path)
+    members = [(SCRIPT_NAME, 0755, render_script(rpm_name))]
+    for name in sorted(conf):
+        members.append(('etc/' + name, 0600, output_format(conf[name]) + '\n'))
+    catalog_dir = get_catalog_directory()
+    for name in catalog_files:
+        with open(os.path.join(catalog_dir, name)) as catalog_file:
+            members.append(('catalog/' + name, 0600, catalog_file.read()))
+
+    digest = hashlib.sha256()
+    for name, mode, content in members:
+        digest.update('%s %o %s\n' % (name, mode,
+                                      hashlib.sha256(content).hexdigest()))
+    if include_rpm:
+        digest.update('rpm/%s %s\n' % (rpm_name, get_local_sha256(local_path)))
+    bundle_path = os.path.join(directory, 'presto-install-%s.tar' %
+                               digest.hexdigest()[:16])
+    if os.path.exists(bundle_path):
+        return bundle_path
+
+    with tarfile.open(bundle_path, 'w', format=tarfile.GNU_FORMAT) as bundle:
+        for name, mode, content in members:
+            bundle.addfile(_tar_info(name, mode, len(content)),
+                           StringIO(content))
+        if include_rpm:
+            with open(local_path, 'rb') as rpm_file:
+                bundle.addfile(_tar_info('rpm/' + rpm_name, 0644,
+                                         os.path.getsize(local_path)),
+                               rpm_file)
+    return bundle_path
+
+
+def _tar_info(name, mode, size):
+    # Fixed metadata, so that the same content gives the same bundle
+    info = tarfile.TarInfo(name)
+    info.mode = mode
+    info.size = size
+    info.mtime = 0
+    return info
+
+
+def render_script(rpm_name):
+    java8_home = ''
+    if env.get('java8_home'):
+        java8_home = "JAVA8_HOME='%s'; export JAVA8_HOME" % \
+            escape_single_quotes(env.java8_home)
+    user, group = PRESTO_STANDALONE_USER_GROUP.split(':')
+    return INSTALL_SCRIPT % {
+        'marker': RESULT_MARKER, 'rpm_name': rpm_name,
+        'packages_dir': constants.REMOTE_PACKAGES_PATH,
+        'rpm_path': os.path.join(constants.REMOTE_PACKAGES_PATH, rpm_name),
+        'java8_home': java8_home,
+        'nodeps': '--nodeps ' if env.get('nodeps') else '',
+        'user': PRESTO_STANDALONE_USER, 'group': group,
+        'user_wait': PRESTO_USER_WAIT,
+        'conf_dir': constants.REMOTE_CONF_DIR,
+        'catalog_dir': constants.REMOTE_CATALOG_DIR}
+
+
+@parallel
+def install_bundle(bundles):
+    """
+    Uploads the bundle of env.host from bundles, a dict of host to the
+    local path of its bundle, and runs its install script.
+
+    Returns:
+        The results of the install, see parse_results
+    """
+    bundle_path = bundles[env.host]
+    bundle_name = os.path.basename(bundle_path)
+    remote_path = os.path.join(REMOTE_BUNDLE_DIR, bundle_name)
+    extract_dir = remote_path[:-len('.tar')]
+
+    print('Deploying install bundle on %s...' % env.host)
+    if needs_chunks(bundle_path):
+        upload_in_chunks(bundle_path, REMOTE_BUNDLE_DIR)
+    else:
+        put(bundle_path, REMOTE_BUNDLE_DIR, use_sudo=True, mode=0600)
+
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        output = sudo('rm -rf %(dir)s && mkdir -m 700 %(dir)s && '
+                      'tar -xf %(bundle)s -C %(dir)s && sh %(dir)s/%(script)s; '
+                      'status=$?; rm -rf %(dir)s %(bundle)s; exit $status' %
+                      {'dir': extract_dir, 'bundle': remote_path,
+                       'script': SCRIPT_NAME})
+    forget_host_facts(env.host)
+    results = parse_results(output)
+    report_results(results)
+    if not output.succeeded:
+        failures = ['%s: %s' % (step, result['detail']) for step, result in
+                    sorted(results.iteritems()) if result['status'] != 'ok']
+        abort('Failed to install Presto on %s: %s' % (
+            env.host, '; '.join(failures) or output))
+    return results
+
+
+def parse_results(output):
+    """
+    Returns:
+        A dict of the steps of the install script that ran, rpm,
+        presto_user, configs and catalogs, to a dict with their status, ok
+        or failed, and a detail: the rpm, the seconds waited for the presto
+        user, the configuration files or the catalogs, or what failed
+    """
+    results = {}
+    for line in output.splitlines():
+        if not line.startswith(RESULT_MARKER):
+            continue
+        fields = line[len(RESULT_MARKER):].split(' ', 2)
+        if len(fields) >= 2:
+            results[fields[0]] = {
+                'status': fields[1],
+                'detail': fields[2].strip() if len(fields) == 3 else ''}
+    return results
+
+
+def report_results(results):
+    def succeeded(step):
+        return results.get(step, {}).get('status') == 'ok'
+
+    if succeeded('rpm'):
+        print('Package installed successfully on: ' + env.host)
+    if succeeded('configs'):
+        print('Deploying configuration on: ' + env.host)
+    if succeeded('catalogs') and results['catalogs']['detail']:
+        print('Deploying %s catalog configurations on: %s ' % (
+            ', '.join(results['catalogs']['detail'].split()), env.host))
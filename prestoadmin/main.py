@@ -64,9 +64,11 @@ from fabric.utils import abort, indent, warn, _pty_size
 from prestoadmin.util.exception import ConfigurationError, is_arguments_error
 from prestoadmin import __version__
 from prestoadmin.util.application import entry_point
+from prestoadmin.util.endpoint_cache import get_endpoint_cache
 from prestoadmin.util.fabric_application import FabricApplication
 from prestoadmin.util.hiddenoptgroup import HiddenOptionGroup
 from prestoadmin.util.parser import LoggingOptionParser
+from prestoadmin.util.throttle import set_bandwidth_limits
 
 # One-time calculation of "all internal callables" to avoid doing this on every
 # check of a given fabfile callable (in is_classic_task()).
@@ -75,6 +77,32 @@ _internals = reduce(lambda x, y: x + filter(callable, vars(y).values()),
                     _modules, [])
 _LOGGER = logging.getLogger(__name__)
 
+ROLLING_TASKS = ['server.restart', 'server.upgrade']
+DRAIN_TASKS = ['server.stop', 'server.restart', 'server.upgrade']
+PULL_TASKS = ['package.install', 'server.install', 'server.upgrade']
+# Options that only some tasks take, with the tasks that take them
+TASK_OPTIONS = [
+    ('--nodeps', 'nodeps', ['package.install', 'server.uninstall',
+                            'server.install', 'server.upgrade']),
+    ('--rolling', 'rolling', ROLLING_TASKS),
+    ('--batch-size', 'batch_size', ROLLING_TASKS),
+    ('--pause', 'pause', ROLLING_TASKS),
+    ('--abort-threshold', 'abort_threshold', ROLLING_TASKS),
+    ('--drain', 'drain', DRAIN_TASKS),
+    ('--drain-timeout', 'drain_timeout', DRAIN_TASKS),
+    ('--watch', 'watch', ['server.status']),
+    ('--interval', 'interval', ['server.status']),
+    ('--format', 'output_format', ['server.status', 'topology.show',
+                                   'configuration.show']),
+    ('--tree', 'tree', ['package.install', 'server.install', 'server.upgrade',
+                        'plugin.add_jar', 'file.copy']),
+    ('--pull', 'pull', PULL_TASKS),
+    ('--seed-count', 'seed_count', PULL_TASKS),
+    ('--pull-concurrency', 'pull_concurrency', PULL_TASKS),
+    ('--skip-preflight', 'skip_preflight', ['server.install',
+                                            'server.upgrade'])
+]
+
 
 def _get_presto_env_options():
     new_env_options = copy.deepcopy(env_options)
@@ -323,6 +351,133 @@ def parser_for_options():
         help=SUPPRESS_HELP
     )
 
+    parser.add_option(
+        '--rolling',
+        action='store_true',
+        dest='rolling',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--batch-size',
+        type='int',
+        dest='batch_size',
+        default=1,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--pause',
+        type='float',
+        dest='pause',
+        default=0,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--abort-threshold',
+        type='int',
+        dest='abort_threshold',
+        default=0,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--drain',
+        action='store_true',
+        dest='drain',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--drain-timeout',
+        type='int',
+        dest='drain_timeout',
+        default=300,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--watch',
+        action='store_true',
+        dest='watch',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--interval',
+        type='float',
+        dest='interval',
+        default=2,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--format',
+        dest='output_format',
+        default=None,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--tree',
+        action='store_true',
+        dest='tree',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--seed-count',
+        type='int',
+        dest='seed_count',
+        default=2,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--pull',
+        action='store_true',
+        dest='pull',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--pull-concurrency',
+        type='int',
+        dest='pull_concurrency',
+        default=10,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--skip-preflight',
+        action='store_true',
+        dest='skip_preflight',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--host-bandwidth',
+        type='float',
+        dest='host_bandwidth',
+        default=None,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--total-bandwidth',
+        type='float',
+        dest='total_bandwidth',
+        default=None,
+        help=SUPPRESS_HELP
+    )
+
     #
     # Add in options which are also destined to show up as `env` vars.
     #
@@ -558,12 +713,16 @@ def show_commands(docstring, format, code=0):
 def run_tasks(task_list):
     for name, args, kwargs, arg_hosts, arg_roles, arg_excl_hosts in task_list:
         try:
-            nodeps_tasks = ['package.install', 'server.uninstall',
-                            'server.install', 'server.upgrade']
-            if state.env.nodeps and name.strip() not in nodeps_tasks:
-                sys.stderr.write('Invalid argument --nodeps to task: %s\n'
-                                 % name)
-                display_command(name, 2)
+            command_line_options = state.env.get('command_line_options', [])
+            for option, dest, tasks in TASK_OPTIONS:
+                if dest in command_line_options and \
+                        name.strip() not in tasks:
+                    sys.stderr.write('Invalid argument %s to task: %s\n'
+                                     % (option, name))
+                    display_command(name, 2)
+
+            set_bandwidth_limits(state.env.get('host_bandwidth'),
+                                 state.env.get('total_bandwidth'))
 
             return execute(
                 name,
@@ -686,6 +845,10 @@ def _update_env(default_options, non_default_options, load_config_callback):
     for opt, value in default_options.__dict__.items():
         state.env[opt] = value
 
+    # The options given on the command line, which run_tasks checks against
+    # the task
+    state.env.command_line_options = non_default_options.__dict__.keys()
+
     if load_config_callback:
         config_path = load_config(load_config_callback)
     else:
@@ -839,6 +1002,9 @@ def parse_and_validate_commands(args=sys.argv[1:]):
         state.env.password = getpass.getpass(prompt)
 
     state.env['tasks'] = [x[0] for x in commands_to_run]
+    # Created before any task forks, so the jobs share the coordinator
+    # endpoint one of them found
+    get_endpoint_cache()
 
     return commands_to_run
 
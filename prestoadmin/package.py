@@ -27,7 +27,14 @@ from fabric.utils import abort
 from prestoadmin.util import constants
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.chunked_upload import needs_chunks, prepare_chunks, \
+    upload_in_chunks
+from prestoadmin.util.distribution import distribute
 from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.host_facts import forget_host_facts, \
+    is_package_installed
+from prestoadmin.util.pull_install import pull
+from prestoadmin.util.verification_cache import VerificationCache
 
 _LOGGER = logging.getLogger(__name__)
 __all__ = ['install', 'uninstall']
@@ -45,12 +52,45 @@ def install(local_path):
         --nodeps (optional): Flag to indicate if rpm install
             should ignore checking package dependencies. Equivalent
             to adding --nodeps flag to rpm -i.
+        --tree (optional): Copy the rpm to a few nodes only and let
+            the nodes relay it to each other.
+        --seed-count (optional): Number of nodes to copy the rpm to
+            with --tree. Defaults to 2.
+        --pull (optional): Serve the rpm over HTTP from this host and
+            let the nodes download it with curl.
+        --pull-concurrency (optional): Number of nodes downloading the
+            rpm at the same time with --pull. Defaults to 10.
     """
     check_if_valid_rpm(local_path)
+    distribute_if_requested(local_path)
+    prepare_chunks(local_path)
     return execute(deploy_install, local_path, hosts=get_host_list())
 
 
+def distribute_if_requested(local_path):
+    """
+    With --tree or --pull, gets the rpm to the packages directory of all
+    the hosts up front, so that deploy finds it there on every host. Hosts
+    that fail to pull the rpm get it pushed by deploy.
+    """
+    if env.get('tree') and env.get('pull'):
+        abort('--tree and --pull cannot be used together.')
+    if env.get('tree') or env.get('pull'):
+        if not os.path.isfile(local_path):
+            abort('RPM file not found at %s.' % local_path)
+    if env.get('pull'):
+        pull(local_path, constants.REMOTE_PACKAGES_PATH, get_host_list(),
+             checksum=get_local_sha256(local_path))
+    elif env.get('tree'):
+        distribute(local_path, constants.REMOTE_PACKAGES_PATH,
+                   get_host_list(), checksum=get_local_sha256(local_path))
+
+
 def check_if_valid_rpm(local_path):
+    verification_cache = VerificationCache()
+    if verification_cache.is_verified(local_path):
+        _LOGGER.info("Rpm %s unchanged since it was verified" % local_path)
+        return
     _LOGGER.info("Checking rpm checksum to see if it is corrupted")
     with settings(hide('warnings', 'stdout'), warn_only=True):
         result = local('rpm -K --nosignature ' + local_path, capture=True)
@@ -58,6 +98,10 @@ def check_if_valid_rpm(local_path):
         abort("Corrupted RPM. Try downloading the RPM again.")
     elif result.stderr:
         abort(result.stderr)
+    else:
+        verification_cache.record(
+            local_path, valid=True,
+            sha256=verification_cache.get_sha256(local_path))
 
 
 def deploy_install(local_path):
@@ -71,15 +115,25 @@ def deploy_upgrade(local_path):
 def deploy_action(local_path, rpm_action):
     deploy(local_path)
     rpm_action(os.path.basename(local_path))
+    forget_host_facts(env.host)
 
 
 def deploy(local_path=None):
     if not os.path.isfile(local_path):
         abort('RPM file not found at %s.' % local_path)
 
+    if is_deployed(local_path):
+        _LOGGER.info("Rpm already deployed on %s" % env.host)
+        print("Package already deployed on %s, skipping the transfer"
+              % env.host)
+        return
+
     _LOGGER.info("Deploying rpm on %s..." % env.host)
     print("Deploying rpm on %s..." % env.host)
-    sudo('mkdir -p ' + constants.REMOTE_PACKAGES_PATH)
+    if needs_chunks(local_path):
+        upload_in_chunks(local_path, constants.REMOTE_PACKAGES_PATH)
+        print("Package deployed successfully on: " + env.host)
+        return
     ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH, use_sudo=True)
     if not ret_list.succeeded:
         _LOGGER.warn("Failure during put. Now using /tmp as temp dir...")
@@ -89,6 +143,25 @@ def deploy(local_path=None):
         print("Package deployed successfully on: " + env.host)
 
 
+def is_deployed(local_path):
+    """
+    Creates REMOTE_PACKAGES_PATH on env.host if needed and checks, with the
+    same command, whether it already holds a copy of the file at local_path
+    with the same SHA-256, e.g. from an earlier install that failed later on.
+    """
+    remote_path = _rpm_path(os.path.basename(local_path))
+    with settings(hide('stdout')):
+        result = sudo('mkdir -p %s && (sha256sum %s 2>/dev/null || true)'
+                      % (constants.REMOTE_PACKAGES_PATH, remote_path))
+    remote_checksum = result.split()[0] if result.split() else None
+    return remote_checksum == get_local_sha256(local_path)
+
+
+def get_local_sha256(local_path):
+    # Recorded, since the same file is deployed to every host
+    return VerificationCache().get_sha256(local_path)
+
+
 def _rpm_install(package_path):
     nodeps = _nodeps_rpm_option()
 
@@ -129,6 +202,20 @@ def rpm_upgrade(rpm_name):
         print("Package upgraded successfully on: " + env.host)
 
 
+def check_remote_rpm(local_path):
+    """
+    Checks that the rpm deployed to REMOTE_PACKAGES_PATH on env.host has
+    the SHA-256 of the local rpm at local_path, which check_if_valid_rpm
+    verified, so that a transfer that went wrong is caught before anything
+    is stopped or changed.
+    """
+    rpm_path = _rpm_path(os.path.basename(local_path))
+    result = sudo('sha256sum %s' % rpm_path, quiet=True)
+    if not result.succeeded or \
+            result.split()[:1] != [get_local_sha256(local_path)]:
+        abort('Corrupted RPM file: %s' % rpm_path)
+
+
 def _rpm_upgrade(package_name):
     return sudo('rpm -U %s%s' % (_nodeps_rpm_option(), package_name))
 
@@ -157,9 +244,13 @@ def rpm_uninstall(package_name):
             abort('Package is not installed: ' + package_name)
     elif _rpm_uninstall(package_name).succeeded:
         print("Package uninstalled successfully on: " + env.host)
+    forget_host_facts(env.host)
 
 
 def is_rpm_installed(package_name):
+    installed = is_package_installed(env.host, package_name)
+    if installed is not None:
+        return installed
     return sudo('rpm -qi %s' % package_name, quiet=True).succeeded
 
 
@@ -16,24 +16,44 @@
 module for tasks relating to presto plugins
 """
 import logging
-from fabric.decorators import task
+from fabric.decorators import task, runs_once
 from fabric.operations import sudo, put
+from fabric.tasks import execute
 import os
 from fabric.api import env
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.chunked_upload import needs_chunks, prepare_chunks, \
+    upload_in_chunks
 from prestoadmin.util.constants import REMOTE_PLUGIN_DIR
+from prestoadmin.util.distribution import distribute
+from prestoadmin.util.fabricapi import get_host_list
 
 __all__ = ['add_jar']
 _LOGGER = logging.getLogger(__name__)
 
 
 def write(local_path, remote_dir):
+    if needs_chunks(local_path):
+        upload_in_chunks(local_path, remote_dir)
+        return
     sudo("mkdir -p " + remote_dir)
     put(local_path, remote_dir, use_sudo=True)
 
 
+def write_to_cluster(local_path, remote_dir):
+    """
+    Writes local_path to remote_dir on every host, through a distribution
+    tree with --tree.
+    """
+    if env.get('tree'):
+        return distribute(local_path, remote_dir, get_host_list())
+    prepare_chunks(local_path)
+    return execute(write, local_path, remote_dir, hosts=get_host_list())
+
+
 @task
+@runs_once
 @requires_config(StandaloneConfig)
 def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
     """
@@ -44,6 +64,8 @@ def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
         plugin_name - Name of the plugin subdirectory to deploy jars to
         plugin_dir - (Optional) The plugin directory.  If no directory is
                      given, '/usr/lib/presto/lib/plugin' is used by default.
+        --tree - (Optional) Copy the jar to a few nodes only and let the
+                 nodes relay it to each other.
     """
-    _LOGGER.info('deploying jars on %s' % env.host)
-    write(local_path, os.path.join(plugin_dir, plugin_name))
+    _LOGGER.info('deploying jars to %s' % ', '.join(get_host_list()))
+    write_to_cluster(local_path, os.path.join(plugin_dir, plugin_name))
@@ -18,7 +18,10 @@ Simple client to communicate with a Presto server.
 import json
 import logging
 import os
+import Queue
 import socket
+import threading
+import time
 import urlparse
 from httplib import HTTPConnection, HTTPException
 from tempfile import mkstemp
@@ -29,6 +32,7 @@ from fabric.state import env
 from fabric.utils import error
 from jks import jks, base64, textwrap
 from prestoadmin.util.constants import REMOTE_CONF_DIR, CONFIG_PROPERTIES
+from prestoadmin.util.endpoint_cache import get_endpoint_cache
 from prestoadmin.util.exception import InvalidArgumentError
 from prestoadmin.util.httpscacertconnection import HTTPSCaCertConnection
 from prestoadmin.util.local_config_util import get_coordinator_directory, get_topology_path
@@ -39,19 +43,116 @@ URL_TIMEOUT_MS = 5000
 NUM_ROWS = 1000
 DATA_RESP = "data"
 NEXT_URI_RESP = "nextUri"
+ID_RESP = "id"
+STATS_RESP = "stats"
+
+# Query states in which the coordinator has no data to return yet, so there
+# is no point in asking for the next page right away.
+WAITING_QUERY_STATES = ['QUEUED', 'PLANNING', 'STARTING']
+POLL_INITIAL_DELAY = 0.05
+POLL_MAX_DELAY = 1.0
+POLL_BACKOFF_FACTOR = 2
+
+NODE_STATE_URI = '/v1/info/state'
+TASK_URI = '/v1/task'
+# States of tasks that still hold on to splits; a draining server only shuts
+# down once none of its tasks is in one of these states.
+ACTIVE_TASK_STATES = ['PLANNED', 'RUNNING']
+
+# When there are several coordinator endpoints, the next one is tried if the
+# previous one hasn't accepted a connection after this many seconds.
+ENDPOINT_HEAD_START = 0.25
+ENDPOINT_CONNECT_TIMEOUT = 5
 
 CERTIFICATE_ALIAS = 'certificate_alias'
 
 
+class QueryDeadlineExceeded(Exception):
+    """
+    Raised internally when a query runs past the deadline given to run_sql,
+    and by the node requests when they run past their timeout.
+    """
+    pass
+
+
+def get_query_progress(stats):
+    """
+    Returns a one line summary of the 'stats' block of a Presto response.
+    """
+    return '%s, splits %s/%s, %.1fs elapsed, %s rows, %s bytes' % (
+        stats.get('state', 'UNKNOWN'), stats.get('completedSplits', 0),
+        stats.get('totalSplits', 0),
+        stats.get('elapsedTimeMillis', 0) / 1000.0,
+        stats.get('processedRows', 0), stats.get('processedBytes', 0))
+
+
+def race_endpoints(endpoints, timeout=ENDPOINT_CONNECT_TIMEOUT,
+                   head_start=ENDPOINT_HEAD_START):
+    """
+    Opens TCP connections to the (host, port) endpoints, starting them in
+    order and giving each one head_start seconds before starting the next.
+
+    Returns:
+        The first endpoint that accepted a connection, or None if none of
+        them did within timeout seconds.
+    """
+    results = Queue.Queue()
+
+    def probe(endpoint):
+        try:
+            socket.create_connection(endpoint, timeout).close()
+            results.put(endpoint)
+        except socket.error as e:
+            _LOGGER.info('Unable to connect to %s:%s: %s' %
+                         (endpoint[0], endpoint[1], e))
+            results.put(None)
+
+    not_started = list(endpoints)
+    running = 0
+    while not_started or running:
+        if not_started:
+            thread = threading.Thread(target=probe, args=(not_started.pop(0),))
+            thread.daemon = True
+            thread.start()
+            running += 1
+        try:
+            result = results.get(timeout=head_start if not_started else timeout)
+        except Queue.Empty:
+            if not_started:
+                continue
+            return None
+        running -= 1
+        if result:
+            return result
+    return None
+
+
 class PrestoClient:
-    def __init__(self, server, user, coordinator_config=None):
+    def __init__(self, server, user, coordinator_config=None,
+                 keep_alive=False):
+        """
+        Parameters:
+            server: Host of the coordinator, or a list of hosts (optionally
+                host:port) in order of preference, e.g. the coordinator
+                followed by a standby or a load balancer.
+            user: Presto user to run queries as
+            keep_alive: Reuse one HTTP connection for all the requests made
+                by this client instead of opening one per request.
+        """
         # immutable stuff
-        self.server = server
         self.user = user
         if (coordinator_config is None):
             coordinator_config = PrestoConfig.coordinator_config()
         self.coordinator_config = coordinator_config
-        self.port = PrestoClient._get_configured_port(self.coordinator_config)
+        configured_port = PrestoClient._get_configured_port(self.coordinator_config)
+        if isinstance(server, basestring):
+            server = [server]
+        self.endpoints = [PrestoClient._parse_endpoint(endpoint, configured_port)
+                          for endpoint in server]
+        if not self.endpoints:
+            self.endpoints = [('', configured_port)]
+        self.server, self.port = self.endpoints[0]
+        self.keep_alive = keep_alive
 
         # mutable stuff
         self.ca_file_path = ""
@@ -59,6 +160,11 @@ class PrestoClient:
         self.rows = []
         self.next_uri = ''
         self.response_from_server = {}
+        self.deadline = None
+        self.stats = {}
+        self.stats_callback = None
+        self.poll_delay = 0
+        self.connection = None
 
     @staticmethod
     def _remove_silently(path):
@@ -69,6 +175,56 @@ class PrestoClient:
 
     def close(self):
         PrestoClient._remove_silently(self.ca_file_path)
+        if self.connection is not None:
+            self._drop_connection(self.connection)
+
+    @staticmethod
+    def _parse_endpoint(endpoint, default_port):
+        if endpoint.count(':') == 1:
+            host, port = endpoint.split(':')
+            return host, int(port)
+        return endpoint, default_port
+
+    def _choose_endpoint(self, exclude=None):
+        """
+        Point the client at the endpoint that last answered or, if there is
+        none, at the first endpoint that accepts a connection.
+
+        Returns:
+            True if an endpoint was found, False otherwise
+        """
+        if len(self.endpoints) < 2:
+            return False
+
+        # The endpoint is remembered for the rest of the run, also by the
+        # jobs fabric forks
+        endpoint_cache = get_endpoint_cache()
+        endpoint = endpoint_cache.get(self.endpoints)
+        if endpoint is None or endpoint == exclude:
+            candidates = [e for e in self.endpoints if e != exclude]
+            timeout = min(ENDPOINT_CONNECT_TIMEOUT, self._get_socket_timeout())
+            endpoint = race_endpoints(candidates, timeout)
+            if endpoint is None:
+                endpoint_cache.forget(self.endpoints)
+                return False
+            _LOGGER.info('Using coordinator endpoint %s:%s' % endpoint)
+            endpoint_cache.put(self.endpoints, endpoint)
+
+        self.server, self.port = endpoint
+        return True
+
+    def _fail_over(self):
+        """
+        Forget the current endpoint and switch to another one that accepts
+        connections, if any.
+        """
+        if len(self.endpoints) < 2:
+            return False
+        failed = (self.server, self.port)
+        get_endpoint_cache().forget(self.endpoints)
+        _LOGGER.warn('Coordinator endpoint %s:%s failed, trying the others' %
+                     failed)
+        return self._choose_endpoint(exclude=failed)
 
     def _clear_old_results(self):
         if self.rows:
@@ -80,7 +236,13 @@ class PrestoClient:
         if self.response_from_server:
             self.response_from_server = {}
 
-    def run_sql(self, sql, schema="default", catalog="hive"):
+        if self.stats:
+            self.stats = {}
+
+        self.poll_delay = 0
+
+    def run_sql(self, sql, schema="default", catalog="hive", timeout=None,
+                stats_callback=None, cache=None, max_rows=NUM_ROWS):
         """
         Execute a query connecting to Presto server using passed parameters.
 
@@ -89,16 +251,172 @@ class PrestoClient:
             schema: Presto schema to be used while executing query
                 (default=default)
             catalog: Catalog to be used by the server
+            timeout: Number of seconds the whole query, including fetching
+                all of its results, may take. When the deadline passes the
+                query is cancelled on the server. (default=no deadline)
+            stats_callback: Function called with the 'stats' block of every
+                response from the server, e.g. to show the progress of long
+                queries. See get_query_progress for the fields of interest.
+            cache: QueryResultCache to look the result up in before running
+                the query and to store it in afterwards. Only meant for
+                queries against system tables whose results don't change
+                during a single presto-admin command. (default=no caching)
+            max_rows: Number of rows after which the rest of the result is
+                discarded, or None to return all the rows. (default=1000)
 
         Returns:
             list of rows or None if client was unable to connect to Presto
+            or the query did not finish before the deadline
+        """
+        if cache is not None:
+            coordinator = '%s:%s' % self.endpoints[0]
+            rows = cache.get(coordinator, self.user, catalog, schema, sql)
+            if rows is None:
+                rows = self._run_sql(sql, schema, catalog, timeout,
+                                     stats_callback, max_rows)
+                if rows is not None:
+                    cache.put(coordinator, self.user, catalog, schema, sql,
+                              rows)
+            return rows
+
+        return self._run_sql(sql, schema, catalog, timeout, stats_callback,
+                             max_rows)
+
+    def _run_sql(self, sql, schema, catalog, timeout, stats_callback,
+                 max_rows=NUM_ROWS):
+        self._set_deadline(timeout)
+        self.stats_callback = stats_callback
+
+        try:
+            self._choose_endpoint()
+            status = self._execute_query(sql, schema, catalog)
+            if not status and self._fail_over():
+                status = self._execute_query(sql, schema, catalog)
+            if status:
+                return self._get_rows(max_rows)
+            else:
+                return None
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        except QueryDeadlineExceeded:
+            _LOGGER.error('Query did not finish within %s seconds, '
+                          'cancelling it: %s' % (timeout, sql))
+            self.cancel()
+            return None
+
+    def cancel(self):
+        """
+        Cancel the query that is currently being executed, if any, by sending
+        a DELETE request to its 'nextUri'. Presto stops the query and frees
+        the resources it holds on the coordinator and workers.
+
+        Returns:
+            True if the server accepted the cancellation, False otherwise
+        """
+        uri = self._get_next_uri()
+        if not uri:
+            return False
+
+        self.next_uri = ''
+        # Cancelling is best effort and must not be cut short by the deadline
+        # that triggered it.
+        self.deadline = None
+        headers = {"X-Presto-User": self.user}
+        self._add_auth_headers(headers)
+        try:
+            response, _ = self._request("DELETE", uri, headers=headers)
+        except (HTTPException, socket.error) as e:
+            _LOGGER.warn('Unable to cancel query %s: %s' %
+                         (self.response_from_server.get(ID_RESP, uri), e))
+            return False
+
+        _LOGGER.info('Cancelled query %s, server responded with %s %s' %
+                     (self.response_from_server.get(ID_RESP, uri),
+                      response.status, response.reason))
+        return response.status in [200, 204]
+
+    def set_node_state(self, state, timeout=None):
         """
-        status = self._execute_query(sql, schema, catalog)
-        if status:
-            return self._get_rows()
+        Ask the server to move to another state, e.g. SHUTTING_DOWN to make
+        a worker finish its tasks, stop accepting new ones and shut itself
+        down.
+
+        Parameters:
+            timeout: Seconds the request may take (default=URL_TIMEOUT_MS)
+
+        Returns:
+            True if the server accepted the new state, False if it refused
+            it, e.g. because it is a coordinator or too old to support it
+
+        Raises:
+            HTTPException or socket.error if the server can't be reached,
+            QueryDeadlineExceeded if the timeout already passed
+        """
+        self._set_deadline(timeout)
+        headers = {"X-Presto-User": self.user,
+                   "Content-Type": "application/json"}
+        self._add_auth_headers(headers)
+        response, _ = self._request("PUT", NODE_STATE_URI, json.dumps(state),
+                                    headers)
+        if response.status != 200:
+            _LOGGER.warn('Server %s:%s refused state %s: %s %s' %
+                         (self.server, self.port, state, response.status,
+                          response.reason))
+            return False
+        return True
+
+    def get_active_task_count(self, timeout=None):
+        """
+        Returns the number of tasks on the server that are still planned or
+        running, or None if the server didn't list its tasks.
+
+        Parameters:
+            timeout: Seconds the request may take (default=URL_TIMEOUT_MS)
+
+        Raises:
+            HTTPException or socket.error if the server can't be reached,
+            QueryDeadlineExceeded if the timeout already passed
+        """
+        self._set_deadline(timeout)
+        headers = {"X-Presto-User": self.user}
+        self._add_auth_headers(headers)
+        response, answer = self._request("GET", TASK_URI, headers=headers)
+        if response.status != 200:
+            _LOGGER.warn('Unable to list tasks of server %s:%s: %s %s' %
+                         (self.server, self.port, response.status,
+                          response.reason))
+            return None
+        try:
+            tasks = json.loads(answer)
+            return len([task for task in tasks if
+                        task['taskStatus']['state'] in ACTIVE_TASK_STATES])
+        except (ValueError, KeyError, TypeError) as e:
+            _LOGGER.warn('Unexpected task list from server %s:%s: %s' %
+                         (self.server, self.port, e))
+            return None
+
+    def _set_deadline(self, timeout):
+        if timeout is None:
+            self.deadline = None
         else:
+            self.deadline = time.time() + timeout
+
+    def _remaining_time(self):
+        """
+        Returns the number of seconds left until the deadline of the current
+        query, or None if the query has no deadline.
+
+        Raises QueryDeadlineExceeded if the deadline has already passed.
+        """
+        if self.deadline is None:
             return None
 
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise QueryDeadlineExceeded()
+        return remaining
+
     def _execute_query(self, sql, schema, catalog):
         if not sql:
             raise InvalidArgumentError("SQL query missing")
@@ -120,23 +438,24 @@ class PrestoClient:
             _LOGGER.info("Connecting to server at: " + self.server +
                          ":" + str(self.port) + " as user " + self.user +
                          " to execute query " + sql)
-            conn = self._get_connection()
             self._add_auth_headers(headers)
-            conn.request("POST", "/v1/statement", sql, headers)
-            response = conn.getresponse()
+            response, answer = self._request("POST", "/v1/statement", sql,
+                                             headers)
 
             if response.status != 200:
-                conn.close()
                 _LOGGER.error("Connection error: " +
                               str(response.status) + " " + response.reason)
                 return False
 
-            answer = response.read()
-            conn.close()
-
             self.response_from_server = json.loads(answer)
             _LOGGER.info("Query executed successfully: %s" % (sql))
             return True
+        except socket.timeout:
+            if self.deadline is not None and time.time() >= self.deadline:
+                raise QueryDeadlineExceeded()
+            _LOGGER.error("Timed out connecting to presto server at: " +
+                          self.server + ":" + str(self.port))
+            return False
         except (HTTPException, socket.error) as e:
             _LOGGER.error("Error connecting to presto server at: " +
                           self.server + ":" + str(self.port) + ' ' + e.message)
@@ -146,33 +465,67 @@ class PrestoClient:
                           ' error from server: ' + answer)
             raise e
 
-    def _get_response_from(self, uri):
+    @staticmethod
+    def _get_location(uri):
         """
-        Sends a GET request to the Presto server at the specified next_uri
-        and updates the response
-
         Remove the scheme and host/port from the uri; the connection itself
         has that information.
         """
         parts = list(urlparse.urlsplit(uri))
         parts[0] = None
         parts[1] = None
-        location = urlparse.urlunsplit(parts)
+        return urlparse.urlunsplit(parts)
+
+    def _request(self, method, uri, body=None, headers=None):
+        """
+        Sends a request to the server and reads the whole response.
+
+        With keep_alive the connection stays open for the next request. If
+        the server has closed a kept-alive connection in the meantime, the
+        request is retried once on a new connection.
+
+        Returns:
+            tuple of the response and its body
+        """
+        reused = self.connection is not None
         conn = self._get_connection()
+        try:
+            conn.request(method, PrestoClient._get_location(uri), body,
+                         headers or {})
+            response = conn.getresponse()
+            answer = response.read()
+        except socket.timeout:
+            self._drop_connection(conn)
+            raise
+        except (HTTPException, socket.error):
+            self._drop_connection(conn)
+            if reused:
+                return self._request(method, uri, body, headers)
+            raise
+
+        if not self.keep_alive or response.will_close:
+            self._drop_connection(conn)
+        return response, answer
+
+    def _drop_connection(self, conn):
+        conn.close()
+        if conn is self.connection:
+            self.connection = None
+
+    def _get_response_from(self, uri):
+        """
+        Sends a GET request to the Presto server at the specified next_uri
+        and updates the response
+        """
         headers = {"X-Presto-User": self.user}
         self._add_auth_headers(headers)
-        conn.request("GET", location, headers=headers)
-        response = conn.getresponse()
+        response, answer = self._request("GET", uri, headers=headers)
 
         if response.status != 200:
-            conn.close()
             _LOGGER.error("Error making GET request to %s: %s %s" %
                           (uri, response.status, response.reason))
             return False
 
-        answer = response.read()
-        conn.close()
-
         self.response_from_server = json.loads(answer)
         _LOGGER.info("GET request successful for uri: " + uri)
         return True
@@ -182,9 +535,12 @@ class PrestoClient:
         Build result from the response
 
         The reponse_from_server may contain up to 3 uri's.
-        1. link to fetch the next packet of data ('nextUri')
+        1. link to fetch the next packet of data ('nextUri'), which is also
+           used to cancel the whole query (see cancel())
         2. TODO: information about the query execution ('infoUri')
-        3. TODO: cancel the query ('partialCancelUri').
+        3. link to cancel a single stage of the query ('partialCancelUri'),
+           which presto-admin does not need since it only ever cancels
+           whole queries.
         """
         if NEXT_URI_RESP in self.response_from_server:
             self.next_uri = self.response_from_server[NEXT_URI_RESP]
@@ -197,6 +553,48 @@ class PrestoClient:
             else:
                 self.rows = self.response_from_server[DATA_RESP]
 
+        self._update_stats()
+
+    def _update_stats(self):
+        """
+        Record the 'stats' block of the last response, pass it on to the
+        stats callback and adapt the polling delay to the query state.
+        """
+        if STATS_RESP not in self.response_from_server:
+            return
+
+        self.stats = self.response_from_server[STATS_RESP]
+        _LOGGER.debug('Query %s progress: %s' %
+                      (self.response_from_server.get(ID_RESP, ''),
+                       get_query_progress(self.stats)))
+        if self.stats_callback:
+            self.stats_callback(self.stats)
+
+        has_data = bool(self.response_from_server.get(DATA_RESP))
+        self.poll_delay = PrestoClient._next_poll_delay(
+            self.poll_delay, self.stats.get('state'), has_data)
+
+    @staticmethod
+    def _next_poll_delay(current_delay, state, has_data):
+        """
+        Back off exponentially while the query is waiting to run, and poll
+        again immediately once it returns data.
+        """
+        if has_data or state not in WAITING_QUERY_STATES:
+            return 0
+        if not current_delay:
+            return POLL_INITIAL_DELAY
+        return min(current_delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
+
+    def _wait_before_polling(self):
+        if not self.poll_delay:
+            return
+        remaining = self._remaining_time()
+        if remaining is None:
+            time.sleep(self.poll_delay)
+        else:
+            time.sleep(min(self.poll_delay, remaining))
+
     def _get_rows(self, num_of_rows=NUM_ROWS):
         """
         Get the rows returned from the query.
@@ -210,7 +608,11 @@ class PrestoClient:
         the results.
 
         Parameters:
-            num_of_rows: to be retrieved. 1000 by default
+            num_of_rows: to be retrieved. 1000 by default. None retrieves
+                all the rows. The client keeps following 'nextUri' after
+                that many rows so that the query can finish on the server,
+                but discards the remaining data, and returns no more than
+                that many rows.
         """
         if num_of_rows == 0:
             return []
@@ -221,20 +623,49 @@ class PrestoClient:
             return []
 
         while self._get_next_uri():
-            if not self._get_response_from(self._get_next_uri()):
-                return []
-            if (len(self.rows) <= num_of_rows):
-                self._build_results_from_response()
-        return self.rows
+            self._wait_before_polling()
+            try:
+                if not self._get_response_from(self._get_next_uri()):
+                    return []
+            except socket.timeout:
+                if self.deadline is not None and \
+                        time.time() >= self.deadline:
+                    raise QueryDeadlineExceeded()
+                raise
+            if num_of_rows is not None and len(self.rows) >= num_of_rows:
+                self.response_from_server.pop(DATA_RESP, None)
+            self._build_results_from_response()
+        if num_of_rows is None:
+            return self.rows
+        return self.rows[:num_of_rows]
 
     def _get_next_uri(self):
         return self.next_uri
 
     def _get_connection(self):
+        timeout = self._get_socket_timeout()
+        if self.connection is not None:
+            if (self.connection.host, self.connection.port) == \
+                    (self.server, self.port):
+                if self.connection.sock:
+                    self.connection.sock.settimeout(timeout)
+                return self.connection
+            self._drop_connection(self.connection)
+
         if self.coordinator_config.use_https():
-            return self._get_https_connection()
+            conn = self._get_https_connection(timeout)
         else:
-            return HTTPConnection(self.server, self.port, False, URL_TIMEOUT_MS)
+            conn = HTTPConnection(self.server, self.port, False, timeout)
+
+        if self.keep_alive:
+            self.connection = conn
+        return conn
+
+    def _get_socket_timeout(self):
+        remaining = self._remaining_time()
+        if remaining is None:
+            return URL_TIMEOUT_MS
+        return min(URL_TIMEOUT_MS, remaining)
 
     @staticmethod
     def _get_configured_port(coordinator_config):
@@ -243,10 +674,10 @@ class PrestoClient:
         else:
             return coordinator_config.get_http_port()
 
-    def _get_https_connection(self):
+    def _get_https_connection(self, timeout=URL_TIMEOUT_MS):
         ca_file_path = self._get_pem()
         result = HTTPSCaCertConnection(
-                self.server, self.port, None, None, ca_file_path, False, URL_TIMEOUT_MS)
+                self.server, self.port, None, None, ca_file_path, False, timeout)
         return result
 
     def _fetch_keystore_data(self):
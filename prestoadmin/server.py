@@ -19,40 +19,94 @@ using presto-admin
 import cgi
 import logging
 import re
+import socket
 import sys
+import time
 import urllib2
 import urlparse
 from contextlib import closing
+from httplib import HTTPException
 
 from fabric.api import task, sudo, env
 from fabric.context_managers import settings, hide
 from fabric.decorators import runs_once, with_settings, parallel
-from fabric.operations import run, os
+from fabric.operations import os
 from fabric.tasks import execute
 from fabric.utils import warn, error, abort
-from retrying import retry, RetryError
 
 import util.filesystem
-from prestoadmin import catalog
 from prestoadmin import configure_cmds
 from prestoadmin import package
-from prestoadmin.prestoclient import PrestoClient
+from prestoadmin.coordinator import Coordinator
+from prestoadmin.install_bundle import install_bundles
+from prestoadmin.prestoclient import PrestoClient, QueryDeadlineExceeded
 from prestoadmin.standalone.config import StandaloneConfig
-from prestoadmin.util import constants
 from prestoadmin.util.base_config import requires_config
-from prestoadmin.util.exception import ConfigFileNotFoundError, ConfigurationError
-from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role
+from prestoadmin.util.chunked_upload import format_throughput, prepare_chunks
+from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role, \
+    get_coordinator_endpoints
+from prestoadmin.util import preflight as preflight_checks
+from prestoadmin.util.host_facts import get_presto_rpm_version, \
+    get_presto_package, get_facts_of_hosts, NODE_CONFIG_FILE, \
+    GENERAL_CONFIG_FILE, PRESTO_RPM_NAMES, JVM_CONFIG, CONFIG_PROPERTIES
 from prestoadmin.util.local_config_util import get_catalog_directory
-from prestoadmin.util.remote_config_util import lookup_port, \
+from prestoadmin.util.node_watcher import NodeListWatcher
+from prestoadmin.util.output_format import get_output_format, \
+    print_records, elapsed_ms, TEXT
+from prestoadmin.util.presto_config import PrestoConfig, HTTP_PORT_KEY
+from prestoadmin.util.query_cache import get_query_cache
+from prestoadmin.util.ranged_download import download_in_ranges, supports_ranges, \
+    RangesNotSupportedError, DEFAULT_RANGE_COUNT
+from prestoadmin.util.rpm_cache import RpmCache
+from prestoadmin.util.status_board import StatusBoard, format_duration, \
+    format_bytes
+from prestoadmin.util.remote_config_util import \
     lookup_server_log_file, lookup_launcher_log_file, lookup_string_config
 from prestoadmin.util.version_util import VersionRange, VersionRangeList, \
     split_version, strip_tag
+from prestoadmin.workers import Worker
 
 __all__ = ['install', 'uninstall', 'upgrade', 'start', 'stop', 'restart',
-           'status']
+           'status', 'preflight']
 
 INIT_SCRIPTS = '/etc/init.d/presto'
+# Every name the Presto package has been released under, in the order in
+# which uninstall looks for them
+UNINSTALL_RPM_NAMES = ['presto', 'presto-server', 'presto-server-rpm']
+START_MARKER = '#presto-admin:'
+# Checks that Presto is installed and its HTTP port is free, and if so
+# starts it, reporting each step on a line starting with START_MARKER. A
+# port that isn't configured defaults to 8080; one that isn't a number or
+# a config.properties that can't be read skip the port check.
+START_SCRIPT = '''set -m
+version=$(rpm -q --qf '%%{VERSION}\\n' %(rpm_names)s 2>/dev/null |
+  grep -v 'not installed' | head -n 1)
+echo "%(marker)sversion=$version"
+if [ -n "$version" ]; then
+  port=''
+  if [ -r %(config)s ]; then
+    port=$(sed -n 's/^[[:space:]]*http-server\\.http\\.port[[:space:]]*[=:]//p' \\
+      %(config)s | tail -n 1 | tr -d '[:space:]')
+    case "$port" in
+      '') port=8080 ;;
+      *[!0-9]*) port='' ;;
+    esac
+  fi
+  echo "%(marker)sport=$port"
+  if [ -n "$port" ] && netstat -ln | grep -E "\\<$port\\>" | grep -q LISTEN; then
+    echo '%(marker)sport_in_use=1'
+  else
+    %(init)s start
+    echo "%(marker)sstart_exit_code=$?"
+  fi
+fi''' % {
+    'rpm_names': ' '.join(PRESTO_RPM_NAMES), 'marker': START_MARKER,
+    'config': GENERAL_CONFIG_FILE, 'init': INIT_SCRIPTS}
 RETRY_TIMEOUT = 120
+DRAIN_TIMEOUT = 300
+DRAIN_POLL_INTERVAL = 1
+SHUTTING_DOWN = 'SHUTTING_DOWN'
 SYSTEM_RUNTIME_NODES = 'select * from system.runtime.nodes'
 
 
@@ -67,22 +121,52 @@ def new_sysnode_processor(node_info_rows):
     return get_sysnode_info_from(node_info_rows, lambda x: x)
 
 
-NODE_INFO_PER_URI_SQL = VersionRangeList(
+NODE_INFO_SQL = VersionRangeList(
     VersionRange((0, 0), (0, 128),
-                 ('select http_uri, node_version, active from '
-                  'system.runtime.nodes where '
-                  'url_extract_host(http_uri) = \'%s\'',
+                 ('select node_id, http_uri, node_version, active from '
+                  'system.runtime.nodes',
                   old_sysnode_processor)),
     VersionRange((0, 128), (sys.maxsize,),
-                 ('select http_uri, node_version, state from '
-                  'system.runtime.nodes where '
-                  'url_extract_host(http_uri) = \'%s\'',
+                 ('select node_id, http_uri, node_version, state from '
+                  'system.runtime.nodes',
                   new_sysnode_processor))
 )
 
-EXTERNAL_IP_SQL = 'select url_extract_host(http_uri) from ' \
-                  'system.runtime.nodes WHERE node_id = \'%s\''
 CATALOG_INFO_SQL = 'select catalog_name from system.metadata.catalogs'
+# Fields of the machine readable output of server status
+STATUS_FIELDS = ['host', 'roles', 'running', 'node_id', 'external_ip',
+                 'node_uri', 'presto_version', 'node_state', 'catalogs',
+                 'error', 'coordinator_query_ms', 'host_probe_ms']
+
+# Everything server status --watch shows about the nodes, fetched with one
+# query per refresh. The uptime and the memory used by queries come from the
+# jmx catalog, if the cluster has one.
+WATCH_STATE_COLUMN = VersionRangeList(
+    VersionRange((0, 0), (0, 128),
+                 ('active', lambda active: 'active' if active else 'inactive')),
+    VersionRange((0, 128), (sys.maxsize,), ('state', lambda state: state))
+)
+WATCH_SQL = ('select n.node_id, n.node_version, n.%(state)s, '
+             'coalesce(t.running_tasks, 0)%(jmx_columns)s '
+             'from system.runtime.nodes n '
+             'left join (select node_id, count(*) as running_tasks '
+             'from system.runtime.tasks where state = \'RUNNING\' '
+             'group by node_id) t on n.node_id = t.node_id%(jmx_joins)s')
+# Name, expression and join of each column from the jmx catalog. The jmx
+# connector only has columns for attributes of primitive types, so the heap
+# usage, a MemoryUsage composite, can't be queried; the general memory pool
+# tells how much memory the queries use instead.
+WATCH_JMX_COLUMNS = [
+    ('uptime', 'r.uptime',
+     ' left join jmx.current."java.lang:type=runtime" r '
+     'on n.node_id = r.node'),
+    ('memory_used', 'p.maxbytes - p.freebytes',
+     ' left join jmx.current."com.facebook.presto.memory:type=memorypool,'
+     'name=general" p on n.node_id = p.node')
+]
+WATCH_QUERY_TIMEOUT = 10
+DEFAULT_WATCH_INTERVAL = 2
+WATCH_LINE_FORMAT = '%-*s  %-19s  %-14s  %-26s  %12s  %5s  %9s'
 _LOGGER = logging.getLogger(__name__)
 
 DOWNLOAD_DIRECTORY = '/tmp'
@@ -90,6 +174,9 @@ DEFAULT_RPM_NAME = 'presto-server-rpm.rpm'
 LATEST_RPM_URL = 'https://repository.sonatype.org/service/local/artifact/maven' \
                  '/content?r=central-proxy&g=com.facebook.presto' \
                  '&a=presto-server-rpm&e=rpm&v=RELEASE'
+# How long the rpm downloaded for 'latest' is used before checking for a
+# newer release
+LATEST_RPM_MAX_AGE = 24 * 60 * 60
 
 
 class LocalPrestoRpmFinder:
@@ -173,6 +260,9 @@ class UrlHandler:
             # the 'Content-Length' header
             return None
 
+    def get_header(self, name):
+        return self.url_response.info().get(name)
+
     def get_download_file_name(self, version=None):
         try:
             headers = self.url_response.info()
@@ -196,13 +286,29 @@ class UrlHandler:
 
 
 class PrestoRpmDownloader:
-    def __init__(self, url_handler):
+    def __init__(self, url_handler, download_directory=DOWNLOAD_DIRECTORY,
+                 range_count=DEFAULT_RANGE_COUNT):
         self.url_handler = url_handler
+        self.download_directory = download_directory
+        self.range_count = range_count
 
     def download_rpm(self, version=None):
         content_length = self.url_handler.get_content_length()
         download_file_path = self.get_download_file_path(version)
 
+        if content_length and supports_ranges(self.url_handler.get_header('Accept-Ranges')):
+            try:
+                stats = download_in_ranges(
+                    self.url_handler.get_url(), download_file_path, content_length, self.range_count,
+                    self.url_handler.get_header('ETag') or self.url_handler.get_header('Last-Modified'),
+                    self.print_download_status)
+                print('Downloaded %d bytes in %d ranges, %s' % (
+                    stats['bytes_read'], stats['ranges'], format_throughput(stats['bytes_read'], stats['seconds'])))
+                print('Rpm downloaded to: %s' % download_file_path)
+                return download_file_path
+            except RangesNotSupportedError:
+                print('The server does not support range requests, downloading the rpm in one stream')
+
         with open(download_file_path, 'wb') as local_file:
             bytes_read = 0
             block_size = 16 * 1024 * 1024
@@ -219,7 +325,7 @@ class PrestoRpmDownloader:
         return download_file_path
 
     def get_download_file_path(self, version=None):
-        return os.path.join(DOWNLOAD_DIRECTORY, self.url_handler.get_download_file_name(version))
+        return os.path.join(self.download_directory, self.url_handler.get_download_file_name(version))
 
     @staticmethod
     def print_download_status(bytes_read, content_length):
@@ -280,32 +386,52 @@ class PrestoRpmFetcher:
                       version attached to its name (presto-server-rpm-'version'.rpm)
                       rather than the default name
 
-        If downloading the presto rpm at the given url would overwrite an existing rpm,
-        this function returns the path to the existing rpm. However, if the rpm that
-        would be downloaded takes the default rpm name, it will overwrite the existing
-        rpm because there is no way to know if the default rpm name is of the same version
-        as the requested rpm. If the rpm is corrupted, this function will remove the corrupted
-        rpm and attempt to download it.
+        The rpm is looked up in the local rpm cache first, by version if one is given and
+        otherwise by url, without going to the network. The rpm cached for the url of the
+        latest release is only used for LATEST_RPM_MAX_AGE seconds. Cached rpms that are
+        corrupted are removed from the cache and downloaded again. Downloaded rpms are
+        checked before they are added to the cache.
 
         Returns:
             The path to the downloaded or found presto rpm
         """
+        rpm_cache = RpmCache()
+        cached_rpm = None
+        if version:
+            cached_rpm = PrestoRpmFetcher._lookup_uncorrupted_rpm(rpm_cache, version=version)
+        if not cached_rpm:
+            max_age = LATEST_RPM_MAX_AGE if url == LATEST_RPM_URL else None
+            cached_rpm = PrestoRpmFetcher._lookup_uncorrupted_rpm(rpm_cache, url=url, max_age=max_age)
+        if cached_rpm:
+            print('Found and using presto rpm in the local rpm cache: %s' % cached_rpm)
+            return cached_rpm
+
         with UrlHandler(url) as url_handler:
-            downloader = PrestoRpmDownloader(url_handler)
+            util.filesystem.ensure_directory_exists(rpm_cache.cache_dir)
+            downloader = PrestoRpmDownloader(url_handler, rpm_cache.cache_dir)
             download_file_path = downloader.get_download_file_path(version)
-            local_finder = LocalPrestoRpmFinder(download_file_path)
-            local_rpm_path = local_finder.find_local_presto_rpm()
-            if local_rpm_path and os.path.basename(local_rpm_path) != DEFAULT_RPM_NAME:
-                print('Found and using local presto rpm at path: %s\n'
-                      'Delete the existing rpm to force a new download' % local_rpm_path)
-                return local_rpm_path
-            elif local_rpm_path:
-                print('Found local presto rpm at path: %s\n'
-                      'The rpm has the default name, so it will not be used' % local_rpm_path)
             print('Downloading rpm from %s\n'
                   'to %s\n'
                   'This can take a few minutes' % (url_handler.get_url(), download_file_path))
-            return downloader.download_rpm(version)
+            download_file_path = downloader.download_rpm(version)
+            # A download that was cut short or resumed badly is removed and not cached
+            if not LocalPrestoRpmFinder._check_rpm_uncorrupted(download_file_path):
+                abort('The rpm downloaded from %s is corrupted. Try downloading the RPM again.'
+                      % url_handler.get_url())
+            return rpm_cache.add(download_file_path, url, version)
+
+    @staticmethod
+    def _lookup_uncorrupted_rpm(rpm_cache, **criteria):
+        """
+        Returns the rpm found in rpm_cache with criteria, see RpmCache.lookup, after removing
+        the corrupted rpms that match them, or None if there is none. The check is recorded
+        in the VerificationCache, so an rpm is only checked again after it changes.
+        """
+        while True:
+            cached_rpm = rpm_cache.lookup(**criteria)
+            if not cached_rpm or LocalPrestoRpmFinder._check_rpm_uncorrupted(cached_rpm):
+                return cached_rpm
+            rpm_cache.remove(cached_rpm)
 
     def get_path_to_presto_rpm(self):
         """
@@ -338,6 +464,9 @@ def install(rpm_specifier):
     Copy and install the presto-server rpm to all the nodes in the cluster and
     configure the nodes.
 
+    Each node gets a single bundle with the rpm, its configuration, the
+    catalog configurations and a script that installs them all.
+
     The topology information will be read from the config.json file. If this
     file is missing, then the coordinator and workers will be obtained
     interactively. Install will fail for invalid json configuration.
@@ -366,49 +495,140 @@ def install(rpm_specifier):
                         to be a url to download, it will be interpreted as such and will never be
                         interpreted as a version number or a local path.
 
-                        Before downloading an rpm, install will attempt to find a local
-                        copy with a matching version number to the requested rpm. If such
-                        a match is found, it will use the local copy instead of downloading
-                        the rpm again.
+                        Downloaded rpms are kept in a local cache under
+                        ~/.prestoadmin/rpm_cache. Before downloading an rpm, install looks
+                        in the cache for an rpm with the requested version, or downloaded
+                        from the requested url, and uses it instead of downloading the rpm
+                        again. The rpm cached for 'latest' is used for a day.
 
         --nodeps -      (optional) Flag to indicate if server install
                         should ignore checking Presto rpm package
                         dependencies. Equivalent to adding --nodeps
                         flag to rpm -i.
+        --tree -        (optional) Copy the rpm to a few nodes only and
+                        let the nodes relay it to each other.
+        --seed-count -  (optional) Number of nodes to copy the rpm to
+                        with --tree. Defaults to 2.
+        --pull -        (optional) Serve the rpm over HTTP from this host
+                        and let the nodes download it with curl.
+        --pull-concurrency - (optional) Number of nodes downloading the
+                        rpm at the same time with --pull. Defaults to 10.
+        --skip-preflight - (optional) Install even if the preflight
+                        checks fail. See server preflight.
     """
     rpm_fetcher = PrestoRpmFetcher(rpm_specifier)
     path_to_rpm = rpm_fetcher.get_path_to_presto_rpm()
     package.check_if_valid_rpm(path_to_rpm)
-    return execute(deploy_install_configure, path_to_rpm, hosts=get_host_list())
+    check_preflight(path_to_rpm, keep_config=False)
+    add_tpch_catalog()
+    package.distribute_if_requested(path_to_rpm)
+    return install_bundles(path_to_rpm, get_host_list())
 
 
-def deploy_install_configure(local_path):
-    package.deploy_install(local_path)
-    update_configs()
-    wait_for_presto_user()
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def preflight(local_path=None):
+    """
+    Check that the nodes are ready for a Presto install or upgrade
+
+    Checks every node with a single remote command, and prints the results
+    as a table with a row per node. install and upgrade run the same checks
+    before copying the rpm to the nodes, and stop if any of them fails.
+
+    The checks are:
+        java -      Java 8 is found in java8_home, if config.json sets it,
+                    or where the rpm looks for it
+        disk -      There is room for the rpm in /opt/prestoadmin/packages
+                    and /usr/lib/presto, and 1GB to spare on every
+                    filesystem, including the one of /var/lib/presto
+        memory -    The node has more memory than the -Xmx of jvm.config
+        port -      No other program listens on http-server.http.port
+        uuidgen -   uuidgen is installed, to generate the node.id
+        user -      The presto user exists if Presto is installed
+
+    Nodes where Presto is installed are checked with their current
+    configuration, which upgrade keeps, and the other nodes with the
+    configuration install would deploy.
 
+    Parameters:
+        local_path - (optional) Path to the rpm to check the disk space for
+    """
+    failed_hosts = run_preflight(local_path)
+    if failed_hosts:
+        abort('Preflight checks failed on %s' % ', '.join(failed_hosts))
 
-def add_tpch_catalog():
-    tpch_catalog_config = os.path.join(get_catalog_directory(), 'tpch.properties')
-    util.filesystem.write_to_file_if_not_exists('connector.name=tpch', tpch_catalog_config)
 
+def check_preflight(local_path, keep_config):
+    if env.get('skip_preflight'):
+        return
+    failed_hosts = run_preflight(local_path, keep_config)
+    if failed_hosts:
+        abort('Preflight checks failed on %s. Fix the problems above, or '
+              'rerun with --skip-preflight to go ahead anyway.'
+              % ', '.join(failed_hosts))
 
-def update_configs():
-    configure_cmds.deploy()
 
-    add_tpch_catalog()
-    try:
-        catalog.add()
-    except ConfigFileNotFoundError:
-        _LOGGER.info('No catalog directory found, not adding catalogs.')
+def run_preflight(local_path=None, keep_config=None):
+    """
+    Runs the preflight checks on all the hosts, probing the hosts in
+    parallel, and prints the results.
 
+    Parameters:
+        keep_config: Whether Presto will run with the configuration on the
+            hosts rather than the local one; by default, the hosts where
+            Presto is installed keep theirs
 
-@retry(stop_max_delay=3000, wait_fixed=250)
-def wait_for_presto_user():
-    ret = sudo('getent passwd presto', quiet=True)
-    if not ret.succeeded:
-        raise Exception('Presto package was not installed successfully. '
-                        'Presto user was not created.')
+    Returns:
+        The hosts with a failed check
+    """
+    hosts = get_host_list()
+    facts_of_hosts = get_facts_of_hosts(hosts)
+    rpm_size = os.path.getsize(local_path) if local_path else 0
+    local_confs = {}
+    results = {}
+    for host in hosts:
+        facts = facts_of_hosts[host]
+        host_keeps_config = keep_config
+        if keep_config is None:
+            host_keeps_config = bool(facts) and \
+                preflight_checks.is_presto_installed(facts)
+        jvm_options, http_port = get_preflight_conf(
+            host, facts, host_keeps_config, local_confs)
+        results[host] = preflight_checks.check_host(
+            facts, jvm_options, http_port, env.get('java8_home'), rpm_size)
+    print('Preflight checks:')
+    print(preflight_checks.format_results(hosts, results))
+    return preflight_checks.failed_hosts(results)
+
+
+def get_preflight_conf(host, facts, keep_config, local_confs):
+    """
+    Returns the jvm.config options and the http port Presto will run with
+    on host: from its current configuration if it keeps it and it can be
+    read, otherwise from the local configuration of its role, which is
+    read once into local_confs.
+    """
+    if keep_config and facts and facts[JVM_CONFIG] is not None and \
+            facts[CONFIG_PROPERTIES] is not None:
+        jvm_options = facts[JVM_CONFIG]
+        config_properties = facts[CONFIG_PROPERTIES]
+    else:
+        is_coordinator = host in get_coordinator_role()
+        if is_coordinator not in local_confs:
+            node = Coordinator() if is_coordinator else Worker()
+            local_confs[is_coordinator] = node.get_conf()
+        jvm_options = local_confs[is_coordinator]['jvm.config']
+        config_properties = local_confs[is_coordinator]['config.properties']
+    http_port = str(config_properties.get(HTTP_PORT_KEY, '')).strip()
+    if not http_port.isdigit():
+        return jvm_options, preflight_checks.DEFAULT_HTTP_PORT
+    return jvm_options, int(http_port)
+
+
+def add_tpch_catalog():
+    tpch_catalog_config = os.path.join(get_catalog_directory(), 'tpch.properties')
+    util.filesystem.write_to_file_if_not_exists('connector.name=tpch', tpch_catalog_config)
 
 
 @task
@@ -425,17 +645,14 @@ def uninstall():
     """
     stop()
 
-    if package.is_rpm_installed('presto'):
-        package.rpm_uninstall('presto')
-    elif package.is_rpm_installed('presto-server'):
-        package.rpm_uninstall('presto-server')
-    elif package.is_rpm_installed('presto-server-rpm'):
-        package.rpm_uninstall('presto-server-rpm')
-    else:
+    presto_package = get_presto_package(env.host, UNINSTALL_RPM_NAMES)
+    if presto_package is None:
         abort('Unable to uninstall package on: ' + env.host)
+    package.rpm_uninstall(presto_package['name'])
 
 
 @task
+@runs_once
 @requires_config(StandaloneConfig)
 def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
     """
@@ -446,10 +663,11 @@ def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
     Unlike install, there is no provision to supply topology information
     interactively.
 
-    The existing cluster configuration is collected from the nodes on the
-    cluster and stored on the host running presto-admin. After the
-    presto-server packages have been upgraded, presto-admin pushes the
-    collected configuration back out to the hosts on the cluster.
+    The new rpm is copied to all the nodes and verified, and the existing
+    configuration is saved on each node, while the servers keep running.
+    Only then is each server stopped, the rpm upgraded and the saved
+    configuration restored. Servers that were running before the upgrade
+    are started again, and the time each was down is reported at the end.
 
     Note that the configuration files in the presto-admin configuration
     directory are not updated during upgrade.
@@ -466,56 +684,198 @@ def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
                                 should ignore checking Presto rpm package
                                 dependencies. Equivalent to adding --nodeps
                                 flag to rpm -U.
+    :param --drain -            (optional) Let the workers finish their
+                                running tasks before stopping them for the
+                                upgrade. See server stop.
+    :param --drain-timeout -    (optional) Seconds to wait for a worker to
+                                drain with --drain. Defaults to 300.
+    :param --rolling -          (optional) Upgrade the running workers a
+                                batch at a time, and the coordinator last.
+                                See server restart for --batch-size,
+                                --pause and --abort-threshold.
+    :param --tree -             (optional) Copy the rpm to a few nodes only
+                                and let the nodes relay it to each other.
+                                See server install.
+    :param --pull -             (optional) Let the nodes download the rpm
+                                over HTTP from this host. See server
+                                install.
+    :param --skip-preflight -   (optional) Upgrade even if the preflight
+                                checks fail. See server preflight.
     """
-    stop()
+    hosts = get_host_list()
+    package.check_if_valid_rpm(new_rpm_path)
+    check_preflight(new_rpm_path, keep_config=True)
+    package.distribute_if_requested(new_rpm_path)
+    prepare_chunks(new_rpm_path)
+    staged = execute(stage_upgrade, new_rpm_path, hosts=hosts)
+    unstaged_hosts = [host for host in hosts
+                      if isinstance(staged.get(host), BaseException)]
+    if unstaged_hosts:
+        abort('Could not stage the upgrade on %s. No server was stopped.' %
+              ', '.join(unstaged_hosts))
+
+    rpm_name = os.path.basename(new_rpm_path)
+    stopped_hosts = [host for host in hosts if not staged[host]['running']]
+    running_hosts = [host for host in hosts if staged[host]['running']]
+    if stopped_hosts:
+        execute(upgrade_server, rpm_name, staged, hosts=stopped_hosts)
+    downtimes = {}
+    if running_hosts and env.get('rolling'):
+        downtimes = run_in_batches(
+            upgrade_server, [rpm_name, staged, True], 'Upgrading',
+            'rolling upgrade', env.get('batch_size', 1), env.get('pause', 0),
+            env.get('abort_threshold', 0), running_hosts)
+    elif running_hosts:
+        downtimes = execute(upgrade_server, rpm_name, staged,
+                            hosts=running_hosts)
+    print_downtimes(downtimes)
+    return downtimes
+
+
+def stage_upgrade(new_rpm_path):
+    """
+    Copies the new rpm to env.host, verifies it and saves the
+    configuration, without touching the running server.
+
+    Returns:
+        Dict with the path of the saved configuration archive on env.host
+        under 'config_tar', and under 'running' whether the server is
+        running
+    """
+    package.deploy(new_rpm_path)
+    package.check_remote_rpm(new_rpm_path)
+    config_tar = configure_cmds.gather_config_directory()
+    running = sudo('set -m; ' + INIT_SCRIPTS + ' status', quiet=True)
+    return {'config_tar': config_tar, 'running': running.succeeded}
 
-    temp_config_tar = configure_cmds.gather_config_directory()
 
-    package.deploy_upgrade(new_rpm_path)
+def upgrade_server(rpm_name, staged, require_active=False):
+    """
+    Stops the server on env.host, upgrades it to the rpm staged by
+    stage_upgrade and restores its configuration. A server that was
+    running before is started again.
 
-    configure_cmds.deploy_config_directory(temp_config_tar)
+    Returns:
+        The number of seconds the server was down, or None if it was not
+        running before the upgrade or didn't come back up
+    """
+    service('stop')
+    # The downtime starts once the server is stopped, after any drain
+    since = time.time()
+    package.rpm_upgrade(rpm_name)
+    configure_cmds.deploy_config_directory(staged[env.host]['config_tar'])
+    if not staged[env.host]['running']:
+        return None
+    if start_presto():
+        return check_status_for_control_commands(since, require_active)
+
+
+def print_downtimes(downtimes):
+    if not downtimes:
+        return
+    print('Downtime per node:')
+    for host in sorted(downtimes):
+        downtime = downtimes[host]
+        if downtime is None or isinstance(downtime, BaseException):
+            print('    %s: did not come back up' % host)
+        else:
+            print('    %s: %.1f seconds' % (host, downtime))
 
 
 def service(control=None):
+    if control == 'start':
+        return start_presto()
     if check_presto_version() != '':
         return False
-    if control == 'start' and is_port_in_use(env.host):
-        return False
+    if control == 'stop' and env.get('drain'):
+        drain_server(env.get('drain_timeout', DRAIN_TIMEOUT))
     _LOGGER.info('Executing %s on presto server' % control)
     ret = sudo('set -m; ' + INIT_SCRIPTS + ' ' + control)
     return ret.succeeded
 
 
-def check_status_for_control_commands():
+def check_status_for_control_commands(since=None, require_active=False):
+    """
+    Waits for the server on env.host to come up and reports whether it did.
+    With require_active, the server only counts as up once the coordinator
+    lists it as active.
+
+    Returns:
+        The number of seconds it took the server to come up after since,
+        or None if it didn't within RETRY_TIMEOUT
+    """
     print('Waiting to make sure we can connect to the Presto server on %s, '
           'please wait. This check will time out after %d minutes if the '
           'server does not respond.'
           % (env.host, (RETRY_TIMEOUT / 60)))
-    if check_server_status():
+    time_to_ready = wait_for_server(since, require_active)
+    if time_to_ready is not None:
         print('Server started successfully on: ' + env.host)
     else:
         warn('Could not verify server status for: ' + env.host +
              '\nThis could mean that the server failed to start or that there was no coordinator or worker up. '
              'Please check ' + lookup_server_log_file(env.host) + ' and ' +
              lookup_launcher_log_file(env.host))
+    return time_to_ready
 
 
-def is_port_in_use(host):
-    _LOGGER.info("Checking if port used by Prestoserver is already in use..")
-    try:
-        portnum = lookup_port(host)
-    except Exception:
-        _LOGGER.info("Cannot find port from config.properties. "
-                     "Skipping check for port already being used")
-        return 0
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        output = run('netstat -ln |grep -E "\<%s\>" |grep LISTEN' % str(portnum))
-    if output:
+def start_presto():
+    """
+    Starts the server on env.host unless Presto isn't installed or its port
+    is taken. The checks and the start run as one remote script, so
+    starting a server costs a single round trip.
+
+    Returns:
+        True if the init script started the server
+    """
+    with settings(hide('stdout', 'running'), warn_only=True):
+        output = sudo(START_SCRIPT)
+    _LOGGER.info('Start script output on %s: %s' % (env.host, output))
+    result = parse_start_output(output)
+
+    if not result['version']:
+        warn('Presto is not installed.')
+        return False
+    if result['port_in_use']:
         _LOGGER.info("Presto server port already in use. Skipping "
                      "server start...")
         error('Server failed to start on %s. Port %s already in use'
-              % (env.host, str(portnum)))
-    return output
+              % (env.host, result['port']))
+        return False
+    if not result['port']:
+        _LOGGER.info("Cannot find port from config.properties. "
+                     "Skipped check for port already being used")
+    if result['start_exit_code'] != 0:
+        warn('Presto init script failed to start the server on %s:\n%s'
+             % (env.host, '\n'.join(result['output'])))
+        return False
+    return True
+
+
+def parse_start_output(output):
+    """
+    Returns:
+        A dict with the installed version ('' if Presto isn't installed),
+        the port checked ('' if it couldn't be determined), whether the
+        port is in use, the exit code of the init script (None if it didn't
+        run) and the other lines of output
+    """
+    result = {'version': '', 'port': '', 'port_in_use': False,
+              'start_exit_code': None, 'output': []}
+    for line in output.splitlines():
+        if not line.startswith(START_MARKER):
+            result['output'].append(line)
+            continue
+        key, _, value = line[len(START_MARKER):].partition('=')
+        value = value.strip()
+        if key == 'port_in_use':
+            result['port_in_use'] = value == '1'
+        elif key == 'start_exit_code':
+            result['start_exit_code'] = int(value) if value.isdigit() \
+                else None
+        elif key in result:
+            result[key] = value
+    return result
 
 
 @task
@@ -528,7 +888,7 @@ def start():
     servers that did not start, if any, are reported at the end.
     """
     if service('start'):
-        check_status_for_control_commands()
+        return check_status_for_control_commands(time.time())
 
 
 @task
@@ -536,22 +896,89 @@ def start():
 def stop():
     """
     Stop the Presto server on all nodes
+
+    Parameters:
+        --drain -               (optional) Let the workers finish their
+                                running tasks before stopping them. Each
+                                worker stops accepting new tasks and is
+                                stopped once it has none left, or when the
+                                drain timeout passes.
+        --drain-timeout -       (optional) Seconds to wait for a worker to
+                                drain with --drain. Defaults to 300.
     """
     service('stop')
 
 
+def drain_server(timeout=DRAIN_TIMEOUT):
+    """
+    Puts the worker on env.host into the SHUTTING_DOWN state, in which it
+    takes no new tasks, and waits until its active tasks are done.
+    Coordinators can't be drained and are left alone.
+
+    Returns:
+        True if the worker drained within timeout seconds, False otherwise
+    """
+    if env.host in get_coordinator_role():
+        return False
+
+    deadline = time.time() + timeout
+    with closing(PrestoClient(env.host, env.user,
+                              PrestoConfig.node_config(env.host))) as client:
+        # Every request only gets the time left to drain; one that runs out
+        # of it means the drain timed out, not that the server is gone
+        try:
+            if not client.set_node_state(SHUTTING_DOWN,
+                                         timeout=deadline - time.time()):
+                warn('Could not drain the server on %s, stopping it right '
+                     'away' % env.host)
+                return False
+        except (QueryDeadlineExceeded, socket.timeout):
+            return warn_drain_timed_out(timeout)
+        except (HTTPException, socket.error) as e:
+            _LOGGER.info('Not draining the server on %s, it is not '
+                         'reachable: %s' % (env.host, e))
+            return False
+
+        print('Draining the server on %s, waiting up to %d seconds for its '
+              'tasks to finish' % (env.host, timeout))
+        while True:
+            try:
+                active_tasks = client.get_active_task_count(
+                    timeout=deadline - time.time())
+            except (QueryDeadlineExceeded, socket.timeout):
+                return warn_drain_timed_out(timeout)
+            except (HTTPException, socket.error):
+                # A drained worker shuts itself down
+                active_tasks = 0
+            if active_tasks == 0:
+                print('Server drained on ' + env.host)
+                return True
+            if time.time() >= deadline:
+                warn('The server on %s still has active tasks after %d '
+                     'seconds, stopping it anyway' % (env.host, timeout))
+                return False
+            time.sleep(min(DRAIN_POLL_INTERVAL,
+                           max(0, deadline - time.time())))
+
+
+def warn_drain_timed_out(timeout):
+    warn('The server on %s did not drain within %d seconds, stopping it '
+         'anyway' % (env.host, timeout))
+    return False
+
+
 def stop_and_start():
     if check_presto_version() != '':
         return False
+    if env.get('drain'):
+        drain_server(env.get('drain_timeout', DRAIN_TIMEOUT))
     sudo('set -m; ' + INIT_SCRIPTS + ' stop')
-    if is_port_in_use(env.host):
-        return False
     _LOGGER.info('Executing start on presto server')
-    ret = sudo('set -m; ' + INIT_SCRIPTS + ' start')
-    return ret.succeeded
+    return start_presto()
 
 
 @task
+@runs_once
 @requires_config(StandaloneConfig)
 def restart():
     """
@@ -559,9 +986,100 @@ def restart():
 
     A status check is performed on the entire cluster and a list of
     servers that did not start, if any, are reported at the end.
+
+    Parameters:
+        --rolling -             (optional) Restart the workers a batch at a
+                                time instead of all at once, waiting for
+                                each batch to be active before restarting
+                                the next one. The coordinator is restarted
+                                last, on its own.
+        --batch-size -          (optional) Number of workers to restart at
+                                once with --rolling. Defaults to 1.
+        --pause -               (optional) Seconds to wait between batches
+                                with --rolling. Defaults to 0.
+        --abort-threshold -     (optional) Number of servers that may fail
+                                to come back with --rolling before the
+                                restart is stopped. Defaults to 0.
+        --drain -               (optional) Let the workers finish their
+                                running tasks before stopping them. See
+                                server stop.
+        --drain-timeout -       (optional) Seconds to wait for a worker to
+                                drain with --drain. Defaults to 300.
     """
+    if env.get('rolling'):
+        return rolling_restart(env.get('batch_size', 1),
+                               env.get('pause', 0),
+                               env.get('abort_threshold', 0))
+    return execute(restart_server, hosts=get_host_list())
+
+
+def restart_server(require_active=False):
     if stop_and_start():
-        check_status_for_control_commands()
+        return check_status_for_control_commands(time.time(), require_active)
+
+
+def rolling_restart(batch_size=1, pause=0, abort_threshold=0):
+    """
+    Restarts the servers batch_size hosts at a time, so that the cluster
+    never loses more than one batch of workers. The coordinator goes last,
+    in a batch of its own.
+
+    Returns:
+        Dict of host to the number of seconds its server took to become
+        active, or None if it didn't
+    """
+    return run_in_batches(restart_server, [True], 'Restarting',
+                          'rolling restart', batch_size, pause,
+                          abort_threshold)
+
+
+def run_in_batches(function, args, action, description, batch_size=1,
+                   pause=0, abort_threshold=0, hosts=None):
+    """
+    Executes function on the workers among hosts batch_size at a time, and
+    then on the coordinator in a batch of its own. function returns None
+    for a host whose server did not come back.
+
+    Parameters:
+        hosts: The hosts to run function on (default all of the cluster)
+
+    Returns:
+        Dict of host to the result of function, or None if it failed
+    """
+    if batch_size < 1:
+        abort('Invalid batch size %s: must be at least 1' % batch_size)
+
+    if hosts is None:
+        hosts = get_host_list()
+    coordinators = [host for host in get_coordinator_role() if host in hosts]
+    workers = [host for host in hosts if host not in coordinators]
+    batches = [workers[i:i + batch_size]
+               for i in range(0, len(workers), batch_size)]
+    batches += [[coordinator] for coordinator in coordinators]
+
+    results = {}
+    failed_hosts = []
+    for batch_number, batch in enumerate(batches, 1):
+        if batch_number > 1 and pause:
+            time.sleep(pause)
+        print('%s batch %d of %d: %s' %
+              (action, batch_number, len(batches), ', '.join(batch)))
+        batch_results = execute(function, *args, hosts=batch)
+        for host in batch:
+            result = batch_results.get(host)
+            # Hosts that aborted come back as SystemExit
+            if result is None or isinstance(result, BaseException):
+                failed_hosts.append(host)
+                result = None
+            results[host] = result
+
+        if len(failed_hosts) > abort_threshold:
+            abort('Stopping the %s after batch %d of %d: '
+                  'the server did not come back on %s' %
+                  (description, batch_number, len(batches),
+                   ', '.join(failed_hosts)))
+
+    return results
 
 
 def check_presto_version():
@@ -580,62 +1098,85 @@ def check_presto_version():
 
 
 def presto_installed():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        package_search = run('rpm -q presto')
-        if not package_search.succeeded:
-            package_search = run('rpm -q presto-server-rpm')
-        return package_search.succeeded
+    return get_presto_rpm_version(env.host) is not None
 
 
 def get_presto_version():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        version = run('rpm -q --qf \"%{VERSION}\\n\" presto')
-        # currently we have two rpm names out so we need this retry
-        if not version.succeeded:
-            version = run('rpm -q --qf \"%{VERSION}\\n\" presto-server-rpm')
-        version = version.strip()
-        _LOGGER.debug('Presto rpm version: ' + version)
-        return version
+    version = get_presto_rpm_version(env.host) or ''
+    _LOGGER.debug('Presto rpm version: ' + version)
+    return version
+
+
+def get_coordinator_presto_version():
+    """
+    Returns the version of the Presto rpm on the coordinator, for the tasks
+    that query the cluster once rather than on every host, so env.host is
+    not the coordinator, or not set at all.
+    """
+    version = get_presto_rpm_version(get_coordinator_role()[0]) or ''
+    _LOGGER.debug('Presto rpm version on the coordinator: ' + version)
+    return version
 
 
 def check_server_status():
     """
-    Checks if server is running for env.host. Retries connecting to server
-    until server is up or till RETRY_TIMEOUT is reached
+    Checks if server is running for env.host. Waits for the server to come
+    up until RETRY_TIMEOUT is reached
+
+    Returns:
+        True or False
+    """
+    return wait_for_server() is not None
+
+
+def wait_for_server(since=None, require_active=False):
+    """
+    Waits until the coordinator lists the node of env.host, or until
+    RETRY_TIMEOUT has passed.
+
+    All the hosts of a run share one watcher, so the coordinator is polled
+    once per interval rather than once per host.
 
     Parameters:
-        client - client that executes the query
+        since - time the server was started; node lists polled earlier
+            don't count. Defaults to now.
+        require_active - only count the node once its state is active
 
     Returns:
-        True or False
+        The number of seconds from since until the node was listed, or None
     """
+    if since is None:
+        since = time.time()
     if len(get_coordinator_role()) < 1:
         warn('No coordinator defined.  Cannot verify server status.')
-    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
-        node_id = lookup_string_config('node.id', os.path.join(constants.REMOTE_CONF_DIR, 'node.properties'), env.host)
+    node_id = lookup_string_config('node.id', NODE_CONFIG_FILE, env.host)
+    time_to_ready = get_node_watcher().wait_for(
+        node_id, since, since + RETRY_TIMEOUT,
+        is_node_active if require_active else None)
+    if time_to_ready is not None:
+        _LOGGER.info('Server on %s ready after %.1fs' %
+                     (env.host, time_to_ready))
+    return time_to_ready
 
-        try:
-            return query_server_for_status(client, node_id)
-        except RetryError:
-            return False
 
+def is_node_active(node_row):
+    # The state is the last column of system.runtime.nodes. Before 0.128 it
+    # was a boolean column named active.
+    return node_row[-1] in ['active', True]
 
-@retry(stop_max_delay=RETRY_TIMEOUT * 1000, wait_fixed=5000, retry_on_result=lambda result: result is False)
-def query_server_for_status(client, node_id):
-    try:
-        rows = client.run_sql(SYSTEM_RUNTIME_NODES)
-        if rows is not None:
-            return _is_in_rows(node_id, rows)
-    except ConfigurationError as e:
-        _LOGGER.warn(e)
-    return False
 
+def get_node_watcher():
+    endpoints = get_coordinator_endpoints()
 
-def _is_in_rows(value, rows):
-    for row in rows:
-        if value in row:
-            return True
-    return False
+    def fetch_nodes(timeout):
+        with closing(PrestoClient(endpoints, env.user)) as client:
+            try:
+                return client.run_sql(SYSTEM_RUNTIME_NODES, timeout=timeout)
+            except ConfigurationError as e:
+                _LOGGER.warn(e)
+                return None
+
+    return NodeListWatcher([endpoints, env.user], fetch_nodes)
 
 
 def execute_catalog_info_sql(client):
@@ -645,39 +1186,69 @@ def execute_catalog_info_sql(client):
     Parameters:
         client - client that executes the query
     """
-    return client.run_sql(CATALOG_INFO_SQL)
+    return client.run_sql(CATALOG_INFO_SQL, cache=get_query_cache())
 
 
-def execute_external_ip_sql(client, uuid):
+def get_sysnode_info_from(node_info_rows, state_transform):
     """
-    Returns external ip of the host with uuid after parsing the http_uri column
-    from nodes system table
+    Returns system node info from the rows of system.runtime.nodes, indexed
+    so that the status of every host can be looked up locally.
 
     Parameters:
-        client - client that executes the query
-        uuid - node_id of the node
-    """
-    return client.run_sql(EXTERNAL_IP_SQL % uuid)
-
+        node_info_rows - [[node_id, http_uri, node_version, state], ...]
+        state_transform - function that turns the state column into a string
 
-def get_sysnode_info_from(node_info_row, state_transform):
+    Returns:
+        A (by_node_id, by_host) tuple of dicts. by_node_id maps each node_id
+        to the hosts of the nodes with that id. by_host maps each host to
+        the info of the nodes running on it, in the format:
+        {'http://node1/statement': [presto-main:0.97-SNAPSHOT, 'active']}
     """
-    Returns system node info dict from node info row for a node
+    by_node_id = {}
+    by_host = {}
+    for row in node_info_rows:
+        if not row:
+            continue
+        node_id, http_uri, node_version, state = row
+        host = urlparse.urlparse(http_uri).hostname
+        by_node_id.setdefault(node_id, []).append(host)
+        by_host.setdefault(host, {})[http_uri] = \
+            [node_version, state_transform(state)]
+
+    _LOGGER.info('Node info: %s ', by_host)
+    return by_node_id, by_host
+
+
+def get_ext_ip_of_node(node_id, by_node_id, host):
+    """
+    Returns the external ip the coordinator knows the node with node_id by.
 
     Parameters:
-        node_info_row -
-
-    Returns:
-        Node info dict in format:
-        {'http://node1/statement': [presto-main:0.97-SNAPSHOT, True]}
+        node_id - node.id from the node.properties of host
+        by_node_id - node_id index returned by get_sysnode_info_from
+        host - host the node_id was read from, for warnings
     """
-    output = {}
-    for row in node_info_row:
-        if row:
-            output[row[0]] = [row[1], state_transform(row[2])]
+    external_ips = by_node_id.get(node_id, [])
+    if len(external_ips) > 1:
+        warn_more_than_one_ip = 'More than one external ip found for ' + host + \
+                                '. There could be multiple nodes associated with the same node.id'
+        _LOGGER.debug(warn_more_than_one_ip)
+        warn(warn_more_than_one_ip)
+        return ''
+    if not external_ips:
+        _LOGGER.debug('Cannot get external IP for ' + host)
+        return 'Unknown'
+    return external_ips[0]
 
-    _LOGGER.info('Node info: %s ', output)
-    return output
+
+def get_cluster_node_info(client):
+    """
+    Fetches the info of every node in the cluster with a single query, so
+    the load on the coordinator doesn't grow with the size of the cluster.
+    """
+    version = strip_tag(split_version(get_coordinator_presto_version()))
+    query, processor = NODE_INFO_SQL.for_version(version)
+    return processor(client.run_sql(query, cache=get_query_cache()))
 
 
 def get_catalog_info_from(client):
@@ -722,26 +1293,8 @@ def print_node_info(node_status, catalog_status):
             print('\tCatalogs:     ' + catalog_status)
 
 
-def get_ext_ip_of_node(client):
-    node_properties_file = os.path.join(constants.REMOTE_CONF_DIR,
-                                        'node.properties')
-    with settings(hide('stdout')):
-        node_uuid = sudo('sed -n s/^node.id=//p ' + node_properties_file)
-    external_ip_row = execute_external_ip_sql(client, node_uuid)
-    external_ip = ''
-    if len(external_ip_row) > 1:
-        warn_more_than_one_ip = 'More than one external ip found for ' + env.host + \
-                                '. There could be multiple nodes associated with the same node.id'
-        _LOGGER.debug(warn_more_than_one_ip)
-        warn(warn_more_than_one_ip)
-        return external_ip
-    for row in external_ip_row:
-        if row:
-            external_ip = row[0]
-    if not external_ip:
-        _LOGGER.debug('Cannot get external IP for ' + env.host)
-        external_ip = 'Unknown'
-    return external_ip
+def get_node_id():
+    return lookup_string_config('node.id', NODE_CONFIG_FILE, env.host)
 
 
 def print_status_header(external_ip, server_status, host):
@@ -753,69 +1306,256 @@ def print_status_header(external_ip, server_status, host):
 
 @parallel
 def collect_node_information():
-    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
-        with settings(hide('warnings')):
-            error_message = check_presto_version()
-        if error_message:
-            external_ip = 'Unknown'
-            is_running = False
-        else:
-            with settings(hide('warnings', 'aborts', 'stdout')):
-                try:
-                    external_ip = get_ext_ip_of_node(client)
-                except:
-                    external_ip = 'Unknown'
-                try:
-                    is_running = service('status')
-                except:
-                    is_running = False
-        return external_ip, is_running, error_message
+    with settings(hide('warnings')):
+        error_message = check_presto_version()
+    if error_message:
+        node_id = None
+        is_running = False
+    else:
+        with settings(hide('warnings', 'aborts', 'stdout')):
+            try:
+                node_id = get_node_id()
+            except:
+                node_id = None
+            try:
+                is_running = service('status')
+            except:
+                is_running = False
+    return node_id, is_running, error_message
 
 
-def get_status_from_coordinator():
-    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
+def collect_cluster_status():
+    """
+    Gathers the status of every host with one round of queries to the
+    coordinator and one probe of every host.
+
+    Returns:
+        A (host_statuses, timings) tuple. host_statuses is a list with a
+        dict per host, in topology order, with the keys host, node_id,
+        is_running, external_ip, error_message and node_status (the info
+        of the nodes on the host from get_sysnode_info_from, or None). All
+        of them share the coordinator_reachable and catalogs keys. timings
+        is a dict of step to its duration in ms.
+    """
+    started = time.time()
+    with closing(PrestoClient(get_coordinator_endpoints(), env.user)) as client:
         try:
-            coordinator_status = client.run_sql(SYSTEM_RUNTIME_NODES)
+            by_node_id, by_host = get_cluster_node_info(client)
             catalog_status = get_catalog_info_from(client)
         except BaseException as e:
             # Just log errors that come from a missing port or anything else; if
             # we can't connect to the coordinator, we just want to print out a
             # minimal status anyway.
             _LOGGER.warn(e.message)
-            coordinator_status = []
+            by_node_id, by_host = {}, {}
             catalog_status = []
+    coordinator_query_ms = elapsed_ms(started)
+
+    probe_started = time.time()
+    with settings(hide('running')):
+        node_information = execute(collect_node_information,
+                                   hosts=get_host_list())
+    host_probe_ms = elapsed_ms(probe_started)
+
+    host_statuses = []
+    for host in get_host_list():
+        node_id = None
+        if isinstance(node_information[host], Exception):
+            external_ip = 'Unknown'
+            is_running = False
+            error_message = node_information[host].message
+        else:
+            (node_id, is_running, error_message) = node_information[host]
+            if node_id:
+                external_ip = get_ext_ip_of_node(node_id, by_node_id, host)
+            else:
+                external_ip = 'Unknown'
+        host_statuses.append({'host': host,
+                              'node_id': node_id,
+                              'is_running': is_running,
+                              'external_ip': external_ip,
+                              'error_message': error_message,
+                              'node_status': by_host.get(external_ip),
+                              'coordinator_reachable': bool(by_host),
+                              'catalogs': catalog_status})
 
-        with settings(hide('running')):
-            node_information = execute(collect_node_information,
-                                       hosts=get_host_list())
+    timings = {'coordinator_query': coordinator_query_ms,
+               'host_probe': host_probe_ms,
+               'total': elapsed_ms(started)}
+    return host_statuses, timings
 
-        for host in get_host_list():
-            if isinstance(node_information[host], Exception):
-                external_ip = 'Unknown'
-                is_running = False
-                error_message = node_information[host].message
-            else:
-                (external_ip, is_running, error_message) = node_information[host]
-
-            print_status_header(external_ip, is_running, host)
-            if error_message:
-                print('\t' + error_message)
-            elif not coordinator_status:
-                print('\tNo information available: unable to query coordinator')
-            elif not is_running:
-                print('\tNo information available')
+
+def get_status_from_coordinator():
+    host_statuses, _ = collect_cluster_status()
+    for host_status in host_statuses:
+        print_status_header(host_status['external_ip'],
+                            host_status['is_running'], host_status['host'])
+        if host_status['error_message']:
+            print('\t' + host_status['error_message'])
+        elif not host_status['coordinator_reachable']:
+            print('\tNo information available: unable to query coordinator')
+        elif not host_status['is_running']:
+            print('\tNo information available')
+        else:
+            node_status = host_status['node_status']
+            if node_status:
+                print_node_info(node_status, host_status['catalogs'])
             else:
-                version_string = get_presto_version()
-                version = strip_tag(split_version(version_string))
-                query, processor = NODE_INFO_PER_URI_SQL.for_version(version)
-                # just get the node_info row for the host if server is up
-                node_info_row = client.run_sql(query % external_ip)
-                node_status = processor(node_info_row)
-                if node_status:
-                    print_node_info(node_status, catalog_status)
-                else:
-                    print('\tNo information available: the coordinator has not yet'
-                          ' discovered this node')
+                print('\tNo information available: the coordinator has not yet'
+                      ' discovered this node')
+
+
+def get_status_records(host_statuses, timings):
+    """
+    Flattens the statuses from collect_cluster_status into one record with
+    the STATUS_FIELDS per host. A host running more than one node is
+    reported with the first of them.
+    """
+    records = []
+    for host_status in host_statuses:
+        record = {'host': host_status['host'],
+                  'roles': get_roles_for(host_status['host']),
+                  'running': host_status['is_running'],
+                  'node_id': host_status['node_id'],
+                  'external_ip': host_status['external_ip'],
+                  'error': host_status['error_message'] or None,
+                  'catalogs': None,
+                  'coordinator_query_ms': timings['coordinator_query'],
+                  'host_probe_ms': timings['host_probe']}
+        node_status = host_status['node_status']
+        if node_status and host_status['is_running'] and \
+                not host_status['error_message']:
+            node_uri = sorted(node_status)[0]
+            record['node_uri'] = node_uri
+            record['presto_version'], record['node_state'] = \
+                node_status[node_uri]
+            if host_status['catalogs']:
+                record['catalogs'] = \
+                    host_status['catalogs'].split(', ')
+        records.append(record)
+    return records
+
+
+def get_watch_sql(state_column, jmx_columns):
+    """
+    Returns the watch query with the given names of WATCH_JMX_COLUMNS.
+    """
+    columns = [(column, join) for name, column, join in WATCH_JMX_COLUMNS
+               if name in jmx_columns]
+    return WATCH_SQL % {
+        'state': state_column,
+        'jmx_columns': ''.join(', ' + column for column, _ in columns),
+        'jmx_joins': ''.join(join for _, join in columns)}
+
+
+def get_queryable_jmx_columns(client, state_column, jmx_columns):
+    """
+    Returns the jmx columns that can be queried on their own, so a column
+    the cluster does not have only takes itself off the dashboard.
+    """
+    queryable = []
+    for name in jmx_columns:
+        if client.run_sql(get_watch_sql(state_column, [name]),
+                          timeout=WATCH_QUERY_TIMEOUT) is None:
+            _LOGGER.info('Unable to query the %s column from the jmx catalog, '
+                         'showing the status without it' % name)
+        else:
+            queryable.append(name)
+    return queryable
+
+
+def get_watch_lines(hosts, node_ids, rows, state_transform, polled_at,
+                    jmx_columns=()):
+    """
+    Returns the lines of the status dashboard, one per host.
+
+    Parameters:
+        node_ids - dict of host to the node.id configured on it
+        rows - result of the watch query, or None if it failed
+        jmx_columns - names of the jmx columns the query had
+    """
+    nodes = {}
+    for row in rows or []:
+        nodes[row[0]] = row
+    host_width = max([len('HOST')] + [len(host) for host in hosts])
+
+    lines = ['Presto cluster status at %s%s' %
+             (time.strftime('%H:%M:%S', time.localtime(polled_at)),
+              '' if rows is not None else ': unable to query coordinator'),
+             WATCH_LINE_FORMAT % (host_width, 'HOST', 'ROLES', 'STATE',
+                                  'VERSION', 'UPTIME', 'TASKS', 'MEM USED')]
+    for host in hosts:
+        row = nodes.get(node_ids.get(host))
+        if row is None:
+            state = 'unknown' if rows is None else 'not listed'
+            version, tasks, jmx_values = '-', '-', {}
+        else:
+            state = state_transform(row[2])
+            version, tasks = row[1], row[3]
+            jmx_values = dict(zip(jmx_columns, row[4:]))
+        lines.append(WATCH_LINE_FORMAT % (
+            host_width, host, ', '.join(get_roles_for(host)), state, version,
+            format_duration(jmx_values.get('uptime')), tasks,
+            format_bytes(jmx_values.get('memory_used'))))
+    return lines
+
+
+def watch_status(interval=DEFAULT_WATCH_INTERVAL, ticks=None, stream=None):
+    """
+    Shows the status of the cluster until interrupted, refreshing it every
+    interval seconds with a single query to the coordinator over one kept
+    alive connection. The hosts are only contacted once, to look up their
+    node.id.
+
+    Parameters:
+        ticks - number of refreshes after which to stop, for testing
+    """
+    hosts = get_host_list()
+    with settings(hide('running')):
+        node_information = execute(collect_node_information, hosts=hosts)
+    node_ids = {}
+    for host in hosts:
+        if not isinstance(node_information[host], Exception):
+            node_ids[host] = node_information[host][0]
+
+    version = strip_tag(split_version(get_coordinator_presto_version()))
+    state_column, state_transform = WATCH_STATE_COLUMN.for_version(version)
+    board = StatusBoard(stream or sys.stdout)
+
+    with closing(PrestoClient(get_coordinator_endpoints(), env.user,
+                              keep_alive=True)) as client:
+        catalogs = client.run_sql(CATALOG_INFO_SQL,
+                                  timeout=WATCH_QUERY_TIMEOUT) or []
+        if ['jmx'] in catalogs:
+            jmx_columns = [name for name, _, _ in WATCH_JMX_COLUMNS]
+        else:
+            jmx_columns = []
+        tick = 0
+        try:
+            while ticks is None or tick < ticks:
+                polled_at = time.time()
+                rows = client.run_sql(get_watch_sql(state_column, jmx_columns),
+                                      timeout=WATCH_QUERY_TIMEOUT)
+                if rows is None and jmx_columns:
+                    # Only blame the jmx columns if the coordinator answers
+                    # without them
+                    rows = client.run_sql(get_watch_sql(state_column, []),
+                                          timeout=WATCH_QUERY_TIMEOUT)
+                    if rows is not None:
+                        jmx_columns = get_queryable_jmx_columns(
+                            client, state_column, jmx_columns)
+                        if jmx_columns:
+                            rows = client.run_sql(
+                                get_watch_sql(state_column, jmx_columns),
+                                timeout=WATCH_QUERY_TIMEOUT)
+                board.update(get_watch_lines(hosts, node_ids, rows,
+                                             state_transform, polled_at,
+                                             jmx_columns))
+                tick += 1
+                if ticks is None or tick < ticks:
+                    time.sleep(max(0, polled_at + interval - time.time()))
+        except KeyboardInterrupt:
+            pass
 
 
 @task
@@ -825,5 +1565,34 @@ def get_status_from_coordinator():
 def status():
     """
     Print the status of presto in the cluster
+
+    Parameters:
+        --watch -               (optional) Keep showing the status of the
+                                cluster, refreshing it until interrupted
+                                with Ctrl-C.
+        --interval -            (optional) Seconds between two refreshes
+                                with --watch. Defaults to 2.
+        --format -              (optional) text, json or csv. json and csv
+                                print a record per host with the fields
+                                host, roles, running, node_id, external_ip,
+                                node_uri, presto_version, node_state,
+                                catalogs, error, coordinator_query_ms and
+                                host_probe_ms. Defaults to text.
     """
-    get_status_from_coordinator()
+    output_format = get_output_format()
+    if env.get('watch'):
+        if output_format != TEXT:
+            abort('--watch can only be used with the text format')
+        return watch_status(env.get('interval', DEFAULT_WATCH_INTERVAL))
+    print_status(output_format)
+
+
+def print_status(output_format=TEXT):
+    if output_format == TEXT:
+        get_status_from_coordinator()
+    else:
+        collected_at = time.time()
+        host_statuses, timings = collect_cluster_status()
+        print_records(output_format, 'server status', STATUS_FIELDS,
+                      get_status_records(host_statuses, timings), timings,
+                      collected_at)
@@ -40,11 +40,13 @@ USERNAME = 'username'
 PORT = 'port'
 COORDINATOR = 'coordinator'
 WORKERS = 'workers'
+COORDINATOR_ENDPOINTS = 'coordinator_endpoints'
 
 STANDALONE_CONFIG_LOADED = 'standalone_config_loaded'
 
 PRESTO_ADMIN_PROPERTIES = ['username', 'port', 'coordinator', 'workers',
-                           'java8_home', CERTIFICATE_ALIAS]
+                           'java8_home', CERTIFICATE_ALIAS,
+                           COORDINATOR_ENDPOINTS]
 
 DEFAULT_PROPERTIES = {USERNAME: 'root',
                       PORT: 22,
@@ -87,6 +89,31 @@ def validate_java8_home(java8_home):
     return java8_home
 
 
+def validate_coordinator_endpoints(endpoints):
+    """
+    Endpoints are standby coordinators or load balancers in front of the
+    coordinator, given as host or host:port. The port defaults to the http
+    port of the coordinator.
+    """
+    if not isinstance(endpoints, list):
+        raise ConfigurationError('%s must be of type list.  Found %s.' %
+                                 (COORDINATOR_ENDPOINTS, type(endpoints)))
+
+    for endpoint in endpoints:
+        if not isinstance(endpoint, basestring):
+            raise ConfigurationError('Coordinator endpoint must be of type '
+                                     'string.  Found %s.' % type(endpoint))
+        # Only split off a port if there is a single colon; anything else is
+        # an IPv6 address.
+        if endpoint.count(':') == 1:
+            host, port = endpoint.split(':')
+            validate_host(host)
+            validate_port(port)
+        else:
+            validate_host(endpoint)
+    return endpoints
+
+
 def validate(conf):
     for key in conf.keys():
         if key not in PRESTO_ADMIN_PROPERTIES:
@@ -121,6 +148,13 @@ def validate(conf):
         workers = [h for host in workers for h in _expand_host(host)]
         conf['workers'] = validate_workers(workers)
 
+    try:
+        endpoints = conf[COORDINATOR_ENDPOINTS]
+    except KeyError:
+        pass
+    else:
+        conf[COORDINATOR_ENDPOINTS] = validate_coordinator_endpoints(endpoints)
+
     try:
         port = conf['port']
     except KeyError:
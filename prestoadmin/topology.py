@@ -16,14 +16,20 @@
 Module for setting and validating the presto-admin config
 """
 import pprint
+import time
 
 from fabric.api import env, runs_once, task
 
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.output_format import get_output_format, \
+    print_records, elapsed_ms, TEXT
 
 import prestoadmin.util.fabricapi as util
 
+# Fields of the machine readable output of topology show
+TOPOLOGY_FIELDS = ['host', 'roles', 'ssh_port', 'username']
+
 
 @task
 @runs_once
@@ -33,7 +39,30 @@ def show():
     Shows the current topology configuration for the cluster (including the
     coordinators, workers, SSH port, and SSH username)
     """
-    pprint.pprint(get_conf_from_fabric(), width=1)
+    output_format = get_output_format()
+    if output_format == TEXT:
+        pprint.pprint(get_conf_from_fabric(), width=1)
+        return
+
+    started = time.time()
+    records = get_topology_records()
+    print_records(output_format, 'topology show', TOPOLOGY_FIELDS, records,
+                  {'total': elapsed_ms(started)}, started)
+
+
+def get_topology_records():
+    coordinators = util.get_coordinator_role()
+    workers = util.get_worker_role()
+    records = []
+    for host in coordinators + [host for host in workers
+                                if host not in coordinators]:
+        roles = [role for role, hosts in [('coordinator', coordinators),
+                                          ('worker', workers)]
+                 if host in hosts]
+        records.append({'host': host, 'roles': roles,
+                        'ssh_port': int(env.port),
+                        'username': env.user})
+    return records
 
 
 def get_conf_from_fabric():
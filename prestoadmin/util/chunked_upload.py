@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resumable uploads of large files, like rpms and plugin jars.
+
+The file is sent in chunks of CHUNK_SIZE bytes. Each chunk is checked
+against its SHA-256 on the remote host before it is appended to a partial
+copy, and the number of chunks appended so far is recorded next to it.
+When an upload is interrupted, the next upload of the same file picks up
+after the last chunk that made it, instead of starting over.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from StringIO import StringIO
+
+from fabric.api import env, put, sudo
+from fabric.context_managers import settings, hide
+from fabric.utils import abort
+
+from prestoadmin.util.verification_cache import VerificationCache
+
+_LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024 * 1024
+CHUNK_RETRIES = 3
+PARTIAL_SUFFIX = '.part'
+PROGRESS_SUFFIX = '.progress'
+CHUNK_SUFFIX = '.chunk'
+
+
+def needs_chunks(local_path):
+    return os.path.getsize(local_path) > CHUNK_SIZE
+
+
+def prepare_chunks(local_path):
+    """
+    Computes the checksums of the chunks of the file at local_path, if it
+    needs chunks. Called before a parallel upload, so that the jobs fabric
+    forks for every host find the checksums recorded instead of hashing
+    the file again each. A missing file is left for the upload to report.
+    """
+    if os.path.isfile(local_path) and needs_chunks(local_path):
+        get_chunk_checksums(local_path, CHUNK_SIZE)
+
+
+def get_chunk_checksums(local_path, chunk_size=CHUNK_SIZE):
+    """
+    Returns:
+        The SHA-256 of the whole file and the list of the SHA-256 of each
+        chunk, computed only if they were not recorded yet, see
+        VerificationCache
+    """
+    verification_cache = VerificationCache()
+    entry = verification_cache.lookup(local_path) or {}
+    chunk_checksums = entry.get('chunk_sha256', {})
+    if not entry.get('sha256') or str(chunk_size) not in chunk_checksums:
+        file_checksum, chunk_checksums[str(chunk_size)] = \
+            _compute_chunk_checksums(local_path, chunk_size)
+        verification_cache.record(local_path, sha256=file_checksum,
+                                  chunk_sha256=chunk_checksums)
+        return file_checksum, chunk_checksums[str(chunk_size)]
+    return entry['sha256'], chunk_checksums[str(chunk_size)]
+
+
+def _compute_chunk_checksums(local_path, chunk_size):
+    file_checksum = hashlib.sha256()
+    chunk_checksums = []
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            file_checksum.update(chunk)
+            chunk_checksums.append(hashlib.sha256(chunk).hexdigest())
+    return file_checksum.hexdigest(), chunk_checksums
+
+
+def upload_in_chunks(local_path, remote_dir, chunk_size=CHUNK_SIZE):
+    """
+    Uploads the file at local_path into remote_dir on env.host, resuming
+    an earlier upload of the same file that was interrupted.
+
+    Returns:
+        Dict with the number of chunks in the file, the number of chunks
+        that were already there from an earlier upload, the bytes sent and
+        the seconds it took
+    """
+    file_name = os.path.basename(local_path)
+    remote_path = os.path.join(remote_dir, file_name)
+    file_checksum, chunk_checksums = get_chunk_checksums(local_path,
+                                                         chunk_size)
+    first_chunk = get_uploaded_chunks(remote_dir, remote_path,
+                                      file_checksum)
+    if first_chunk:
+        print('[%s] Resuming upload of %s after chunk %d of %d' %
+              (env.host, file_name, first_chunk, len(chunk_checksums)))
+
+    start = time.time()
+    bytes_sent = 0
+    with open(local_path, 'rb') as f:
+        f.seek(first_chunk * chunk_size)
+        for index in range(first_chunk, len(chunk_checksums)):
+            chunk = f.read(chunk_size)
+            send_chunk(chunk, index, chunk_checksums[index], chunk_size,
+                       remote_path, file_checksum)
+            bytes_sent += len(chunk)
+            print('[%s] %s: chunk %d of %d, %s' % (
+                env.host, file_name, index + 1, len(chunk_checksums),
+                format_throughput(bytes_sent, time.time() - start)))
+
+    finish_upload(remote_path, file_checksum)
+    seconds = time.time() - start
+    print('[%s] Uploaded %s: %d bytes in %.1f seconds, %s' % (
+        env.host, file_name, bytes_sent, seconds,
+        format_throughput(bytes_sent, seconds)))
+    return {'chunks': len(chunk_checksums), 'resumed_chunks': first_chunk,
+            'bytes_sent': bytes_sent, 'seconds': seconds}
+
+
+def get_uploaded_chunks(remote_dir, remote_path, file_checksum):
+    """
+    Creates remote_dir if needed and returns the number of chunks of the
+    file with file_checksum already uploaded to remote_path. Progress
+    recorded for a different file doesn't count.
+    """
+    with settings(hide('stdout')):
+        progress = sudo('mkdir -p %s && (cat %s 2>/dev/null || true)' %
+                        (remote_dir, remote_path + PROGRESS_SUFFIX))
+    fields = progress.split()
+    if len(fields) == 2 and fields[0] == file_checksum and \
+            fields[1].isdigit():
+        return int(fields[1])
+    return 0
+
+
+def send_chunk(chunk, index, chunk_checksum, chunk_size, remote_path,
+               file_checksum):
+    chunk_path = remote_path + CHUNK_SUFFIX
+    partial_path = remote_path + PARTIAL_SUFFIX
+    # Cutting the partial copy back to the chunk's offset drops whatever an
+    # interrupted append left behind
+    command = ('[ "$(sha256sum < %(chunk)s | cut -c1-64)" = "%(sum)s" ] '
+               '&& truncate -s %(offset)d %(partial)s '
+               '&& cat %(chunk)s >> %(partial)s '
+               '&& echo "%(file_sum)s %(done)d" > %(progress)s; '
+               'status=$?; rm -f %(chunk)s; exit $status' %
+               {'chunk': chunk_path, 'sum': chunk_checksum,
+                'offset': index * chunk_size, 'partial': partial_path,
+                'file_sum': file_checksum, 'done': index + 1,
+                'progress': remote_path + PROGRESS_SUFFIX})
+    for attempt in range(1, CHUNK_RETRIES + 1):
+        with settings(hide('warnings', 'running'), warn_only=True):
+            uploaded = put(StringIO(chunk), chunk_path, use_sudo=True)
+            if uploaded.succeeded and sudo(command).succeeded:
+                return
+        _LOGGER.warn('Failed to upload chunk %d of %s to %s, attempt %d' %
+                     (index + 1, remote_path, env.host, attempt))
+    abort('Failed to upload chunk %d of %s after %d attempts' %
+          (index + 1, remote_path, CHUNK_RETRIES))
+
+
+def finish_upload(remote_path, file_checksum):
+    partial_path = remote_path + PARTIAL_SUFFIX
+    with settings(hide('warnings'), warn_only=True):
+        result = sudo('[ "$(sha256sum < %s | cut -c1-64)" = "%s" ] && '
+                      'mv %s %s && rm -f %s' %
+                      (partial_path, file_checksum, partial_path,
+                       remote_path, remote_path + PROGRESS_SUFFIX))
+    if not result.succeeded:
+        # Start over next time, the partial copy is no good
+        sudo('rm -f %s %s' % (partial_path, remote_path + PROGRESS_SUFFIX))
+        abort('Checksum mismatch after uploading %s' % remote_path)
+
+
+def format_throughput(size, seconds):
+    if seconds <= 0:
+        return '- MB/s'
+    return '%.1f MB/s' % (size / seconds / (1024 * 1024))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Distributes a large file to the hosts of the cluster in a tree, for the
+--tree option.
+
+The file is uploaded from the presto-admin host to a few seed hosts only.
+After that, in every round each host that has the file relays it over ssh
+to a host that doesn't, so the number of hosts with the file doubles every
+round and the whole cluster has it after about log2(N) rounds. The relays
+are driven from the presto-admin host, with its ssh agent forwarded to the
+relaying host. The checksum of the file is checked on every host it
+reaches; hosts that can't be reached through the tree get the file from
+the presto-admin host directly.
+"""
+
+import logging
+import os
+
+from fabric.api import env, put, run, sudo
+from fabric.context_managers import settings, hide
+from fabric.decorators import parallel
+from fabric.tasks import execute
+from fabric.utils import abort
+
+from prestoadmin.util.filesystem import sha256_of_file
+
+_LOGGER = logging.getLogger(__name__)
+
+STAGING_DIR = '/tmp/presto-admin-distribution'
+DEFAULT_SEED_COUNT = 2
+RELAY_SSH_OPTIONS = '-o BatchMode=yes -o StrictHostKeyChecking=no'
+
+
+def distribute(local_path, remote_dir, hosts, seed_count=None,
+               checksum=None):
+    """
+    Copies the file at local_path into remote_dir on all of hosts through
+    a distribution tree.
+
+    Parameters:
+        seed_count: Number of hosts to upload the file to from the
+            presto-admin host (default env.seed_count, or DEFAULT_SEED_COUNT)
+        checksum: SHA-256 of the file, if the caller already computed it
+
+    Returns:
+        The number of relay rounds it took
+    """
+    if seed_count is None:
+        seed_count = env.get('seed_count') or DEFAULT_SEED_COUNT
+    if seed_count < 1:
+        abort('Invalid seed count %s: must be at least 1' % seed_count)
+    if not hosts:
+        return 0
+
+    checksum = checksum or sha256_of_file(local_path)
+    staging_dir = os.path.join(STAGING_DIR, checksum)
+    staged_path = os.path.join(staging_dir, os.path.basename(local_path))
+    hosts = list(hosts)
+
+    seeds = hosts[:seed_count]
+    print('Uploading %s to %s' % (local_path, ', '.join(seeds)))
+    holders = _verified(execute(upload_staged, local_path, staged_path,
+                                hosts=seeds), checksum)
+    fallback_hosts = [host for host in seeds if host not in holders]
+
+    remaining = hosts[seed_count:]
+    rounds = 0
+    while remaining and holders:
+        rounds += 1
+        targets = dict(zip(holders, remaining))
+        remaining = remaining[len(targets):]
+        _LOGGER.info('Relay round %d: %s' % (rounds, ', '.join(
+            '%s -> %s' % pair for pair in sorted(targets.items()))))
+        received = _verified(execute(relay_staged, targets, staged_path,
+                                     hosts=sorted(targets)), checksum,
+                             targets)
+        fallback_hosts += [host for host in targets.values()
+                           if host not in received]
+        holders += received
+    fallback_hosts += remaining
+
+    if fallback_hosts:
+        print('Could not relay %s to %s, uploading it directly' %
+              (local_path, ', '.join(fallback_hosts)))
+        received = _verified(execute(upload_staged, local_path, staged_path,
+                                     hosts=fallback_hosts), checksum)
+        failed_hosts = [host for host in fallback_hosts
+                        if host not in received]
+        if failed_hosts:
+            abort('Checksum mismatch after copying %s to %s' %
+                  (local_path, ', '.join(failed_hosts)))
+
+    execute(install_staged, staged_path, remote_dir, hosts=hosts)
+    print('Distributed %s to %d hosts in %d relay rounds' %
+          (local_path, len(hosts), rounds))
+    return rounds
+
+
+def _verified(results, checksum, targets=None):
+    """
+    Returns the hosts whose copy of the file has the right checksum, given
+    the results of upload_staged, or with targets the results of
+    relay_staged, which are keyed by the relaying host.
+    """
+    verified = []
+    for host in sorted(results):
+        target = targets[host] if targets else host
+        if results[host] == checksum:
+            verified.append(target)
+        else:
+            _LOGGER.warn('Bad or missing copy on %s: checksum %s' %
+                         (target, results[host]))
+    return verified
+
+
+def _checksum_from(output):
+    if output is None or isinstance(output, Exception) or \
+            not output.succeeded or not output.split():
+        return None
+    return output.split()[0]
+
+
+@parallel
+def upload_staged(local_path, staged_path):
+    """
+    Returns:
+        The checksum of the uploaded copy on env.host
+    """
+    with settings(hide('stdout'), warn_only=True):
+        run('mkdir -p ' + os.path.dirname(staged_path))
+        put(local_path, staged_path)
+        return _checksum_from(run('sha256sum ' + staged_path))
+
+
+@parallel
+def relay_staged(targets, staged_path):
+    """
+    Sends the staged file from env.host to the host targets[env.host],
+    which stores it and reports its checksum back through the relay.
+
+    Returns:
+        The checksum of the copy on the target host
+    """
+    target = targets[env.host]
+    remote_command = 'mkdir -p %s && cat > %s && sha256sum %s' % (
+        os.path.dirname(staged_path), staged_path, staged_path)
+    with settings(hide('stdout'), warn_only=True, forward_agent=True):
+        return _checksum_from(run("cat %s | ssh -p %s %s %s@%s '%s'" % (
+            staged_path, env.port, RELAY_SSH_OPTIONS, env.user, target,
+            remote_command)))
+
+
+@parallel
+def install_staged(staged_path, remote_dir):
+    sudo('mkdir -p %s && cp %s %s && rm -rf %s' % (
+        remote_dir, staged_path, remote_dir, os.path.dirname(staged_path)))
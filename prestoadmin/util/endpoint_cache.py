@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Record of the coordinator endpoint that last answered, for each list of
+candidate endpoints.
+
+The record is file backed so that the jobs fabric forks for parallel tasks
+use the endpoint chosen by the parent process or by each other, instead of
+racing the endpoints again. It is kept per run, so that a later
+presto-admin command checks the endpoints afresh.
+"""
+
+import json
+import logging
+import os
+import time
+from tempfile import mkstemp
+
+from fabric.state import env
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_log_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+ENDPOINT_CACHE_DIR_NAME = 'endpoint_cache'
+# Records of earlier runs older than this are removed
+MAX_AGE = 24 * 60 * 60
+
+
+class EndpointCache:
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(get_log_directory(),
+                                     ENDPOINT_CACHE_DIR_NAME)
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, '%d-%d' % (
+            os.getpid(), int(time.time() * 1000)))
+        self.purged = False
+
+    def get(self, endpoints):
+        """
+        Returns the (host, port) that last answered among the endpoints, or
+        None if there is none.
+        """
+        endpoint = self._read_entries().get(_key(endpoints))
+        return tuple(endpoint) if endpoint else None
+
+    def put(self, endpoints, endpoint):
+        entries = self._read_entries()
+        entries[_key(endpoints)] = endpoint
+        self._write_entries(entries)
+
+    def forget(self, endpoints):
+        entries = self._read_entries()
+        if entries.pop(_key(endpoints), None) is not None:
+            self._write_entries(entries)
+
+    def _read_entries(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_entries(self, entries):
+        try:
+            ensure_directory_exists(self.cache_dir)
+            if not self.purged:
+                self.purge_expired()
+            fd, temp_path = mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            # Only costs racing the endpoints again
+            _LOGGER.warn('Unable to record the coordinator endpoint: %s' % e)
+
+    def purge_expired(self):
+        """
+        Removes the records left behind by earlier runs.
+        """
+        self.purged = True
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _key(endpoints):
+    return json.dumps([list(endpoint) for endpoint in endpoints])
+
+
+def get_endpoint_cache():
+    """
+    Returns the endpoint cache of the current run, creating it if necessary.
+
+    It has to be created before calling execute() for the forked jobs to
+    share it, which main does for every command.
+    """
+    if env.get('endpoint_cache') is None:
+        env.endpoint_cache = EndpointCache()
+    return env.endpoint_cache
@@ -30,6 +30,18 @@ def get_coordinator_role():
     return env.roledefs['coordinator']
 
 
+def get_coordinator_endpoints():
+    """
+    Returns the addresses PrestoClient may use to reach the coordinator: the
+    coordinator itself followed by the coordinator_endpoints from the
+    topology, in order of preference.
+    """
+    endpoints = get_coordinator_role()[:1]
+    if 'conf' in env and env.conf:
+        endpoints += env.conf.get('coordinator_endpoints', [])
+    return endpoints
+
+
 def get_worker_role():
     return env.roledefs['worker']
 
@@ -15,12 +15,15 @@
 """ Filesystem tools."""
 
 import errno
+import hashlib
 import logging
 import os
 
 
 logger = logging.getLogger(__name__)
 
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
 
 def ensure_parent_directories_exist(path):
     try:
@@ -59,3 +62,11 @@ def write_to_file_if_not_exists(content, path):
     else:
         with os.fdopen(file_handle, 'w') as f:
             f.write(content)
+
+
+def sha256_of_file(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), ''):
+            checksum.update(block)
+    return checksum.hexdigest()
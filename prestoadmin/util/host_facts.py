@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Facts about the remote hosts that presto-admin needs over and over during
+a run: the Presto configuration, the installed rpm, listening ports, the OS and
+Java versions, and the resources the preflight checks look at.
+
+All the facts of a host are gathered with a single remote command the
+first time any of them is needed, and then served from a cache that lives
+as long as the run. Code that changes a host, like installing a package or
+deploying configuration, has to call forget_host_facts for it.
+"""
+
+import logging
+import re
+
+from fabric.context_managers import settings, hide, shell_env
+from fabric.decorators import parallel
+from fabric.operations import sudo
+from fabric.state import env
+from fabric.tasks import execute
+
+from prestoadmin.config import split_to_pair, COMMENT_CHARS
+from prestoadmin.util.constants import REMOTE_CONF_DIR, REMOTE_PACKAGES_PATH
+from prestoadmin.util.exception import ConfigurationError
+
+_LOGGER = logging.getLogger(__name__)
+
+NODE_CONFIG_FILE = REMOTE_CONF_DIR + '/node.properties'
+GENERAL_CONFIG_FILE = REMOTE_CONF_DIR + '/config.properties'
+JVM_CONFIG_FILE = REMOTE_CONF_DIR + '/jvm.config'
+LOG_CONFIG_FILE = REMOTE_CONF_DIR + '/log.properties'
+
+NODE_PROPERTIES = 'node.properties'
+CONFIG_PROPERTIES = 'config.properties'
+JVM_CONFIG = 'jvm.config'
+LOG_PROPERTIES = 'log.properties'
+RPMS = 'rpms'
+PORTS = 'ports'
+PLATFORM = 'platform'
+JAVA = 'java'
+JAVA_HOMES = 'java_homes'
+DISK = 'disk'
+MEMORY = 'memory'
+UUIDGEN = 'uuidgen'
+PRESTO_USER = 'presto_user'
+
+CONFIG_FILES = {NODE_CONFIG_FILE: NODE_PROPERTIES,
+                GENERAL_CONFIG_FILE: CONFIG_PROPERTIES,
+                LOG_CONFIG_FILE: LOG_PROPERTIES}
+# Names the Presto server rpm has been released under, in the order they
+# are looked for
+PRESTO_RPM_NAMES = ['presto', 'presto-server-rpm']
+RPM_NAMES = PRESTO_RPM_NAMES + ['presto-server']
+PRESTO_USER_NAME = 'presto'
+# Directories the rpm is copied to, installed into and keeps its data in
+DISK_DIRS = [REMOTE_PACKAGES_PATH, '/usr/lib/presto', '/var/lib/presto']
+# Where the rpm looks for Java 8, in order
+JAVA_HOME_CANDIDATES = ['"$JAVA8_HOME"', '"$JAVA_HOME"', '/usr/java/*',
+                        '/usr/lib/jvm/*']
+
+SECTION_MARKER = '#presto-admin:'
+UNREADABLE = SECTION_MARKER + 'unreadable'
+
+
+def _section(name, command):
+    return "echo '%s%s'; %s" % (SECTION_MARKER, name, command)
+
+
+def _file_section(name, path):
+    return _section(name, "if [ -r %(path)s ]; then cat %(path)s; echo; "
+                          "else echo '%(unreadable)s'; fi"
+                    % {'path': path, 'unreadable': UNREADABLE})
+
+
+FACTS_SCRIPT = '; '.join([
+    _file_section(NODE_PROPERTIES, NODE_CONFIG_FILE),
+    _file_section(CONFIG_PROPERTIES, GENERAL_CONFIG_FILE),
+    _file_section(JVM_CONFIG, JVM_CONFIG_FILE),
+    _file_section(LOG_PROPERTIES, LOG_CONFIG_FILE),
+    _section(RPMS, "rpm -q --qf '%%{NAME} %%{VERSION} %%{INSTALLTIME}\\n' %s "
+                   "2>/dev/null" % ' '.join(RPM_NAMES)),
+    _section(PORTS, 'netstat -lnt 2>/dev/null'),
+    _section(PLATFORM, 'uname -a'),
+    _section(JAVA, 'java -version 2>&1'),
+    _section(JAVA_HOMES, 'for home in %s; do [ -n "$home" ] && '
+                         '[ -x "$home/bin/java" ] && '
+                         'echo "$home $("$home/bin/java" -version 2>&1 | '
+                         'head -n 1)"; done' % ' '.join(JAVA_HOME_CANDIDATES)),
+    # The free space of the closest existing parent of every directory
+    _section(DISK, 'for dir in %s; do d=$dir; while [ ! -d "$d" ]; do '
+                   'd=$(dirname "$d"); done; '
+                   'echo "$dir $(df -Pk "$d" | tail -n 1)"; done'
+             % ' '.join(DISK_DIRS)),
+    _section(MEMORY, 'grep MemTotal /proc/meminfo'),
+    _section(UUIDGEN, 'command -v uuidgen'),
+    _section(PRESTO_USER, 'getent passwd %s' % PRESTO_USER_NAME)
+])
+
+
+def get_host_facts(host):
+    """
+    Returns the facts of host, gathering them if this run hasn't yet.
+
+    Returns:
+        A dict with the keys NODE_PROPERTIES, CONFIG_PROPERTIES and
+        LOG_PROPERTIES (dicts, or None if the file can't be read),
+        JVM_CONFIG (list of options, or None if the file can't be read),
+        RPMS (installed rpm name to a dict with its name, version and
+        install_time in seconds since the epoch), PORTS (listening TCP ports),
+        PLATFORM and JAVA (strings), JAVA_HOMES (list of dicts with the path
+        and version of the Java installations the rpm would look at), DISK
+        (dict of the directories in DISK_DIRS to a dict with the available
+        bytes and the mount point), MEMORY (total bytes, or None), UUIDGEN
+        (path, or None) and PRESTO_USER (dict with the name, uid and home of
+        the presto user, or None), or None if the host can't be reached
+    """
+    if env.get('host_facts') is None:
+        env.host_facts = {}
+    if host not in env.host_facts:
+        facts = gather_host_facts(host)
+        if facts is None:
+            return None
+        env.host_facts[host] = facts
+    return env.host_facts[host]
+
+
+def get_facts_of_hosts(hosts):
+    """
+    Returns a dict of every host in hosts to its facts, as returned by
+    get_host_facts. The hosts whose facts this run hasn't gathered yet are
+    probed in parallel.
+    """
+    if env.get('host_facts') is None:
+        env.host_facts = {}
+    missing_hosts = [host for host in hosts if host not in env.host_facts]
+    if missing_hosts:
+        with settings(hide('stdout', 'warnings', 'aborts', 'running'),
+                      skip_bad_hosts=True):
+            outputs = execute(_probe_facts, hosts=missing_hosts)
+        for host in missing_hosts:
+            output = outputs.get(host)
+            if output is None or isinstance(output, Exception):
+                _LOGGER.info('Could not gather facts of host %s: %s' %
+                             (host, output))
+                continue
+            env.host_facts[host] = parse_facts(output)
+    return dict((host, env.host_facts.get(host)) for host in hosts)
+
+
+@parallel
+def _probe_facts():
+    return _run_facts_script()
+
+
+def _run_facts_script():
+    # The rpm is installed with the java8_home of the configuration, so
+    # that is where the Java 8 it will use is looked for
+    if env.get('java8_home'):
+        with shell_env(JAVA8_HOME=env.java8_home):
+            return sudo(FACTS_SCRIPT, warn_only=True)
+    return sudo(FACTS_SCRIPT, warn_only=True)
+
+
+def forget_host_facts(host):
+    if env.get('host_facts'):
+        env.host_facts.pop(host, None)
+
+
+def gather_host_facts(host):
+    with settings(hide('stdout', 'warnings', 'aborts', 'running')):
+        output = execute(_run_facts_script, host=host)[host]
+
+    if isinstance(output, Exception):
+        _LOGGER.info('Could not gather facts of host %s: %s' % (host, output))
+        return None
+
+    facts = parse_facts(output)
+    _LOGGER.debug('Facts of host %s: %s' % (host, facts))
+    return facts
+
+
+def parse_facts(output):
+    sections = {}
+    lines = None
+    for line in output.splitlines():
+        if line.startswith(SECTION_MARKER) and line != UNREADABLE:
+            lines = sections.setdefault(line[len(SECTION_MARKER):], [])
+        elif lines is not None:
+            lines.append(line)
+
+    return {NODE_PROPERTIES: _parse_properties(sections.get(NODE_PROPERTIES)),
+            CONFIG_PROPERTIES:
+                _parse_properties(sections.get(CONFIG_PROPERTIES)),
+            JVM_CONFIG: _parse_options(sections.get(JVM_CONFIG)),
+            LOG_PROPERTIES: _parse_properties(sections.get(LOG_PROPERTIES)),
+            RPMS: _parse_rpms(sections.get(RPMS, [])),
+            PORTS: _parse_ports(sections.get(PORTS, [])),
+            PLATFORM: '\n'.join(sections.get(PLATFORM, [])).strip(),
+            JAVA: '\n'.join(sections.get(JAVA, [])).strip(),
+            JAVA_HOMES: _parse_java_homes(sections.get(JAVA_HOMES, [])),
+            DISK: _parse_disk(sections.get(DISK, [])),
+            MEMORY: _parse_memory(sections.get(MEMORY, [])),
+            UUIDGEN: '\n'.join(sections.get(UUIDGEN, [])).strip() or None,
+            PRESTO_USER: _parse_user(sections.get(PRESTO_USER, []))}
+
+
+def _parse_properties(lines):
+    if lines is None or UNREADABLE in lines:
+        return None
+    properties = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in COMMENT_CHARS:
+            continue
+        try:
+            key, value = split_to_pair(line)
+        except ConfigurationError:
+            _LOGGER.debug('Ignoring malformed property line: %s' % line)
+            continue
+        properties[key] = value
+    return properties
+
+
+def _parse_options(lines):
+    if lines is None or UNREADABLE in lines:
+        return None
+    return [line.strip() for line in lines
+            if line.strip() and line.strip()[0] not in COMMENT_CHARS]
+
+
+def _parse_rpms(lines):
+    # Packages that aren't installed show up as 'package X is not installed'
+    rpms = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 3 and fields[0] in RPM_NAMES:
+            install_time = int(fields[2]) if fields[2].isdigit() else None
+            rpms[fields[0]] = {'name': fields[0], 'version': fields[1],
+                               'install_time': install_time}
+    return rpms
+
+
+def _parse_ports(lines):
+    ports = set()
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 6 and fields[5] == 'LISTEN':
+            port = fields[3].rsplit(':', 1)[-1]
+            if port.isdigit():
+                ports.add(int(port))
+    return sorted(ports)
+
+
+def parse_java_version(output):
+    """
+    Returns the version in the output of java -version, e.g. 1.8.0_40, or
+    None if there is none.
+    """
+    match = re.search(r'version "([^"]+)"', output or '')
+    return match.group(1) if match else None
+
+
+def _parse_java_homes(lines):
+    java_homes = []
+    for line in lines:
+        fields = line.split(' ', 1)
+        if len(fields) == 2 and fields[0] not in \
+                [java_home['path'] for java_home in java_homes]:
+            java_homes.append({'path': fields[0],
+                               'version': parse_java_version(fields[1])})
+    return java_homes
+
+
+def _parse_disk(lines):
+    # Lines are the directory followed by the df -P line of its filesystem
+    disk = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 7 and fields[4].isdigit():
+            disk[fields[0]] = {'available': int(fields[4]) * 1024,
+                               'mount': fields[-1]}
+    return disk
+
+
+def _parse_memory(lines):
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 2 and fields[0] == 'MemTotal:' and \
+                fields[1].isdigit():
+            return int(fields[1]) * 1024
+    return None
+
+
+def _parse_user(lines):
+    for line in lines:
+        fields = line.strip().split(':')
+        if len(fields) >= 6 and fields[0] == PRESTO_USER_NAME:
+            uid = int(fields[2]) if fields[2].isdigit() else None
+            return {'name': fields[0], 'uid': uid, 'home': fields[5]}
+    return None
+
+
+def lookup_config_file(config_file, host):
+    """
+    Returns the properties in config_file on host as a dict.
+
+    Raises:
+        ConfigurationError if the file can't be read
+    """
+    facts = get_host_facts(host)
+    properties = None
+    if facts is not None and config_file in CONFIG_FILES:
+        properties = facts[CONFIG_FILES[config_file]]
+    if properties is None:
+        raise ConfigurationError('Could not access config file %s on '
+                                 'host %s' % (config_file, host))
+    return properties
+
+
+def get_presto_package(host, rpm_names=None):
+    """
+    Returns the Presto package installed on host as a dict with its name,
+    version and install_time, or None if there is none or the host can't be
+    reached. All the names the package has been released under are looked
+    up with the same rpm query, once per run.
+
+    Parameters:
+        rpm_names: Names to look for, in order of preference (default
+            PRESTO_RPM_NAMES)
+    """
+    facts = get_host_facts(host)
+    if facts is None:
+        return None
+    for rpm_name in rpm_names or PRESTO_RPM_NAMES:
+        if rpm_name in facts[RPMS]:
+            return facts[RPMS][rpm_name]
+    return None
+
+
+def is_package_installed(host, rpm_name):
+    """
+    Returns whether the rpm_name package is installed on host, or None if
+    that isn't known from the facts, because the package isn't one of
+    RPM_NAMES or the host can't be reached.
+    """
+    if rpm_name not in RPM_NAMES:
+        return None
+    facts = get_host_facts(host)
+    if facts is None:
+        return None
+    return rpm_name in facts[RPMS]
+
+
+def get_presto_rpm_version(host):
+    """
+    Returns the version of the Presto rpm installed on host, or None if
+    there is none or the host can't be reached.
+    """
+    presto_package = get_presto_package(host)
+    if presto_package is None:
+        return None
+    return presto_package['version']
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Watches the list of nodes known to the coordinator on behalf of all the
+hosts waiting for their server to come up.
+
+Fabric runs a task for each host in a separate process, so the node list
+is shared through a state file: whichever process finds the list stale
+takes a lock and polls the coordinator, everybody else reads the result.
+However many hosts are waiting, the coordinator is polled at most once per
+interval.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from tempfile import mkstemp
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_log_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+NODE_WATCHER_DIR_NAME = 'node_watcher'
+DEFAULT_POLL_INTERVAL = 1
+# How often waiting hosts look at the shared node list. This only reads a
+# local file, so it can be much shorter than the poll interval.
+WAIT_INTERVAL = 0.1
+
+
+class NodeListWatcher:
+    """
+    Parameters:
+        key: Identifies the cluster being watched; watchers with the same
+            key share the node list
+        fetch_nodes: Function that takes a timeout in seconds and returns
+            the rows of system.runtime.nodes, or None if it can't
+        interval: Minimum number of seconds between two polls
+    """
+
+    def __init__(self, key, fetch_nodes, interval=DEFAULT_POLL_INTERVAL,
+                 state_dir=None):
+        if state_dir is None:
+            state_dir = os.path.join(get_log_directory(),
+                                     NODE_WATCHER_DIR_NAME)
+        self.fetch_nodes = fetch_nodes
+        self.interval = interval
+        self.state_dir = state_dir
+        name = hashlib.sha1(json.dumps(key)).hexdigest()
+        self.state_path = os.path.join(state_dir, name)
+        self.lock_path = self.state_path + '.lock'
+
+    def wait_for(self, node_id, since, deadline, is_ready=None):
+        """
+        Waits until node_id shows up in a node list polled no earlier than
+        since, so that a node list from before a restart is never taken as
+        proof that the server is up.
+
+        Parameters:
+            is_ready: Optional function that takes the row of the node and
+                returns whether the node counts as up, e.g. to wait for a
+                particular state
+
+        Returns:
+            The number of seconds from since until the node was seen, or
+            None if it wasn't seen before deadline
+        """
+        while True:
+            snapshot = self._read_snapshot()
+            if snapshot and snapshot['polled_at'] >= since and \
+                    _is_listed(node_id, snapshot['nodes'], is_ready):
+                return snapshot['polled_at'] - since
+
+            now = time.time()
+            if now >= deadline:
+                return None
+            if snapshot and now - snapshot['polled_at'] < self.interval:
+                time.sleep(min(WAIT_INTERVAL, deadline - now))
+            else:
+                self._poll(deadline)
+
+    def _poll(self, deadline):
+        ensure_directory_exists(self.state_dir)
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                # Another host is polling right now, wait for its result
+                time.sleep(max(0, min(WAIT_INTERVAL, deadline - time.time())))
+                return
+            try:
+                snapshot = self._read_snapshot()
+                if snapshot and \
+                        time.time() - snapshot['polled_at'] < self.interval:
+                    return
+                polled_at = time.time()
+                nodes = self.fetch_nodes(deadline - polled_at)
+                # A failed poll is recorded as well, so that the other hosts
+                # don't all retry it at once
+                self._write_snapshot({'polled_at': polled_at,
+                                      'nodes': nodes or []})
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.state_path, 'r') as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write_snapshot(self, snapshot):
+        fd, temp_path = mkstemp(dir=self.state_dir)
+        with os.fdopen(fd, 'w') as state_file:
+            json.dump(snapshot, state_file)
+        os.rename(temp_path, self.state_path)
+        _LOGGER.debug('Coordinator lists %d nodes' % len(snapshot['nodes']))
+
+
+def _is_listed(node_id, rows, is_ready=None):
+    for row in rows:
+        if node_id in row and (is_ready is None or is_ready(row)):
+            return True
+    return False
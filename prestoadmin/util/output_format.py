@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Machine readable output of the commands that report on the cluster, for
+the --format option.
+
+Every command reports a list of flat records with a fixed set of fields.
+In csv the records are the rows, below a header with the field names. In
+json they are the 'records' of a document on a single line that also
+holds the format version, the command, when the information was collected
+and how long collecting it took, in milliseconds.
+
+Fields may be added in later versions, but existing fields keep their
+name and meaning unless FORMAT_VERSION changes.
+"""
+
+import csv
+import json
+import sys
+import time
+
+from fabric.state import env
+from fabric.utils import abort
+
+FORMAT_VERSION = 1
+TEXT = 'text'
+JSON = 'json'
+CSV = 'csv'
+OUTPUT_FORMATS = [TEXT, JSON, CSV]
+LIST_SEPARATOR = ';'
+
+
+def get_output_format():
+    output_format = (env.get('output_format') or TEXT).lower()
+    if output_format not in OUTPUT_FORMATS:
+        abort('Invalid output format %s. Possible values: %s' %
+              (output_format, ', '.join(OUTPUT_FORMATS)))
+    return output_format
+
+
+def elapsed_ms(since):
+    return int(round((time.time() - since) * 1000))
+
+
+def print_records(output_format, command, fields, records, timings,
+                  collected_at=None, header=True, stream=None):
+    """
+    Parameters:
+        fields - names of the fields of the records, in order
+        records - list of dicts with the fields as keys
+        timings - dict of the name of a step to its duration in ms
+        header - whether to write the header row in csv, so that a command
+            that writes its records in parts can write it only once
+    """
+    stream = stream or sys.stdout
+    if output_format == JSON:
+        document = {'format_version': FORMAT_VERSION,
+                    'command': command,
+                    'collected_at': _format_time(collected_at),
+                    'timings_ms': timings,
+                    'records': [dict((field, record.get(field))
+                                     for field in fields)
+                                for record in records]}
+        stream.write(json.dumps(document, sort_keys=True) + '\n')
+    elif output_format == CSV:
+        writer = csv.writer(stream, lineterminator='\n')
+        if header:
+            writer.writerow(fields)
+        for record in records:
+            writer.writerow([_csv_value(record.get(field))
+                             for field in fields])
+    stream.flush()
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        timestamp = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return LIST_SEPARATOR.join(_csv_value(item) for item in value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
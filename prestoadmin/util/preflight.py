@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks that the hosts can take a Presto install or upgrade, for server
+preflight.
+
+The checks only look at the facts of the hosts, see host_facts, so a host
+is probed with a single remote command however many checks there are.
+Every check gives a status, OK, WARN or FAIL, and a short detail. Only
+FAIL stops an install or upgrade.
+"""
+
+import re
+
+from prestoadmin.util.constants import REMOTE_PACKAGES_PATH
+from prestoadmin.util.host_facts import JAVA, JAVA_HOMES, DISK, MEMORY, \
+    PORTS, RPMS, UUIDGEN, PRESTO_USER, DISK_DIRS, PRESTO_RPM_NAMES, \
+    parse_java_version
+from prestoadmin.util.status_board import format_bytes
+
+OK = 'ok'
+WARN = 'warn'
+FAIL = 'FAIL'
+
+JAVA_CHECK = 'java'
+DISK_CHECK = 'disk'
+MEMORY_CHECK = 'memory'
+PORT_CHECK = 'port'
+UUIDGEN_CHECK = 'uuidgen'
+USER_CHECK = 'user'
+CHECKS = [JAVA_CHECK, DISK_CHECK, MEMORY_CHECK, PORT_CHECK, UUIDGEN_CHECK,
+          USER_CHECK]
+
+UNREACHABLE = 'host unreachable'
+
+JAVA_VERSION = '1.8'
+MIN_FREE_DISK = 1024 * 1024 * 1024
+# The heap leaves room for the rest of the JVM and the OS
+MAX_HEAP_SHARE = 0.9
+DEFAULT_HTTP_PORT = 8080
+# Directories that need room for the rpm, the copy and the installed files
+RPM_DIRS = [REMOTE_PACKAGES_PATH, '/usr/lib/presto']
+MEMORY_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+                't': 1024 ** 4}
+
+
+def check_host(facts, jvm_options, http_port, java8_home=None, rpm_size=0):
+    """
+    Runs all the checks for a host. A host with Presto installed is
+    checked for an upgrade, otherwise for an install.
+
+    Parameters:
+        facts: The facts of the host, or None if it can't be reached
+        jvm_options: The jvm.config options Presto will run with
+        http_port: The port Presto will listen on
+        java8_home: The java8_home of the configuration, if any
+        rpm_size: Size of the rpm that will be installed, in bytes
+
+    Returns:
+        A dict of the name of every check in CHECKS to a (status, detail)
+        tuple
+    """
+    if facts is None:
+        return dict((check, (WARN, UNREACHABLE)) for check in CHECKS)
+    return {JAVA_CHECK: check_java(facts, java8_home),
+            DISK_CHECK: check_disk(facts, rpm_size),
+            MEMORY_CHECK: check_memory(facts, jvm_options),
+            PORT_CHECK: check_port(facts, http_port),
+            UUIDGEN_CHECK: check_uuidgen(facts),
+            USER_CHECK: check_user(facts)}
+
+
+def is_presto_installed(facts):
+    return any(rpm_name in facts[RPMS] for rpm_name in PRESTO_RPM_NAMES)
+
+
+def check_java(facts, java8_home=None):
+    java_homes = facts[JAVA_HOMES]
+    if java8_home:
+        java8_home = java8_home.rstrip('/') or '/'
+        for java_home in java_homes:
+            if java_home['path'].rstrip('/') == java8_home:
+                if _is_java8(java_home['version']):
+                    return OK, java_home['version']
+                return FAIL, 'java8_home %s is Java %s' % (
+                    java8_home, java_home['version'])
+        return FAIL, 'no Java in java8_home %s' % java8_home
+
+    for java_home in java_homes:
+        if _is_java8(java_home['version']):
+            return OK, java_home['version']
+    version = parse_java_version(facts[JAVA])
+    if _is_java8(version):
+        return OK, version
+    return FAIL, 'Java 8 not found, set java8_home in config.json'
+
+
+def _is_java8(version):
+    return bool(version) and version.startswith(JAVA_VERSION)
+
+
+def check_disk(facts, rpm_size=0):
+    """
+    Every filesystem needs MIN_FREE_DISK, plus the size of the rpm for each
+    of the RPM_DIRS on it.
+    """
+    disk = facts[DISK]
+    if not disk:
+        return WARN, 'unknown'
+    required = {}
+    available = {}
+    for directory in DISK_DIRS:
+        if directory not in disk:
+            continue
+        mount = disk[directory]['mount']
+        available[mount] = disk[directory]['available']
+        required.setdefault(mount, MIN_FREE_DISK)
+        if directory in RPM_DIRS:
+            required[mount] += rpm_size
+    short_mounts = sorted(mount for mount in required
+                          if available[mount] < required[mount])
+    if short_mounts:
+        return FAIL, ', '.join('%s free on %s, needs %s' % (
+            format_bytes(available[mount]), mount,
+            format_bytes(required[mount])) for mount in short_mounts)
+    return OK, '%s free' % format_bytes(min(available.values()))
+
+
+def check_memory(facts, jvm_options):
+    memory = facts[MEMORY]
+    heap_size = get_max_heap_size(jvm_options)
+    if memory is None:
+        return WARN, 'unknown'
+    if heap_size is None:
+        return OK, '%s' % format_bytes(memory)
+    if heap_size > memory * MAX_HEAP_SHARE:
+        return FAIL, 'heap of %s but only %s of memory' % (
+            format_bytes(heap_size), format_bytes(memory))
+    return OK, 'heap of %s of %s' % (format_bytes(heap_size),
+                                     format_bytes(memory))
+
+
+def get_max_heap_size(jvm_options):
+    """
+    Returns the -Xmx in jvm_options in bytes, or None if there is none.
+    The last one counts, like for the JVM.
+    """
+    heap_size = None
+    for option in jvm_options or []:
+        match = re.match(r'-Xmx(\d+)([kKmMgGtT]?)$', option.strip())
+        if match:
+            heap_size = int(match.group(1)) * \
+                MEMORY_UNITS[match.group(2).lower()]
+    return heap_size
+
+
+def check_port(facts, http_port):
+    if http_port not in facts[PORTS]:
+        return OK, '%d free' % http_port
+    # Presto itself is expected to listen on the port of an installed
+    # server
+    if is_presto_installed(facts):
+        return OK, '%d used by Presto' % http_port
+    return FAIL, '%d in use' % http_port
+
+
+def check_uuidgen(facts):
+    if facts[UUIDGEN]:
+        return OK, facts[UUIDGEN]
+    return FAIL, 'uuidgen not found'
+
+
+def check_user(facts):
+    user = facts[PRESTO_USER]
+    if user:
+        return OK, 'uid %s' % user['uid']
+    if is_presto_installed(facts):
+        return WARN, 'presto user missing'
+    return OK, 'created by the rpm'
+
+
+def failed_hosts(results):
+    """
+    Returns the hosts of results, a dict of host to the result of
+    check_host, with a failed check.
+    """
+    return sorted(host for host in results
+                  if FAIL in [status for status, _ in results[host].values()])
+
+
+def format_results(hosts, results):
+    """
+    Returns a table with a row per host and a column per check, followed by
+    the details of the checks that did not pass.
+    """
+    host_width = max([len('host')] + [len(host) for host in hosts])
+    line_format = '%-*s' + '  %-8s' * len(CHECKS)
+    lines = [line_format % tuple([host_width, 'host'] + CHECKS)]
+    problems = []
+    for host in hosts:
+        statuses = [results[host][check][0] for check in CHECKS]
+        lines.append(line_format % tuple([host_width, host] + statuses))
+        if set(results[host].values()) == set([(WARN, UNREACHABLE)]):
+            problems.append('%s: %s' % (host, UNREACHABLE))
+            continue
+        for check in CHECKS:
+            status, detail = results[host][check]
+            if status != OK:
+                problems.append('%s: %s %s: %s' % (host, check, status,
+                                                   detail))
+    lines = [line.rstrip() for line in lines]
+    if problems:
+        lines.append('')
+        lines.extend(problems)
+    return '\n'.join(lines)
@@ -13,15 +13,14 @@
 # limitations under the License.
 import logging
 import os
-from StringIO import StringIO
 
-from fabric.context_managers import settings, hide
-from fabric.operations import get, run
 from fabric.state import env
 from fabric.utils import error
 
 from prestoadmin.config import get_conf_from_properties_data
 from prestoadmin.util.constants import REMOTE_CONF_DIR, CONFIG_PROPERTIES
+from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.host_facts import lookup_config_file
 
 HTTP_ENABLED_KEY = 'http-server.http.enabled'
 HTTPS_ENABLED_KEY = 'http-server.https.enabled'
@@ -67,21 +66,15 @@ class PrestoConfig:
 
     @staticmethod
     def coordinator_config():
+        return PrestoConfig.node_config(env.roledefs['coordinator'][0])
+
+    @staticmethod
+    def node_config(config_host):
         config_path = os.path.join(REMOTE_CONF_DIR, CONFIG_PROPERTIES)
-        config_host = env.roledefs['coordinator'][0]
         try:
-            data = StringIO()
-            with settings(host_string='%s@%s' % (env.user, config_host)):
-                with hide('stderr', 'stdout'):
-                    temp_dir = run('mktemp -d /tmp/prestoadmin.XXXXXXXXXXXXXX')
-                try:
-                    get(config_path, data, use_sudo=True, temp_dir=temp_dir)
-                finally:
-                    run('rm -rf %s' % temp_dir)
-
-            data.seek(0)
-            return PrestoConfig.from_file(data, config_path, config_host)
-        except:
+            return PrestoConfig(lookup_config_file(config_path, config_host),
+                                config_path, config_host)
+        except ConfigurationError:
             _LOGGER.info('Could not find Presto config.')
             return PrestoConfig(None, config_path, config_host)
 
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lets the hosts of the cluster pull a large file from the presto-admin host
+over HTTP, for the --pull option.
+
+Instead of pushing the file over one ssh session per host, which encrypts
+every copy on the presto-admin host, presto-admin serves the file from a
+temporary HTTP server and has up to --pull-concurrency hosts at a time
+fetch it with curl. Each host checks the SHA-256 of its copy before moving
+it into place. The server only serves the one file, under a random path,
+and is shut down as soon as the hosts are done.
+"""
+
+import binascii
+import logging
+import os
+import shutil
+import socket
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from fabric.api import env, sudo
+from fabric.context_managers import settings, hide
+from fabric.decorators import parallel
+from fabric.tasks import execute
+
+from prestoadmin.util.filesystem import sha256_of_file
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PULL_CONCURRENCY = 10
+CURL_RETRIES = 3
+# Seconds to wait for a connection, so that a firewalled port falls back
+# to pushing quickly
+CURL_CONNECT_TIMEOUT = 10
+SEND_BUFFER_SIZE = 1024 * 1024
+
+
+class _ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        _LOGGER.warn('Error serving %s' % (client_address,), exc_info=True)
+
+
+class FileServer(object):
+    """
+    Temporary HTTP server for the file at local_path, served under a
+    random path on all the addresses of the presto-admin host.
+    """
+
+    def __init__(self, local_path, port=0):
+        self.local_path = local_path
+        self.path = '/%s/%s' % (binascii.hexlify(os.urandom(16)),
+                                os.path.basename(local_path))
+        self.server = _ThreadedHTTPServer(('', port), self._handler_class())
+        self.port = self.server.server_address[1]
+        self.request_count = 0
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def url_for(self, host):
+        """
+        Returns:
+            The url of the file, with the address of the presto-admin host
+            that host would connect to
+        """
+        return 'http://%s:%d%s' % (get_local_address(host), self.port,
+                                   self.path)
+
+    def _handler_class(self):
+        file_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                _LOGGER.info('%s - %s' % (self.client_address[0],
+                                          format % args))
+
+            def do_GET(self):
+                file_server.request_count += 1
+                if self.path != file_server.path:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(
+                    os.path.getsize(file_server.local_path)))
+                self.end_headers()
+                with open(file_server.local_path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile, SEND_BUFFER_SIZE)
+
+        return Handler
+
+
+def get_local_address(host):
+    """
+    Returns:
+        The address of the presto-admin host on the network that reaches
+        host. Connecting a UDP socket only picks the route, nothing is
+        sent.
+    """
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        udp_socket.connect((host, env.get('port') or 22))
+        return udp_socket.getsockname()[0]
+    finally:
+        udp_socket.close()
+
+
+def pull(local_path, remote_dir, hosts, concurrency=None, checksum=None):
+    """
+    Has all of hosts pull the file at local_path into remote_dir from a
+    temporary HTTP server on the presto-admin host.
+
+    Parameters:
+        concurrency: Number of hosts pulling at the same time (default
+            env.pull_concurrency, or DEFAULT_PULL_CONCURRENCY)
+        checksum: SHA-256 of the file, if the caller already computed it
+
+    Returns:
+        The hosts that could not pull the file, which need it pushed
+    """
+    if not hosts:
+        return []
+    concurrency = concurrency or env.get('pull_concurrency') or \
+        DEFAULT_PULL_CONCURRENCY
+    checksum = checksum or sha256_of_file(local_path)
+    remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+
+    with FileServer(local_path) as file_server:
+        # Each host gets the address of the presto-admin host on its own
+        # network
+        urls = {}
+        for host in hosts:
+            try:
+                urls[host] = file_server.url_for(host)
+            except socket.error as e:
+                _LOGGER.warn('No route to %s to serve %s: %s' %
+                             (host, local_path, e))
+        pull_hosts = [host for host in hosts if host in urls]
+        results = {}
+        if pull_hosts:
+            print('Serving %s on port %d to %d hosts, %d at a time' %
+                  (local_path, file_server.port, len(pull_hosts),
+                   concurrency))
+            with settings(parallel=True, pool_size=concurrency):
+                results = execute(pull_file, urls, remote_path, checksum,
+                                  hosts=pull_hosts)
+
+    failed_hosts = [host for host in hosts if results.get(host) is not True]
+    if failed_hosts:
+        print('Could not pull %s to %s, pushing it instead' %
+              (local_path, ', '.join(failed_hosts)))
+    return failed_hosts
+
+
+@parallel
+def pull_file(urls, remote_path, checksum):
+    """
+    Downloads the file from the url of env.host in urls, a dict of host to
+    url.
+
+    Returns:
+        True if env.host downloaded the file and it has the checksum
+    """
+    url = urls[env.host]
+    partial_path = remote_path + '.pull'
+    command = ('mkdir -p %(dir)s && '
+               'curl -fsS --connect-timeout %(timeout)d --retry %(retries)d '
+               '-o %(partial)s %(url)s && '
+               '[ "$(sha256sum < %(partial)s | cut -c1-64)" = "%(sum)s" ] && '
+               'mv %(partial)s %(path)s; '
+               'status=$?; rm -f %(partial)s; exit $status' %
+               {'dir': os.path.dirname(remote_path),
+                'timeout': CURL_CONNECT_TIMEOUT, 'retries': CURL_RETRIES,
+                'partial': partial_path, 'url': url, 'sum': checksum,
+                'path': remote_path})
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        result = sudo(command)
+    if not result.succeeded:
+        _LOGGER.warn('Failed to pull %s to %s on %s: %s' %
+                     (url, remote_path, env.host, result))
+    return result.succeeded
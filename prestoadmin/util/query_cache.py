@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Short-lived cache for the results of queries against system tables.
+
+The cache is file backed so that the jobs fabric forks for parallel tasks
+can share the results fetched by the parent process or by each other.
+Entries are keyed by the run that created the cache, so results never leak
+from one presto-admin command into the next.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from tempfile import mkstemp
+
+from fabric.state import env
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_log_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+QUERY_CACHE_DIR_NAME = 'query_cache'
+DEFAULT_TTL = 30
+
+
+class QueryResultCache:
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL):
+        if cache_dir is None:
+            cache_dir = os.path.join(get_log_directory(), QUERY_CACHE_DIR_NAME)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.run_id = '%d-%d' % (os.getpid(), int(time.time() * 1000))
+        self.purged = False
+
+    def _path_for(self, coordinator, user, catalog, schema, sql):
+        key = json.dumps([self.run_id, coordinator, user, catalog, schema, sql])
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest())
+
+    def get(self, coordinator, user, catalog, schema, sql):
+        """
+        Returns the cached rows for the query, or None if there is no entry
+        or the entry is older than the ttl.
+        """
+        path = self._path_for(coordinator, user, catalog, schema, sql)
+        try:
+            with open(path, 'r') as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+        if time.time() - entry['created'] > self.ttl:
+            return None
+
+        _LOGGER.debug('Using cached result for query: %s' % sql)
+        return entry['rows']
+
+    def put(self, coordinator, user, catalog, schema, sql, rows):
+        """
+        Stores the rows returned by the query. The entry is written to a
+        temporary file first and then renamed so that concurrent readers
+        never see a partially written entry.
+        """
+        try:
+            ensure_directory_exists(self.cache_dir)
+            if not self.purged:
+                self.purge_expired()
+            fd, temp_path = mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump({'created': time.time(), 'rows': rows}, cache_file)
+            os.rename(temp_path,
+                      self._path_for(coordinator, user, catalog, schema, sql))
+        except (IOError, OSError) as e:
+            # The cache is only an optimization, never fail a query because of it
+            _LOGGER.warn('Unable to cache result of query %s: %s' % (sql, e))
+
+    def purge_expired(self):
+        """
+        Removes the entries left behind by earlier runs.
+        """
+        self.purged = True
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def get_query_cache():
+    """
+    Returns the query cache of the current run, creating it if necessary.
+
+    Tasks that want forked jobs to share results should call this before
+    calling execute() so that the jobs inherit the same cache.
+    """
+    if env.get('query_cache') is None:
+        env.query_cache = QueryResultCache()
+    return env.query_cache
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Downloads of large files, like Presto rpms, as parallel byte ranges.
+
+When the server accepts range requests, the file is split into a number of
+ranges that are fetched over separate connections at the same time and
+written into their place in a partial file of the full size. How far each
+range got is recorded next to the partial file, so a download that fails
+or is interrupted picks up where every range left off the next time, as
+long as the file on the server is still the same.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib2
+from httplib import HTTPException
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_RANGE_COUNT = 4
+# Files smaller than this per range are split into fewer ranges
+MIN_RANGE_SIZE = 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+RANGE_RETRIES = 3
+PROGRESS_INTERVAL = 5
+PARTIAL_SUFFIX = '.part'
+PROGRESS_SUFFIX = '.progress'
+
+
+class RangesNotSupportedError(Exception):
+    pass
+
+
+def supports_ranges(accept_ranges):
+    """
+    Parameters:
+        accept_ranges: The value of the Accept-Ranges header of the response
+    """
+    return accept_ranges is not None and accept_ranges.strip().lower() == 'bytes'
+
+
+def split_ranges(length, range_count):
+    """
+    Returns:
+        List of [start, end, done] for the ranges of a file of the given
+        length, with end exclusive and done the bytes of the range fetched
+    """
+    range_count = max(1, min(range_count, length // MIN_RANGE_SIZE))
+    range_size = max(1, (length + range_count - 1) // range_count)
+    return [[start, min(start + range_size, length), 0]
+            for start in range(0, length, range_size)]
+
+
+def download_in_ranges(url, path, length, range_count=DEFAULT_RANGE_COUNT,
+                       validator=None, report=None):
+    """
+    Downloads the file of the given length at url to path, as range_count
+    parallel byte ranges. A partial download of the same url, length and
+    validator is resumed.
+
+    Parameters:
+        validator: ETag or Last-Modified of the file on the server, so that
+            a partial download of an older version of it isn't resumed
+        report: Called every PROGRESS_INTERVAL seconds with the number of
+            bytes downloaded and the length
+
+    Returns:
+        Dict with the number of ranges, the bytes resumed from an earlier
+        download, the bytes read and the seconds it took
+
+    Raises:
+        RangesNotSupportedError if the server doesn't answer range requests
+        with the requested range, and the last error of a range that failed
+        RANGE_RETRIES times
+    """
+    partial_path = path + PARTIAL_SUFFIX
+    progress = _read_progress(path)
+    if progress.get('url') != url or progress.get('length') != length or \
+            progress.get('validator') != validator or \
+            not os.path.isfile(partial_path) or \
+            os.path.getsize(partial_path) != length:
+        progress = {'url': url, 'length': length, 'validator': validator,
+                    'ranges': split_ranges(length, range_count)}
+        with open(partial_path, 'wb') as partial_file:
+            partial_file.truncate(length)
+    ranges = progress['ranges']
+    resumed_bytes = sum(done for _, _, done in ranges)
+    if resumed_bytes:
+        print('Resuming download of %s after %d of %d bytes' %
+              (url, resumed_bytes, length))
+
+    lock = threading.Lock()
+    errors = []
+
+    def fetch(index):
+        try:
+            _fetch_range(url, path, progress, index, lock)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    start = time.time()
+    threads = [threading.Thread(target=fetch, args=(index,))
+               for index, (first, end, done) in enumerate(ranges)
+               if first + done < end]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(PROGRESS_INTERVAL)
+            if report and thread.is_alive():
+                report(sum(done for _, _, done in ranges), length)
+    seconds = time.time() - start
+
+    if any(isinstance(e, RangesNotSupportedError) for e in errors):
+        _remove_partial(path)
+        raise RangesNotSupportedError(url)
+    with lock:
+        _write_progress(path, progress)
+    if errors:
+        raise errors[0]
+    os.rename(partial_path, path)
+    os.remove(path + PROGRESS_SUFFIX)
+    return {'ranges': len(ranges), 'resumed_bytes': resumed_bytes,
+            'bytes_read': length - resumed_bytes, 'seconds': seconds}
+
+
+def _fetch_range(url, path, progress, index, lock):
+    partial_path = path + PARTIAL_SUFFIX
+    byte_range = progress['ranges'][index]
+    first, end, _ = byte_range
+    for attempt in range(1, RANGE_RETRIES + 1):
+        offset = first + byte_range[2]
+        try:
+            request = urllib2.Request(url, headers={
+                'Range': 'bytes=%d-%d' % (offset, end - 1)})
+            response = urllib2.urlopen(request)
+            try:
+                content_range = response.info().get('Content-Range', '')
+                if response.getcode() != 206 or \
+                        not content_range.startswith('bytes %d-' % offset):
+                    raise RangesNotSupportedError(
+                        'Server answered range request for %s with %s %s' %
+                        (url, response.getcode(), content_range))
+                with open(partial_path, 'r+b') as partial_file:
+                    partial_file.seek(offset)
+                    while offset < end:
+                        block = response.read(min(BLOCK_SIZE, end - offset))
+                        if not block:
+                            break
+                        partial_file.write(block)
+                        offset += len(block)
+                        # The bytes have to be on disk before the progress
+                        # says so, or a resume after a crash keeps a hole
+                        partial_file.flush()
+                        os.fsync(partial_file.fileno())
+                        with lock:
+                            byte_range[2] = offset - first
+                            _write_progress(path, progress)
+            finally:
+                response.close()
+            if offset == end:
+                return
+            error = IOError('Connection closed after %d of %d bytes' %
+                            (offset - first, end - first))
+        except RangesNotSupportedError:
+            raise
+        except (urllib2.URLError, HTTPException, socket.error,
+                IOError) as e:
+            error = e
+        _LOGGER.warn('Failed to download bytes %d-%d of %s, attempt %d: %s' %
+                     (first, end - 1, url, attempt, error))
+    raise error
+
+
+def _remove_partial(path):
+    for suffix in [PARTIAL_SUFFIX, PROGRESS_SUFFIX]:
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+def _read_progress(path):
+    try:
+        with open(path + PROGRESS_SUFFIX, 'r') as progress_file:
+            return json.load(progress_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_progress(path, progress):
+    temp_path = path + PROGRESS_SUFFIX + '.tmp'
+    with open(temp_path, 'w') as progress_file:
+        json.dump(progress, progress_file)
+    os.rename(temp_path, path + PROGRESS_SUFFIX)
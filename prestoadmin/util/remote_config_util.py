@@ -18,14 +18,13 @@ from fabric.operations import sudo
 from fabric.tasks import execute
 from prestoadmin.util.exception import ConfigurationError
 from prestoadmin.util.constants import DEFAULT_PRESTO_LAUNCHER_LOG_FILE,\
-    DEFAULT_PRESTO_SERVER_LOG_FILE, REMOTE_CONF_DIR, REMOTE_CATALOG_DIR
+    DEFAULT_PRESTO_SERVER_LOG_FILE, REMOTE_CATALOG_DIR
+from prestoadmin.util.host_facts import CONFIG_FILES, NODE_CONFIG_FILE, \
+    GENERAL_CONFIG_FILE, lookup_config_file
 import prestoadmin.util.validators
 
 _LOGGER = logging.getLogger(__name__)
 
-NODE_CONFIG_FILE = REMOTE_CONF_DIR + '/node.properties'
-GENERAL_CONFIG_FILE = REMOTE_CONF_DIR + '/config.properties'
-
 
 def lookup_port(host):
     """
@@ -88,6 +87,17 @@ def lookup_string_config(config_value, config_file, host, default=''):
 
 
 def lookup_in_config(config_key, config_file, host):
+    """
+    Returns the line 'config_key=value' for config_key in config_file on
+    host, or '' if the key isn't set. The Presto config files are read from
+    the host facts, so looking up any number of keys costs one round trip.
+    """
+    if config_file in CONFIG_FILES:
+        properties = lookup_config_file(config_file, host)
+        if config_key in properties:
+            return '%s=%s' % (config_key, properties[config_key])
+        return ''
+
     with settings(hide('stdout', 'warnings', 'aborts')):
         config_value = execute(sudo, 'grep %s= %s' % (config_key, config_file),
                                user='presto',
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local cache of the Presto rpms downloaded by server install.
+
+The rpms are kept in a directory under the presto-admin configuration
+directory, next to an index that records for each of them the version, the
+url it was downloaded from, its size, its SHA-256 and when it was last
+used. Install looks rpms up by version or url in the index, so a cached
+rpm is found without going to the network. When the rpms take more than
+the maximum size, the least recently used ones are removed.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+from tempfile import mkstemp
+
+from fabric.api import local
+from fabric.context_managers import settings, hide
+
+from prestoadmin.util.filesystem import ensure_directory_exists, \
+    sha256_of_file
+from prestoadmin.util.local_config_util import get_config_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+RPM_CACHE_DIR_NAME = 'rpm_cache'
+INDEX_FILE_NAME = 'index.json'
+DEFAULT_MAX_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class RpmCache:
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = os.path.join(get_config_directory(),
+                                     RPM_CACHE_DIR_NAME)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.index_path = os.path.join(cache_dir, INDEX_FILE_NAME)
+
+    def lookup(self, version=None, url=None, max_age=None):
+        """
+        Returns the path of the most recently added rpm with the given
+        version, or downloaded from the given url, or None if there is none.
+        Rpms that have gone missing or changed size are dropped from the
+        index.
+
+        Parameters:
+            max_age: Only return an rpm added less than max_age seconds ago
+        """
+        index = self._read_index()
+        now = time.time()
+        found = None
+        for name, entry in sorted(index.items(),
+                                  key=lambda item: -item[1]['added']):
+            if (version and entry['version'] != version) or \
+                    (url and entry['url'] != url) or \
+                    (max_age is not None and now - entry['added'] > max_age):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isfile(path) or \
+                    os.path.getsize(path) != entry['size']:
+                _LOGGER.info('Dropping %s from the rpm cache' % name)
+                del index[name]
+                continue
+            entry['last_used'] = now
+            found = path
+            break
+        self._write_index(index)
+        return found
+
+    def remove(self, path):
+        """
+        Removes the rpm at path from the cache and from the index.
+        """
+        index = self._read_index()
+        index.pop(os.path.basename(path), None)
+        self._write_index(index)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def add(self, path, url, version=None):
+        """
+        Moves the rpm at path into the cache and adds it to the index.
+
+        Parameters:
+            version: The version of the rpm, if known. Otherwise it is read
+                from the rpm.
+
+        Returns:
+            The path of the rpm in the cache
+        """
+        ensure_directory_exists(self.cache_dir)
+        version = version or get_rpm_version(path)
+        name = os.path.basename(path)
+        if version:
+            name = 'presto-server-rpm-%s.rpm' % version
+        cached_path = os.path.join(self.cache_dir, name)
+        if os.path.realpath(path) != os.path.realpath(cached_path):
+            shutil.move(path, cached_path)
+
+        now = time.time()
+        index = self._read_index()
+        index[name] = {'version': version, 'url': url,
+                       'size': os.path.getsize(cached_path),
+                       'sha256': sha256_of_file(cached_path),
+                       'added': now, 'last_used': now}
+        self._evict(index, keep=name)
+        self._write_index(index)
+        return cached_path
+
+    def _evict(self, index, keep):
+        total_size = sum(entry['size'] for entry in index.values())
+        for name, entry in sorted(index.items(),
+                                  key=lambda item: item[1]['last_used']):
+            if total_size <= self.max_size:
+                break
+            if name == keep:
+                continue
+            print('Removing least recently used rpm %s from the rpm cache' %
+                  name)
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total_size -= entry['size']
+            del index[name]
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r') as index_file:
+                return json.load(index_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        try:
+            ensure_directory_exists(self.cache_dir)
+            fd, temp_path = mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(index, index_file, indent=4, sort_keys=True)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError) as e:
+            _LOGGER.warn('Unable to write the rpm cache index: %s' % e)
+
+
+def get_rpm_version(path):
+    with settings(hide('everything'), warn_only=True):
+        result = local("rpm -qp --queryformat '%%{VERSION}' %s" % path,
+                       capture=True)
+    if result.succeeded and result.strip():
+        return result.strip()
+    return None
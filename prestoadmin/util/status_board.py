@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps a block of lines on the terminal up to date, like the status
+dashboard of server status --watch.
+"""
+
+CURSOR_UP = '\033[%dA'
+CURSOR_DOWN = '\033[%dB'
+CLEAR_LINE = '\r\033[K'
+CLEAR_TO_END = '\r\033[J'
+
+
+class StatusBoard(object):
+    """
+    On a terminal, every update rewrites only the lines that changed since
+    the previous one. Anywhere else, e.g. when the output is redirected to a
+    file, an update that changes anything is written out in full.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = []
+        self.is_tty = hasattr(stream, 'isatty') and stream.isatty()
+
+    def update(self, lines):
+        """
+        Returns:
+            The number of lines written
+        """
+        if lines == self.lines:
+            return 0
+
+        if self.is_tty and len(lines) == len(self.lines):
+            written = 0
+            for i, (old_line, new_line) in enumerate(zip(self.lines, lines)):
+                if old_line != new_line:
+                    # The cursor stays below the board between updates
+                    distance = len(lines) - i
+                    self.stream.write(CURSOR_UP % distance + CLEAR_LINE +
+                                      new_line + CURSOR_DOWN % distance + '\r')
+                    written += 1
+        else:
+            if self.is_tty and self.lines:
+                self.stream.write(CURSOR_UP % len(self.lines) + CLEAR_TO_END)
+            self.stream.write(''.join(line + '\n' for line in lines))
+            written = len(lines)
+
+        self.stream.flush()
+        self.lines = list(lines)
+        return written
+
+
+def format_duration(millis):
+    if millis is None:
+        return '-'
+    seconds = int(millis) // 1000
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    duration = '%02d:%02d:%02d' % (hours, minutes, seconds)
+    if days:
+        duration = '%dd %s' % (days, duration)
+    return duration
+
+
+def format_bytes(size):
+    if size is None:
+        return '-'
+    size = float(size)
+    for unit in ['B', 'K', 'M', 'G']:
+        if size < 1024:
+            return '%.1f%s' % (size, unit) if unit != 'B' else '%dB' % size
+        size /= 1024
+    return '%.1fT' % size
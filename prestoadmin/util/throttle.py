@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bandwidth limits for the files transferred with put and get, for the
+--host-bandwidth and --total-bandwidth options.
+
+Every transfer takes tokens from token buckets, one byte per token: the
+bucket of the host it goes to or comes from, and the bucket shared by all
+hosts. The buckets fill up at the configured rates and hold at most a
+second worth of tokens. A transfer that runs out of tokens waits until
+the buckets have filled up again. The shared bucket lives in shared
+memory, so it also limits hosts that Fabric handles in parallel
+processes.
+"""
+
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+
+from fabric.api import env
+
+from prestoadmin.util.exception import ConfigurationError
+
+MB = 1024 * 1024
+BURST_SECONDS = 1
+GET_BLOCK_SIZE = 32 * 1024
+
+_limits = {'host_rate': None, 'total_bucket': None}
+_host_buckets = {}
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        """
+        Parameters:
+            rate: Tokens added per second
+            burst: Tokens the bucket holds at most, rate * BURST_SECONDS by
+                default
+        """
+        self.rate = float(rate)
+        self.burst = burst or self.rate * BURST_SECONDS
+        # Tokens and the time they were counted, shared with the processes
+        # forked after the bucket is created
+        self._state = multiprocessing.Array('d', [self.burst, time.time()])
+
+    def reserve(self, count):
+        """
+        Takes count tokens from the bucket, going into debt if there are
+        not enough.
+
+        Returns:
+            The seconds to wait until the debt is paid off
+        """
+        with self._state.get_lock():
+            now = time.time()
+            tokens = min(self.burst, self._state[0] +
+                         (now - self._state[1]) * self.rate) - count
+            self._state[0] = tokens
+            self._state[1] = now
+        return max(0.0, -tokens / self.rate)
+
+
+def set_bandwidth_limits(host_bandwidth=None, total_bandwidth=None):
+    """
+    Sets the bandwidth limits in MB/s; None for no limit. Has to be called
+    before the tasks run, so that processes forked for parallel tasks
+    share the limit for all hosts.
+    """
+    for bandwidth in [host_bandwidth, total_bandwidth]:
+        if bandwidth is not None and bandwidth <= 0:
+            raise ConfigurationError(
+                'Invalid bandwidth %s: must be more than 0 MB/s' % bandwidth)
+    _limits['host_rate'] = host_bandwidth * MB if host_bandwidth else None
+    _limits['total_bucket'] = \
+        TokenBucket(total_bandwidth * MB) if total_bandwidth else None
+    _host_buckets.clear()
+
+
+def get_buckets(host):
+    buckets = []
+    if _limits['host_rate']:
+        if host not in _host_buckets:
+            _host_buckets[host] = TokenBucket(_limits['host_rate'])
+        buckets.append(_host_buckets[host])
+    if _limits['total_bucket']:
+        buckets.append(_limits['total_bucket'])
+    return buckets
+
+
+def describe_limits():
+    limits = []
+    if _limits['host_rate']:
+        limits.append('%.1f MB/s per host' % (_limits['host_rate'] / MB))
+    if _limits['total_bucket']:
+        limits.append('%.1f MB/s in total' %
+                      (_limits['total_bucket'].rate / MB))
+    return ', '.join(limits)
+
+
+@contextmanager
+def throttled(sftp, action, name):
+    """
+    Limits the bandwidth of the put or get on the fabric.sftp.SFTP
+    connection sftp inside the context, and prints a summary of the
+    transfer afterwards.
+    """
+    buckets = get_buckets(env.host)
+    if not buckets:
+        yield
+        return
+    client = sftp.ftp
+    sftp.ftp = ThrottledSFTPClient(client, buckets)
+    start = time.time()
+    try:
+        yield
+    finally:
+        throttled_client = sftp.ftp
+        sftp.ftp = client
+    seconds = max(time.time() - start, 0.001)
+    print('[%s] %s %s: %d bytes in %.1f seconds, %.1f MB/s, waited %.1f '
+          'seconds for the bandwidth limit of %s' % (
+              env.host, action, name, throttled_client.bytes, seconds,
+              throttled_client.bytes / seconds / MB, throttled_client.waited,
+              describe_limits()))
+
+
+class ThrottledSFTPClient(object):
+    """
+    Wraps a paramiko SFTPClient so that put and get take tokens from the
+    buckets for every block.
+    """
+
+    def __init__(self, client, buckets):
+        self._client = client
+        self._buckets = buckets
+        self.bytes = 0
+        self.waited = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def transferred(self, count):
+        self.bytes += count
+        delay = max(bucket.reserve(count) for bucket in self._buckets)
+        if delay:
+            time.sleep(delay)
+            self.waited += delay
+
+    def _callback(self):
+        sizes = [0]
+
+        def callback(size, file_size):
+            self.transferred(size - sizes[0])
+            sizes[0] = size
+        return callback
+
+    def put(self, localpath, remotepath, callback=None, confirm=True):
+        with open(localpath, 'rb') as local_file:
+            return self.putfo(local_file, remotepath,
+                              os.stat(localpath).st_size, confirm=confirm)
+
+    def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True):
+        return self._client.putfo(fl, remotepath, file_size,
+                                  self._callback(), confirm)
+
+    def get(self, remotepath, localpath, callback=None):
+        with open(localpath, 'wb') as local_file:
+            return self.getfo(remotepath, local_file)
+
+    def getfo(self, remotepath, fl, callback=None):
+        # Reads block by block instead of prefetching, which would request
+        # the whole file at once and let it arrive at full speed
+        size = 0
+        with self._client.open(remotepath, 'rb') as remote_file:
+            while True:
+                block = remote_file.read(GET_BLOCK_SIZE)
+                if not block:
+                    break
+                fl.write(block)
+                size += len(block)
+                self.transferred(len(block))
+        return size
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Record of the local rpms that were already verified.
+
+For every file it records its SHA-256 and whether it passed rpm -K, keyed
+by its path, size, modification time and inode, so that a file is hashed
+and checked only once for as long as it doesn't change, across
+presto-admin commands. The record is file backed, so that the jobs fabric
+forks for parallel tasks find what the parent process recorded.
+"""
+
+import json
+import logging
+import os
+import time
+from tempfile import mkstemp
+
+from prestoadmin.util.filesystem import ensure_directory_exists, \
+    sha256_of_file
+from prestoadmin.util.local_config_util import get_config_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+VERIFICATION_CACHE_FILE_NAME = 'verified_files.json'
+MAX_ENTRIES = 256
+
+
+class VerificationCache:
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_config_directory(),
+                                VERIFICATION_CACHE_FILE_NAME)
+        self.path = path
+
+    def lookup(self, local_path):
+        """
+        Returns:
+            What was recorded for the file at local_path, or None if
+            nothing was recorded since it last changed
+        """
+        key = _file_key(local_path)
+        return self._read_entries().get(key) if key else None
+
+    def record(self, local_path, **fields):
+        """
+        Records the fields for the file at local_path, unless it doesn't
+        exist.
+        """
+        key = _file_key(local_path)
+        if not key:
+            return
+        entries = self._read_entries()
+        entry = entries.get(key, {})
+        entry.update(fields)
+        entry['recorded'] = time.time()
+        entries[key] = entry
+        for old_key in sorted(entries, key=lambda k: entries[k]['recorded'],
+                              reverse=True)[MAX_ENTRIES:]:
+            del entries[old_key]
+        self._write_entries(entries)
+
+    def get_sha256(self, local_path):
+        """
+        Returns:
+            The SHA-256 of the file at local_path, computed only if it was
+            not recorded yet
+        """
+        entry = self.lookup(local_path) or {}
+        if not entry.get('sha256'):
+            entry['sha256'] = sha256_of_file(local_path)
+            self.record(local_path, sha256=entry['sha256'])
+        return entry['sha256']
+
+    def is_verified(self, local_path):
+        return bool((self.lookup(local_path) or {}).get('valid'))
+
+    def _read_entries(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_entries(self, entries):
+        try:
+            directory = os.path.dirname(self.path)
+            ensure_directory_exists(directory)
+            fd, temp_path = mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            _LOGGER.warn('Unable to record the verified files: %s' % e)
+
+
+def _file_key(local_path):
+    try:
+        stat = os.stat(local_path)
+    except OSError:
+        return None
+    return '%s:%d:%.6f:%d' % (os.path.realpath(local_path), stat.st_size,
+                              stat.st_mtime, stat.st_ino)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of PrestoClient.run_sql against FakePrestoCoordinator.
+
+Measures the latency and memory use of run_sql for results of different
+sizes, numbers of concurrent clients and with HTTP keep-alive on or off.
+The results are written to a JSON file; pass the file of an earlier run
+with --compare to see how the current version performs relative to it:
+
+    python -m tests.benchmark.prestoclient_benchmark -o new.json \\
+        --compare old.json
+
+Every case runs in its own process so that the peak memory of one case
+does not hide the memory use of the next.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+import prestoadmin
+from prestoadmin.prestoclient import PrestoClient
+from tests.fake_presto_coordinator import FakePrestoCoordinator
+
+DEFAULT_ROW_COUNTS = [1000, 10000, 100000, 1000000, 10000000]
+DEFAULT_CLIENT_COUNTS = [1, 4, 16, 64]
+# Concurrency is measured with results of this size
+CONCURRENCY_ROW_COUNT = 10000
+SQL = 'select * from fake'
+LDAP_USER = 'benchmark'
+LDAP_PASSWORD = 'benchmark'
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _client_for(coordinator, keep_alive, certfile):
+    client = PrestoClient(coordinator.host, 'benchmark',
+                          coordinator.presto_config(), keep_alive=keep_alive)
+    if certfile:
+        # Trust the self-signed certificate of the fake coordinator instead
+        # of fetching the keystore from the cluster.
+        client._get_pem = lambda: certfile
+    return client
+
+
+def run_case(case, certfile=None, keyfile=None):
+    """
+    Runs queries_per_client queries from each of case['clients'] threads
+    and returns the case updated with the measurements.
+    """
+    coordinator = FakePrestoCoordinator(
+        row_count=case['rows'], page_size=case['page_size'],
+        delay=case['delay'], keep_alive=case['keep_alive'],
+        certfile=certfile, keyfile=keyfile,
+        ldap_user=LDAP_USER if case['ldap'] else None,
+        ldap_password=LDAP_PASSWORD if case['ldap'] else None)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run_client():
+        client = _client_for(coordinator, case['keep_alive'], certfile)
+        try:
+            for _ in range(case['queries_per_client']):
+                start = time.time()
+                rows = client.run_sql(SQL, max_rows=None)
+                elapsed = time.time() - start
+                with lock:
+                    if rows is None or len(rows) != case['rows']:
+                        errors.append('got %s rows' % (
+                            None if rows is None else len(rows)))
+                    else:
+                        latencies.append(elapsed)
+                del rows
+        finally:
+            client.close()
+
+    rss_before = _max_rss_kb()
+    with coordinator:
+        threads = [threading.Thread(target=run_client)
+                   for _ in range(case['clients'])]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - start
+        requests = coordinator.request_count
+        connections = coordinator.connection_count
+
+    result = dict(case)
+    result.update({
+        'queries': len(latencies),
+        'errors': errors[:10],
+        'wall_time_s': wall_time,
+        'requests': requests,
+        'connections': connections,
+        'max_rss_kb': _max_rss_kb(),
+        'max_rss_growth_kb': _max_rss_kb() - rss_before,
+    })
+    if latencies:
+        result.update({
+            'latency_min_s': min(latencies),
+            'latency_p50_s': _percentile(latencies, 50),
+            'latency_p95_s': _percentile(latencies, 95),
+            'latency_max_s': max(latencies),
+            'rows_per_s': case['rows'] * len(latencies) / wall_time,
+        })
+    return result
+
+
+def _run_case_in_child(case, certfile, keyfile, results):
+    try:
+        results.put(run_case(case, certfile, keyfile))
+    except Exception as e:
+        failed = dict(case)
+        failed['errors'] = [repr(e)]
+        results.put(failed)
+
+
+def run_case_isolated(case, certfile=None, keyfile=None):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run_case_in_child, args=(case, certfile, keyfile, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def build_cases(options):
+    keep_alive_values = {'on': [True], 'off': [False],
+                         'both': [True, False]}[options.keep_alive]
+    base = {'page_size': options.page_size, 'delay': options.delay,
+            'https': options.https, 'ldap': options.ldap,
+            'queries_per_client': options.queries_per_client}
+    shapes = [(rows, 1) for rows in options.rows] + \
+        [(CONCURRENCY_ROW_COUNT, clients) for clients in options.clients
+         if clients != 1 or CONCURRENCY_ROW_COUNT not in options.rows]
+
+    cases = []
+    for keep_alive in keep_alive_values:
+        for rows, clients in shapes:
+            case = dict(base)
+            case.update({'rows': rows, 'clients': clients,
+                         'keep_alive': keep_alive})
+            cases.append(case)
+    return cases
+
+
+def case_key(case):
+    return (case['rows'], case['clients'], case['keep_alive'],
+            case['page_size'], case['https'], case['ldap'])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = dict((case_key(case), case)
+                        for case in json.load(baseline_file)['results'])
+
+    print('\nCompared to %s (ratio < 1.0 is faster/smaller):' % baseline_path)
+    for result in results:
+        old = baseline.get(case_key(result))
+        if not old or 'latency_p50_s' not in old or \
+                'latency_p50_s' not in result:
+            continue
+        print('rows=%-9d clients=%-3d keep_alive=%-5s p50 x%.2f  '
+              'p95 x%.2f  rss growth %+d KB' % (
+                  result['rows'], result['clients'], result['keep_alive'],
+                  result['latency_p50_s'] / old['latency_p50_s'],
+                  result['latency_p95_s'] / old['latency_p95_s'],
+                  result['max_rss_growth_kb'] - old['max_rss_growth_kb']))
+
+
+def generate_certificate(directory):
+    certfile = os.path.join(directory, 'fake-coordinator.pem')
+    keyfile = os.path.join(directory, 'fake-coordinator.key')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-subj', '/CN=127.0.0.1', '-days', '1',
+             '-keyout', keyfile, '-out', certfile],
+            stdout=devnull, stderr=devnull)
+    return certfile, keyfile
+
+
+def _int_list(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+
+def parse_options(args):
+    parser = OptionParser(usage='python -m tests.benchmark.prestoclient_benchmark [options]')
+    parser.add_option('-o', '--output', default='prestoclient-benchmark.json',
+                      help='file to write the results to')
+    parser.add_option('--compare', metavar='FILE',
+                      help='results of an earlier run to compare against')
+    parser.add_option('--rows', type='string', action='callback',
+                      callback=_int_list, default=DEFAULT_ROW_COUNTS,
+                      help='comma separated result sizes for one client')
+    parser.add_option('--clients', type='string', action='callback',
+                      callback=_int_list, default=DEFAULT_CLIENT_COUNTS,
+                      help='comma separated numbers of concurrent clients, '
+                           'each fetching %d rows' % CONCURRENCY_ROW_COUNT)
+    parser.add_option('--keep-alive', choices=['on', 'off', 'both'],
+                      default='both')
+    parser.add_option('--page-size', type='int', default=1000,
+                      help='rows per response from the coordinator')
+    parser.add_option('--delay', type='float', default=0,
+                      help='seconds the coordinator waits before each response')
+    parser.add_option('--queries-per-client', type='int', default=3)
+    parser.add_option('--https', action='store_true', default=False,
+                      help='serve HTTPS with a generated self-signed certificate')
+    parser.add_option('--ldap', action='store_true', default=False,
+                      help='require LDAP credentials; implies --https')
+    options, _ = parser.parse_args(args)
+    if options.ldap:
+        options.https = True
+    return options
+
+
+def main(args):
+    options = parse_options(args)
+    cert_dir = tempfile.mkdtemp(prefix='prestoclient-benchmark-')
+    try:
+        certfile = keyfile = None
+        if options.https:
+            certfile, keyfile = generate_certificate(cert_dir)
+
+        results = []
+        for case in build_cases(options):
+            result = run_case_isolated(case, certfile, keyfile)
+            results.append(result)
+            print('rows=%-9d clients=%-3d keep_alive=%-5s p50=%.4fs '
+                  'p95=%.4fs rss growth=%d KB errors=%d' % (
+                      result['rows'], result['clients'], result['keep_alive'],
+                      result.get('latency_p50_s', float('nan')),
+                      result.get('latency_p95_s', float('nan')),
+                      result.get('max_rss_growth_kb', 0),
+                      len(result['errors'])))
+    finally:
+        shutil.rmtree(cert_dir)
+
+    with open(options.output, 'w') as output:
+        json.dump({'prestoadmin_version': prestoadmin.__version__,
+                   'python_version': platform.python_version(),
+                   'platform': platform.platform(),
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': results}, output, indent=4, sort_keys=True)
+    print('Results written to %s' % options.output)
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
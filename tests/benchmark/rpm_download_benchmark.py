@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the rpm download against FakeRpmRepository.
+
+Measures the throughput of download_in_ranges for different numbers of
+ranges, with the bandwidth of every connection to the repository limited
+like on a mirror that throttles its connections. The serial download of
+PrestoRpmDownloader, on one connection, is measured as the baseline. The
+results are written to a JSON file:
+
+    python -m tests.benchmark.rpm_download_benchmark --size 64 \\
+        --ranges 1,2,4,8 --bandwidth 8
+"""
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import prestoadmin
+from prestoadmin.server import UrlHandler, PrestoRpmDownloader
+from prestoadmin.util.ranged_download import download_in_ranges
+from tests.fake_rpm_repository import FakeRpmRepository
+
+DEFAULT_RANGE_COUNTS = [1, 2, 4, 8, 16]
+MB = 1024 * 1024
+
+
+def download_serially(url, download_dir):
+    with UrlHandler(url) as url_handler:
+        PrestoRpmDownloader(url_handler, download_dir).download_rpm()
+
+
+def run_case(content, range_count, bandwidth, download_dir):
+    """
+    Returns the seconds it took to download content in range_count ranges,
+    or serially in one stream if range_count is None.
+    """
+    path = os.path.join(download_dir, 'presto-server-rpm.rpm')
+    with FakeRpmRepository(content, accept_ranges=range_count is not None,
+                           bandwidth=bandwidth) as repository:
+        start = time.time()
+        if range_count is None:
+            download_serially(repository.url, download_dir)
+        else:
+            download_in_ranges(repository.url, path, len(content),
+                               range_count)
+        seconds = time.time() - start
+    os.remove(path)
+    return seconds
+
+
+def _int_list(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+
+def parse_options(args):
+    parser = OptionParser(usage='python -m tests.benchmark.rpm_download_benchmark [options]')
+    parser.add_option('-o', '--output', default='rpm-download-benchmark.json',
+                      help='file to write the results to')
+    parser.add_option('--size', type='int', default=64,
+                      help='size of the rpm in MB')
+    parser.add_option('--ranges', type='string', action='callback',
+                      callback=_int_list, default=DEFAULT_RANGE_COUNTS,
+                      help='comma separated numbers of ranges')
+    parser.add_option('--bandwidth', type='float', default=8,
+                      help='MB/s each connection to the repository is '
+                           'limited to, 0 for no limit')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='downloads per number of ranges; the fastest '
+                           'one counts')
+    options, _ = parser.parse_args(args)
+    return options
+
+
+def main(args):
+    options = parse_options(args)
+    content = os.urandom(options.size * MB)
+    bandwidth = options.bandwidth * MB or None
+    download_dir = tempfile.mkdtemp(prefix='rpm-download-benchmark-')
+    results = []
+    try:
+        for range_count in [None] + options.ranges:
+            seconds = min(run_case(content, range_count, bandwidth,
+                                   download_dir)
+                          for _ in range(options.repeat))
+            result = {'ranges': range_count, 'seconds': seconds,
+                      'mb_per_s': options.size / seconds}
+            results.append(result)
+            print('ranges=%-6s %.2fs %.1f MB/s' % (
+                'serial' if range_count is None else range_count,
+                seconds, result['mb_per_s']))
+    finally:
+        shutil.rmtree(download_dir)
+
+    serial = results[0]['seconds']
+    for result in results:
+        result['speedup'] = serial / result['seconds']
+
+    with open(options.output, 'w') as output:
+        json.dump({'prestoadmin_version': prestoadmin.__version__,
+                   'python_version': platform.python_version(),
+                   'platform': platform.platform(),
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'size_mb': options.size,
+                   'bandwidth_mb_per_s': options.bandwidth,
+                   'results': results}, output, indent=4, sort_keys=True)
+    print('Results written to %s' % options.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
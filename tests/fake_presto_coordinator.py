@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process stand-in for a Presto coordinator, for testing and benchmarking
+PrestoClient without a cluster.
+
+FakePrestoCoordinator implements the paging protocol of /v1/statement:
+a POST creates a query, every GET on its 'nextUri' returns the next page
+of rows and a DELETE cancels it. The result of every query is a generated
+table of row_count rows. Rows are generated on the fly, so even results
+with millions of rows don't use any memory on the server side.
+
+It also serves the node endpoints used to drain a worker: a PUT on
+/v1/info/state changes the state of the node and GET /v1/task lists its
+tasks. Once the node is SHUTTING_DOWN, every listing finishes one task.
+"""
+
+import base64
+import json
+import re
+import socket
+import ssl
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from prestoadmin.util.presto_config import PrestoConfig
+
+STATEMENT_PATH = '/v1/statement'
+QUERY_PATH_PATTERN = re.compile(r'^/v1/statement/([^/]+)/(\d+)$')
+NODE_STATE_PATH = '/v1/info/state'
+TASK_PATH = '/v1/task'
+COLUMNS = [{'name': 'id', 'type': 'bigint'},
+           {'name': 'name', 'type': 'varchar'}]
+
+
+class _ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients closing kept-alive connections are not worth a traceback
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class _FakeQuery(object):
+    def __init__(self, query_id, sql, row_count):
+        self.query_id = query_id
+        self.sql = sql
+        self.row_count = row_count
+        self.created = time.time()
+        self.cancelled = False
+
+
+class FakePrestoCoordinator(object):
+    """
+    Parameters:
+        row_count: Number of rows every query returns
+        page_size: Number of rows per response
+        queued_polls: Number of responses in QUEUED state, without data,
+            before the first page of data
+        delay: Seconds to wait before answering each request
+        keep_alive: Whether to support persistent HTTP/1.1 connections
+        certfile, keyfile: Serve HTTPS with this certificate and key
+        ldap_user, ldap_password: Require these credentials in a Basic
+            Authorization header, like a coordinator set up with LDAP
+        active_tasks: Number of tasks running on the node
+    """
+
+    def __init__(self, row_count=1000, page_size=1000, queued_polls=0,
+                 delay=0, keep_alive=True, certfile=None, keyfile=None,
+                 ldap_user=None, ldap_password=None, host='127.0.0.1',
+                 port=0, active_tasks=0):
+        self.row_count = row_count
+        self.page_size = page_size
+        self.queued_polls = queued_polls
+        self.delay = delay
+        self.keep_alive = keep_alive
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.ldap_user = ldap_user
+        self.ldap_password = ldap_password
+        self.active_tasks = active_tasks
+        self.node_state = 'ACTIVE'
+
+        self.queries = {}
+        self.request_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        self._next_query_id = 0
+
+        self.server = _ThreadedHTTPServer((host, port), self._handler_class())
+        if certfile:
+            self.server.socket = ssl.wrap_socket(
+                self.server.socket, keyfile=keyfile, certfile=certfile,
+                server_side=True)
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    @property
+    def scheme(self):
+        return 'https' if self.certfile else 'http'
+
+    def presto_config(self):
+        """
+        Returns a PrestoConfig that points PrestoClient at this server.
+        """
+        properties = {'http-server.http.port': str(self.port),
+                      'http-server.https.port': str(self.port)}
+        if self.certfile:
+            properties['http-server.http.enabled'] = 'false'
+            properties['http-server.https.enabled'] = 'true'
+        if self.ldap_user:
+            properties['http-server.authentication.type'] = 'LDAP'
+            properties['internal-communication.authentication.ldap.user'] = \
+                self.ldap_user
+            properties['internal-communication.authentication.ldap.password'] = \
+                self.ldap_password
+        return PrestoConfig(properties, 'FAKE_PATH', self.host)
+
+    @property
+    def cancelled_queries(self):
+        return [query for query in self.queries.values() if query.cancelled]
+
+    def _create_query(self, sql):
+        with self._lock:
+            query_id = '%s_%05d_fake' % (time.strftime('%Y%m%d_%H%M%S'),
+                                         self._next_query_id)
+            self._next_query_id += 1
+            query = _FakeQuery(query_id, sql, self.row_count)
+            self.queries[query_id] = query
+        return query
+
+    def _count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def _count_connection(self):
+        with self._lock:
+            self.connection_count += 1
+
+    def _list_tasks(self):
+        with self._lock:
+            tasks = [{'taskStatus': {'taskId': 'task.%d' % i,
+                                     'state': 'RUNNING'}}
+                     for i in range(self.active_tasks)]
+            if self.node_state == 'SHUTTING_DOWN' and self.active_tasks:
+                self.active_tasks -= 1
+        return tasks + [{'taskStatus': {'taskId': 'task.done',
+                                        'state': 'FINISHED'}}]
+
+    def _is_authorized(self, authorization):
+        if not self.ldap_user:
+            return True
+        expected = 'Basic ' + base64.b64encode(
+            '%s:%s' % (self.ldap_user, self.ldap_password))
+        return authorization == expected
+
+    def _page_count(self, query):
+        return (query.row_count + self.page_size - 1) // self.page_size
+
+    def _response_for(self, query, token):
+        """
+        Builds the response to the request with the given token. Tokens
+        before queued_polls are answered in QUEUED state without data; the
+        remaining ones each carry one page of rows.
+        """
+        response = {'id': query.query_id,
+                    'infoUri': '%s://%s:%s/v1/query/%s' %
+                               (self.scheme, self.host, self.port,
+                                query.query_id)}
+
+        page = token - self.queued_polls
+        pages = self._page_count(query)
+        if page < 0:
+            state = 'QUEUED'
+        elif page < pages:
+            start = page * self.page_size
+            end = min(start + self.page_size, query.row_count)
+            response['columns'] = COLUMNS
+            response['data'] = [[i, 'row-%d' % i] for i in xrange(start, end)]
+            state = 'RUNNING'
+        else:
+            state = 'FINISHED'
+
+        if state != 'FINISHED':
+            response['nextUri'] = '%s://%s:%s%s/%s/%d' % (
+                self.scheme, self.host, self.port, STATEMENT_PATH,
+                query.query_id, token + 1)
+
+        completed = max(0, min(page, pages))
+        response['stats'] = {
+            'state': state,
+            'queued': state == 'QUEUED',
+            'scheduled': state != 'QUEUED',
+            'nodes': 1,
+            'totalSplits': pages,
+            'queuedSplits': pages - completed if state == 'QUEUED' else 0,
+            'runningSplits': 1 if state == 'RUNNING' else 0,
+            'completedSplits': completed,
+            'elapsedTimeMillis': int((time.time() - query.created) * 1000),
+            'processedRows': min(completed * self.page_size, query.row_count),
+            'processedBytes': min(completed * self.page_size,
+                                  query.row_count) * 16}
+        return response
+
+    def _handler_class(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' if coordinator.keep_alive \
+                else 'HTTP/1.0'
+            # Send every response in one write. Writing the status line and
+            # headers separately stalls kept-alive connections on delayed
+            # ACKs, which a real coordinator doesn't do.
+            wbufsize = -1
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                self.connection.setsockopt(socket.IPPROTO_TCP,
+                                           socket.TCP_NODELAY, 1)
+                coordinator._count_connection()
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=None):
+                payload = json.dumps(body) if body is not None else ''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if not coordinator.keep_alive:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(payload)
+                self.wfile.flush()
+
+            def _prepare(self):
+                coordinator._count_request()
+                if coordinator.delay:
+                    time.sleep(coordinator.delay)
+                if not coordinator._is_authorized(
+                        self.headers.getheader('Authorization')):
+                    self._send(401, {'message': 'Unauthorized'})
+                    return False
+                return True
+
+            def _lookup_query(self):
+                match = QUERY_PATH_PATTERN.match(self.path)
+                if not match or match.group(1) not in coordinator.queries:
+                    self._send(404, {'message': 'Unknown query'})
+                    return None, None
+                return coordinator.queries[match.group(1)], \
+                    int(match.group(2))
+
+            def do_POST(self):
+                length = int(self.headers.getheader('Content-Length') or 0)
+                sql = self.rfile.read(length)
+                if not self._prepare():
+                    return
+                if self.path != STATEMENT_PATH:
+                    self._send(404, {'message': 'Unknown path'})
+                    return
+                if not self.headers.getheader('X-Presto-User'):
+                    self._send(400, {'message': 'User must be set'})
+                    return
+                query = coordinator._create_query(sql)
+                self._send(200, coordinator._response_for(query, 0))
+
+            def do_GET(self):
+                if not self._prepare():
+                    return
+                if self.path == TASK_PATH:
+                    self._send(200, coordinator._list_tasks())
+                    return
+                query, token = self._lookup_query()
+                if query is None:
+                    return
+                if query.cancelled:
+                    self._send(410, {'message': 'Query was cancelled'})
+                    return
+                self._send(200, coordinator._response_for(query, token))
+
+            def do_PUT(self):
+                length = int(self.headers.getheader('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if not self._prepare():
+                    return
+                if self.path != NODE_STATE_PATH:
+                    self._send(404, {'message': 'Unknown path'})
+                    return
+                coordinator.node_state = json.loads(body)
+                self._send(200)
+
+            def do_DELETE(self):
+                if not self._prepare():
+                    return
+                query, _ = self._lookup_query()
+                if query is None:
+                    return
+                query.cancelled = True
+                self._send(204)
+
+        return Handler
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process stand-in for the repository that Presto rpms are downloaded
+from, for testing and benchmarking the rpm downloads without a network.
+
+FakeRpmRepository serves one file at RPM_PATH. It answers range requests
+with 206 Partial Content, unless it is told not to support them, can limit
+the bandwidth of every connection, like mirrors that throttle their
+connections, and can cut off the first responses to range requests part
+way through.
+"""
+
+import re
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+from tests.fake_presto_coordinator import _ThreadedHTTPServer
+
+RPM_PATH = '/presto-server-rpm.rpm'
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class FakeRpmRepository(object):
+    """
+    Parameters:
+        content: The content of the file
+        accept_ranges: Whether to answer range requests
+        bandwidth: Bytes per second each connection sends at most, or None
+        failures: Number of responses to range requests to cut off
+        fail_after: Bytes sent before a response is cut off
+        etag: The ETag of the file
+    """
+
+    def __init__(self, content, accept_ranges=True, bandwidth=None,
+                 failures=0, fail_after=0, etag='"v1"', host='127.0.0.1',
+                 port=0):
+        self.content = content
+        self.accept_ranges = accept_ranges
+        self.bandwidth = bandwidth
+        self.failures = failures
+        self.fail_after = fail_after
+        self.etag = etag
+
+        self.request_count = 0
+        self.ranges = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self.server = _ThreadedHTTPServer((host, port), self._handler_class())
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    @property
+    def url(self):
+        return 'http://%s:%d%s' % (self.host, self.port, RPM_PATH)
+
+    def _count_request(self, byte_range):
+        with self._lock:
+            self.request_count += 1
+            if byte_range:
+                self.ranges.append(byte_range)
+            if byte_range and self.failures:
+                self.failures -= 1
+                return True
+        return False
+
+    def _count_bytes(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def _handler_class(self):
+        repository = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != RPM_PATH:
+                    self.send_error(404)
+                    return
+                length = len(repository.content)
+                match = RANGE_PATTERN.match(self.headers.get('Range', ''))
+                byte_range = None
+                if repository.accept_ranges and match:
+                    first = int(match.group(1))
+                    last = min(int(match.group(2) or length - 1), length - 1)
+                    byte_range = (first, last)
+                cut_off = repository._count_request(byte_range)
+
+                if byte_range:
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                                     (first, last, length))
+                else:
+                    first, last = 0, length - 1
+                    self.send_response(200)
+                if repository.accept_ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Type', 'application/x-rpm')
+                self.send_header('Content-Length', str(last - first + 1))
+                self.send_header('ETag', repository.etag)
+                self.end_headers()
+
+                end = last + 1
+                if cut_off:
+                    end = min(end, first + repository.fail_after)
+                self._send(first, end)
+
+            def _send(self, first, end):
+                offset = first
+                while offset < end:
+                    block = repository.content[
+                        offset:min(offset + SEND_BLOCK_SIZE, end)]
+                    self.wfile.write(block)
+                    offset += len(block)
+                    repository._count_bytes(len(block))
+                    if repository.bandwidth:
+                        time.sleep(float(len(block)) / repository.bandwidth)
+
+        return Handler
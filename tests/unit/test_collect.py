@@ -188,13 +188,14 @@ class TestCollect(BaseUnitCase):
 
     @patch("prestoadmin.collect.get_files")
     @patch("prestoadmin.collect.append")
+    @patch("prestoadmin.collect.get_presto_package")
     @patch("prestoadmin.collect.get_presto_version")
     @patch("prestoadmin.collect.get_java_version")
     @patch("prestoadmin.collect.get_platform_information")
     @patch('prestoadmin.collect.run')
     def test_get_system_info(self, run_collect_mock,
                              plat_info_mock, java_version_mock,
-                             server_version_mock,
+                             server_version_mock, package_mock,
                              append_mock, get_files_mock):
         downloaded_sys_info_loc = path.join(TMP_PRESTO_DEBUG, "sysinfo")
         version_info_file_name = path.join(TMP_PRESTO_DEBUG_REMOTE,
@@ -206,6 +207,9 @@ class TestCollect(BaseUnitCase):
         plat_info_mock.return_value = platform_info
         java_version_mock.return_value = java_version
         server_version_mock.return_value = server_version
+        package_mock.return_value = {'name': 'presto-server-rpm',
+                                     'version': '0.130',
+                                     'install_time': 1451606400}
 
         collect.get_system_info(downloaded_sys_info_loc)
 
@@ -227,5 +231,10 @@ class TestCollect(BaseUnitCase):
                                     'Presto server version: ' +
                                     server_version + '\n')
 
+        append_mock.assert_any_call(version_info_file_name,
+                                    'Presto server package: '
+                                    'presto-server-rpm-0.130 '
+                                    'installed 2016-01-01 00:00:00 UTC\n')
+
         get_files_mock.assert_called_with(version_info_file_name,
                                           downloaded_sys_info_loc)
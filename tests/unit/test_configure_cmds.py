@@ -12,15 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 from fabric.state import env
 from mock import patch
 from prestoadmin.util import constants
 from prestoadmin import configure_cmds
+from prestoadmin.util.host_facts import parse_facts
 from tests.unit.base_unit_case import BaseUnitCase
 
 
+FACTS_OUTPUT = '''#presto-admin:node.properties
+node.id=abc
+#presto-admin:config.properties
+coordinator=false
+http-server.http.port=8080
+#presto-admin:jvm.config
+-server
+-Xmx16G
+#presto-admin:log.properties
+#presto-admin:unreadable
+'''
+
+
 class TestConfigureCmds(BaseUnitCase):
+    def setUp(self):
+        super(TestConfigureCmds, self).setUp(capture_output=True)
+
     @patch('prestoadmin.configure_cmds.get')
     @patch('prestoadmin.configure_cmds.files.exists')
     def test_config_show(self, mock_file_exists, mock_get):
@@ -102,3 +120,38 @@ class TestConfigureCmds(BaseUnitCase):
         configure_cmds.deploy("workers")
         mock_workers.assert_called_with()
         assert not mock_coordinator.called
+
+    @patch('prestoadmin.configure_cmds.warn')
+    @patch('prestoadmin.configure_cmds.get_host_facts')
+    def test_config_show_csv(self, mock_facts, mock_warn):
+        mock_facts.return_value = parse_facts(FACTS_OUTPUT)
+        env.output_format = 'csv'
+        for host in ['host1', 'host2']:
+            env.host = host
+            configure_cmds.show()
+        lines = self.test_stdout.getvalue().splitlines()
+        self.assertEqual('host,file,path,key,value,fetch_ms', lines[0])
+        self.assertEqual(11, len(lines))
+        self.assertTrue(lines[1].startswith(
+            'host1,node.properties,/etc/presto/node.properties,node.id,abc,'))
+        self.assertTrue(lines[2].startswith(
+            'host1,jvm.config,/etc/presto/jvm.config,-server,,'))
+        self.assertTrue(lines[6].startswith('host2,'))
+        # A missing log.properties is fine, as with the text output
+        self.assertFalse(mock_warn.called)
+
+    @patch('prestoadmin.configure_cmds.warn')
+    @patch('prestoadmin.configure_cmds.get_host_facts')
+    def test_config_show_json_single_file(self, mock_facts, mock_warn):
+        mock_facts.return_value = parse_facts(FACTS_OUTPUT)
+        env.output_format = 'json'
+        env.host = 'host1'
+        configure_cmds.show('config')
+        configure_cmds.show('log')
+        documents = [json.loads(line) for line in
+                     self.test_stdout.getvalue().splitlines()]
+        self.assertEqual(['coordinator', 'http-server.http.port'],
+                         [record['key'] for record in documents[0]['records']])
+        self.assertEqual([], documents[1]['records'])
+        mock_warn.assert_called_with('No configuration file found for host1 '
+                                     'at /etc/presto/log.properties')
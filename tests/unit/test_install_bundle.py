@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests installing the servers from a single bundle per host
+"""
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import patch
+
+from prestoadmin import install_bundle
+from prestoadmin.install_bundle import build_bundle, install_bundle as \
+    install_bundle_task, install_bundles, parse_results, prepare_host, \
+    render_script, REMOTE_BUNDLE_DIR
+from prestoadmin.util.exception import ConfigurationError
+from tests.unit.base_unit_case import BaseUnitCase
+
+CONF = {'node.properties': {'node.environment': 'presto',
+                            'node.data-dir': '/var/lib/presto/data'},
+        'jvm.config': ['-server', '-Xmx16G'],
+        'config.properties': {'coordinator': 'false'},
+        'log.properties': {'com.facebook.presto': 'INFO'}}
+
+SCRIPT_OUTPUT = '''Preparing packages...
+#presto-admin-result:rpm ok presto-server-rpm.rpm
+#presto-admin-result:presto_user ok 1s
+#presto-admin-result:configs ok config.properties jvm.config
+#presto-admin-result:catalogs ok jmx.properties tpch.properties'''
+
+
+class TestInstallBundle(BaseUnitCase):
+    def setUp(self):
+        super(TestInstallBundle, self).setUp(capture_output=True)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.catalog_dir = os.path.join(self.directory, 'catalog')
+        os.mkdir(self.catalog_dir)
+        for name in ['tpch.properties', 'jmx.properties']:
+            with open(os.path.join(self.catalog_dir, name), 'w') as f:
+                f.write('connector.name=%s\n' % name.split('.')[0])
+        self.rpm_path = os.path.join(self.directory,
+                                     'presto-server-rpm.rpm')
+        with open(self.rpm_path, 'wb') as f:
+            f.write('rpm' * 1000)
+        self.bundle_dir = os.path.join(self.directory, 'bundles')
+        os.mkdir(self.bundle_dir)
+
+        for module in ['prestoadmin.install_bundle', 'prestoadmin.catalog']:
+            catalog_patcher = patch(module + '.get_catalog_directory',
+                                    return_value=self.catalog_dir)
+            catalog_patcher.start()
+            self.addCleanup(catalog_patcher.stop)
+        # Keep the record of the rpm checksum out of the real config
+        # directory
+        config_patcher = patch(
+            'prestoadmin.util.verification_cache.get_config_directory',
+            return_value=os.path.join(self.directory, 'config'))
+        config_patcher.start()
+        self.addCleanup(config_patcher.stop)
+
+    def build(self, include_rpm=True):
+        return build_bundle(self.bundle_dir, self.rpm_path, CONF,
+                            install_bundle.get_catalog_files(),
+                            include_rpm=include_rpm)
+
+    def test_bundle_contents(self):
+        with tarfile.open(self.build()) as bundle:
+            members = dict((member.name, member) for member in bundle)
+            self.assertEqual(
+                ['catalog/jmx.properties', 'catalog/tpch.properties',
+                 'etc/config.properties', 'etc/jvm.config',
+                 'etc/log.properties', 'etc/node.properties', 'install.sh',
+                 'rpm/presto-server-rpm.rpm'],
+                sorted(members))
+            self.assertEqual(0755, members['install.sh'].mode)
+            self.assertEqual(0600, members['etc/jvm.config'].mode)
+            self.assertEqual(0, members['etc/jvm.config'].mtime)
+            self.assertEqual(
+                'node.data-dir=/var/lib/presto/data\n'
+                'node.environment=presto\n',
+                bundle.extractfile('etc/node.properties').read())
+            self.assertEqual('-server\n-Xmx16G\n',
+                             bundle.extractfile('etc/jvm.config').read())
+            self.assertEqual('connector.name=jmx\n', bundle.extractfile(
+                'catalog/jmx.properties').read())
+            self.assertEqual('rpm' * 1000, bundle.extractfile(
+                'rpm/presto-server-rpm.rpm').read())
+
+    def test_same_content_gives_the_same_bundle(self):
+        bundle_path = self.build()
+        with open(bundle_path, 'rb') as f:
+            content = f.read()
+        os.remove(bundle_path)
+        self.assertEqual(bundle_path, self.build())
+        with open(bundle_path, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+        without_rpm = self.build(include_rpm=False)
+        self.assertNotEqual(bundle_path, without_rpm)
+        with tarfile.open(without_rpm) as bundle:
+            self.assertFalse('rpm/presto-server-rpm.rpm' in
+                             bundle.getnames())
+
+    def test_invalid_catalog_stops_the_install(self):
+        with open(os.path.join(self.catalog_dir, 'bad.properties'), 'w') as f:
+            f.write('a=b\n')
+        self.assertRaises(ConfigurationError,
+                          install_bundle.get_catalog_files)
+
+        shutil.rmtree(self.catalog_dir)
+        self.assertEqual([], install_bundle.get_catalog_files())
+
+    def test_script(self):
+        env.nodeps = True
+        env.java8_home = '/usr/java/jdk1.8.0_40'
+        script = render_script('presto-server-rpm.rpm')
+        self.assertTrue("JAVA8_HOME='/usr/java/jdk1.8.0_40'; export "
+                        "JAVA8_HOME" in script)
+        self.assertTrue("rpm -i --nodeps "
+                        "'/opt/prestoadmin/packages/presto-server-rpm.rpm'"
+                        in script)
+        self.assertEqual(0, subprocess.call(['sh', '-n', '-c', script]))
+
+    def test_parse_results(self):
+        self.assertEqual(
+            {'rpm': {'status': 'ok', 'detail': 'presto-server-rpm.rpm'},
+             'presto_user': {'status': 'ok', 'detail': '1s'},
+             'configs': {'status': 'ok',
+                         'detail': 'config.properties jvm.config'},
+             'catalogs': {'status': 'ok',
+                          'detail': 'jmx.properties tpch.properties'}},
+            parse_results(SCRIPT_OUTPUT))
+        self.assertEqual(
+            {'rpm': {'status': 'failed', 'detail': 'package is installed'}},
+            parse_results('#presto-admin-result:rpm failed package is '
+                          'installed \n'))
+
+    @patch('prestoadmin.install_bundle.get_local_sha256', return_value='abc')
+    @patch('prestoadmin.install_bundle.sudo')
+    def test_prepare_host(self, mock_sudo, unused_mock_sha256):
+        mock_sudo.return_value = _AttributeString(
+            'abc  /opt/prestoadmin/packages/presto-server-rpm.rpm')
+        self.assertTrue(prepare_host(self.rpm_path))
+        mock_sudo.assert_called_with(
+            'install -d -m 700 /opt/prestoadmin/packages/bundles && '
+            '(sha256sum /opt/prestoadmin/packages/presto-server-rpm.rpm '
+            '2>/dev/null || true)')
+        mock_sudo.return_value = _AttributeString('')
+        self.assertFalse(prepare_host(self.rpm_path))
+
+    @patch('prestoadmin.install_bundle.get_role_confs',
+           return_value={'coordinator': CONF, 'workers': CONF})
+    @patch('prestoadmin.install_bundle.execute')
+    def test_install_bundles(self, mock_execute, unused_mock_confs):
+        bundles = {}
+
+        def fake_execute(task, *args, **kwargs):
+            if task == prepare_host:
+                return {'master': True, 'slave1': False, 'slave2': False}
+            bundles.update(args[0])
+            for path in args[0].values():
+                self.assertTrue(os.path.isfile(path))
+            return {'master': {}, 'slave1': {}, 'slave2': {}}
+        mock_execute.side_effect = fake_execute
+
+        install_bundles(self.rpm_path, ['master', 'slave1', 'slave2'])
+        self.assertEqual(install_bundle_task,
+                         mock_execute.call_args[0][0])
+        self.assertEqual(['master', 'slave1', 'slave2'],
+                         mock_execute.call_args[1]['hosts'])
+        self.assertEqual(bundles['slave1'], bundles['slave2'])
+        self.assertNotEqual(bundles['master'], bundles['slave1'])
+        # The bundles only live for the install
+        self.assertFalse(os.path.exists(os.path.dirname(bundles['master'])))
+
+    @patch('prestoadmin.install_bundle.execute')
+    def test_install_bundles_without_hosts(self, mock_execute):
+        self.assertEqual({}, install_bundles(self.rpm_path, []))
+        self.assertFalse(mock_execute.called)
+
+    @patch('prestoadmin.install_bundle.forget_host_facts')
+    @patch('prestoadmin.install_bundle.put')
+    @patch('prestoadmin.install_bundle.sudo')
+    def test_install_bundle(self, mock_sudo, mock_put, mock_forget):
+        env.host = 'slave1'
+        bundle_path = self.build()
+        mock_sudo.return_value = _AttributeString(SCRIPT_OUTPUT)
+        mock_sudo.return_value.succeeded = True
+
+        results = install_bundle_task({'slave1': bundle_path})
+
+        self.assertEqual(parse_results(SCRIPT_OUTPUT), results)
+        mock_put.assert_called_with(bundle_path, REMOTE_BUNDLE_DIR,
+                                    use_sudo=True, mode=0600)
+        remote_path = os.path.join(REMOTE_BUNDLE_DIR,
+                                   os.path.basename(bundle_path))
+        extract_dir = remote_path[:-len('.tar')]
+        mock_sudo.assert_called_with(
+            'rm -rf %(dir)s && mkdir -m 700 %(dir)s && '
+            'tar -xf %(bundle)s -C %(dir)s && sh %(dir)s/install.sh; '
+            'status=$?; rm -rf %(dir)s %(bundle)s; exit $status' %
+            {'dir': extract_dir, 'bundle': remote_path})
+        mock_forget.assert_called_with('slave1')
+        output = self.test_stdout.getvalue()
+        self.assertTrue('Package installed successfully on: slave1' in output)
+        self.assertTrue('Deploying configuration on: slave1' in output)
+        self.assertTrue('Deploying jmx.properties, tpch.properties catalog '
+                        'configurations on: slave1' in output)
+
+    @patch('prestoadmin.install_bundle.forget_host_facts')
+    @patch('prestoadmin.install_bundle.upload_in_chunks')
+    @patch('prestoadmin.install_bundle.needs_chunks', return_value=True)
+    @patch('prestoadmin.install_bundle.sudo')
+    def test_install_bundle_fails(self, mock_sudo, unused_mock_needs_chunks,
+                                  mock_upload, unused_mock_forget):
+        env.host = 'slave1'
+        bundle_path = self.build()
+        mock_sudo.return_value = _AttributeString(
+            '#presto-admin-result:rpm ok presto-server-rpm.rpm\n'
+            '#presto-admin-result:presto_user failed the rpm did not create '
+            'the presto user')
+        mock_sudo.return_value.succeeded = False
+
+        self.assertRaisesRegexp(
+            SystemExit, '', install_bundle_task, {'slave1': bundle_path})
+        mock_upload.assert_called_with(bundle_path, REMOTE_BUNDLE_DIR)
+        self.assertTrue('Failed to install Presto on slave1: presto_user: '
+                        'the rpm did not create the presto user' in
+                        self.test_stderr.getvalue())
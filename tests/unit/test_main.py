@@ -396,6 +396,40 @@ class TestMain(BaseMainCase):
                         'coordinators, workers, SSH port, and SSH username)'
                         '\n\n' in self.test_stdout.getvalue())
 
+    @patch('prestoadmin.main.execute', return_value={})
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_options_only_some_tasks_take(self, unused_mock_load,
+                                          mock_execute):
+        # option, a task that takes it and one that doesn't
+        for option, valid, invalid in [
+                (['--rolling'], 'server restart', 'topology show'),
+                (['--batch-size', '2'], 'server upgrade', 'server start'),
+                (['--pause', '5'], 'server restart', 'server stop'),
+                (['--abort-threshold', '1'], 'server restart', 'server stop'),
+                (['--drain'], 'server stop', 'server start'),
+                (['--drain-timeout', '60'], 'server stop', 'server start'),
+                (['--watch'], 'server status', 'topology show'),
+                (['--interval', '5'], 'server status', 'server start'),
+                (['--format', 'json'], 'topology show', 'server start'),
+                (['--tree'], 'file copy', 'server start'),
+                (['--pull'], 'package install', 'server start'),
+                (['--seed-count', '3'], 'server install', 'server start'),
+                (['--pull-concurrency', '3'], 'server upgrade', 'server start'),
+                (['--skip-preflight'], 'server install', 'server start')]:
+            message = 'Invalid argument %s to task: %s\n' % (
+                option[0], invalid.replace(' ', '.'))
+            try:
+                main.main(invalid.split() + option)
+                self.fail('%s accepted by %s' % (option[0], invalid))
+            except SystemExit as e:
+                self.assertEqual(e.code, 2)
+            self.assertTrue(message in self.test_stderr.getvalue(), message)
+
+            mock_execute.reset_mock()
+            main.main(valid.split() + option)
+            self.assertEqual(valid.replace(' ', '.'),
+                             mock_execute.call_args[0][0])
+
     @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
     def test_skip_bad_hosts(self, unused_mock_load):
         main.parse_and_validate_commands(['server', 'install',
@@ -12,29 +12,104 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import tempfile
+
 from fabric.state import env
 from fabric.operations import _AttributeString
 from mock import patch
 from prestoadmin import package
 from prestoadmin.util import constants
+from prestoadmin.util.host_facts import parse_facts
 from tests.unit.base_unit_case import BaseUnitCase
 
 
 class TestPackage(BaseUnitCase):
+    def setUp(self):
+        super(TestPackage, self).setUp()
+        # Keep the record of verified rpms out of the real config directory
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        patcher = patch(
+            'prestoadmin.util.verification_cache.get_config_directory',
+            return_value=config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
+    @patch('prestoadmin.package.needs_chunks', return_value=False)
+    @patch('prestoadmin.package.get_local_sha256', return_value='abc')
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile,
+                              unused_mock_sha256, unused_mock_needs_chunks):
         env.host = 'any_host'
         mock_isfile.return_value = True
+        mock_sudo.return_value = _AttributeString('')
         package.deploy('/any/path/rpm')
-        mock_sudo.assert_called_with('mkdir -p ' +
-                                     constants.REMOTE_PACKAGES_PATH)
+        mock_sudo.assert_called_with(
+            'mkdir -p %s && (sha256sum %s/rpm 2>/dev/null || true)' %
+            (constants.REMOTE_PACKAGES_PATH, constants.REMOTE_PACKAGES_PATH))
         mock_put.assert_called_with('/any/path/rpm',
                                     constants.REMOTE_PACKAGES_PATH,
                                     use_sudo=True)
 
+    @patch('prestoadmin.package.needs_chunks', return_value=False)
+    @patch('prestoadmin.package.get_local_sha256', return_value='abc')
+    @patch('prestoadmin.package.os.path.isfile', return_value=True)
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put')
+    def test_deploy_skipped_when_checksum_matches(self, mock_put, mock_sudo,
+                                                  unused_mock_isfile,
+                                                  unused_mock_sha256,
+                                                  unused_mock_needs_chunks):
+        env.host = 'any_host'
+        mock_sudo.return_value = _AttributeString(
+            'abc  %s/rpm' % constants.REMOTE_PACKAGES_PATH)
+        package.deploy('/any/path/rpm')
+        self.assertFalse(mock_put.called)
+
+        mock_sudo.return_value = _AttributeString(
+            'def  %s/rpm' % constants.REMOTE_PACKAGES_PATH)
+        package.deploy('/any/path/rpm')
+        self.assertTrue(mock_put.called)
+
+    @patch('prestoadmin.util.verification_cache.sha256_of_file',
+           return_value='abc')
+    def test_local_sha256_computed_once(self, mock_sha256):
+        rpm_path = os.path.join(os.path.dirname(__file__), 'test_package.py')
+        self.assertEqual('abc', package.get_local_sha256(rpm_path))
+        self.assertEqual('abc', package.get_local_sha256(rpm_path))
+        self.assertEqual(1, mock_sha256.call_count)
+
+    @patch('prestoadmin.util.verification_cache.sha256_of_file',
+           return_value='abc')
+    def test_local_sha256_shared_with_forked_jobs(self, mock_sha256):
+        # fabric forks a job per host for parallel tasks, so a checksum
+        # computed by one of them has to reach the others
+        rpm_path = os.path.join(os.path.dirname(__file__), 'test_package.py')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                package.get_local_sha256(rpm_path)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual('abc', package.get_local_sha256(rpm_path))
+        self.assertFalse(mock_sha256.called)
+
+    @patch('prestoadmin.util.verification_cache.sha256_of_file',
+           return_value='abc')
+    @patch('prestoadmin.package.local')
+    def test_rpm_verified_once(self, mock_local, unused_mock_sha256):
+        rpm_path = os.path.join(os.path.dirname(__file__), 'test_package.py')
+        mock_local.return_value = _AttributeString('sha1 md5 OK')
+        mock_local.return_value.stderr = ''
+        package.check_if_valid_rpm(rpm_path)
+        package.check_if_valid_rpm(rpm_path)
+        self.assertEqual(1, mock_local.call_count)
+
     @patch('prestoadmin.package.sudo')
     def test_rpm_install(self, mock_sudo):
         env.host = 'any_host'
@@ -77,6 +152,28 @@ class TestPackage(BaseUnitCase):
         mock_deploy.assert_called_with('/any/path/rpm')
         mock_install.assert_called_with('rpm')
 
+    @patch('prestoadmin.package.get_host_list', return_value=['a', 'b'])
+    @patch('prestoadmin.package.get_local_sha256', return_value='abc')
+    @patch('prestoadmin.package.os.path.isfile', return_value=True)
+    @patch('prestoadmin.package.distribute')
+    @patch('prestoadmin.package.pull')
+    def test_distribute_if_requested(self, mock_pull, mock_distribute,
+                                     unused_mock_isfile, unused_mock_sha256,
+                                     unused_mock_hosts):
+        package.distribute_if_requested('/any/path/rpm')
+        self.assertFalse(mock_pull.called or mock_distribute.called)
+
+        env.pull = True
+        package.distribute_if_requested('/any/path/rpm')
+        mock_pull.assert_called_with('/any/path/rpm',
+                                     constants.REMOTE_PACKAGES_PATH,
+                                     ['a', 'b'], checksum='abc')
+        self.assertFalse(mock_distribute.called)
+
+        env.tree = True
+        self.assertRaises(SystemExit, package.distribute_if_requested,
+                          '/any/path/rpm')
+
     @patch('prestoadmin.package.local')
     @patch('prestoadmin.package.abort')
     def test_check_rpm_checksum(self, mock_abort, mock_local):
@@ -102,12 +199,16 @@ class TestPackage(BaseUnitCase):
                                       capture=True)
         mock_abort.assert_called_with('Not an rpm package')
 
+    @patch('prestoadmin.package.needs_chunks', return_value=False)
+    @patch('prestoadmin.package.get_local_sha256', return_value='abc')
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_with_fallback_location(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_with_fallback_location(self, mock_put, mock_sudo, mock_isfile, unused_mock_sha256,
+                                           unused_mock_needs_chunks):
         env.host = 'any_host'
         mock_isfile.return_value = True
+        mock_sudo.return_value = _AttributeString('')
         package.deploy('/any/path/rpm')
         mock_put.return_value = lambda: None
         setattr(mock_put.return_value, 'succeeded', False)
@@ -117,6 +218,18 @@ class TestPackage(BaseUnitCase):
                                     use_sudo=True,
                                     temp_dir='/tmp')
 
+    @patch('prestoadmin.package.needs_chunks', return_value=True)
+    @patch('prestoadmin.package.upload_in_chunks')
+    @patch('prestoadmin.package.is_deployed', return_value=False)
+    @patch('prestoadmin.package.os.path.isfile', return_value=True)
+    @patch('prestoadmin.package.put')
+    def test_deploy_large_rpm_in_chunks(self, mock_put, unused_mock_isfile, unused_mock_is_deployed,
+                                        mock_upload_in_chunks, unused_mock_needs_chunks):
+        env.host = 'any_host'
+        package.deploy('/any/path/rpm')
+        mock_upload_in_chunks.assert_called_with('/any/path/rpm', constants.REMOTE_PACKAGES_PATH)
+        self.assertFalse(mock_put.called)
+
     @patch('prestoadmin.package.os.path.isfile')
     def test_deploy_invalid_local_path(self, mock_isfile):
         mock_isfile.return_value = False
@@ -174,3 +287,41 @@ class TestPackage(BaseUnitCase):
         package.rpm_uninstall('anyrpm')
 
         self.assertTrue(mock_sudo.call_count == 0)
+
+    @patch('prestoadmin.util.host_facts.gather_host_facts')
+    @patch('prestoadmin.package.sudo')
+    def test_is_rpm_installed_from_host_facts(self, mock_sudo, mock_gather):
+        env.host = 'any_host'
+        mock_gather.return_value = parse_facts(
+            '#presto-admin:rpms\n'
+            'presto-server-rpm 0.130 1451606400\n'
+            'package presto-server is not installed')
+
+        self.assertTrue(package.is_rpm_installed('presto-server-rpm'))
+        self.assertFalse(package.is_rpm_installed('presto-server'))
+        self.assertFalse(mock_sudo.called)
+
+        package.is_rpm_installed('anyrpm')
+        mock_sudo.assert_called_with('rpm -qi anyrpm', quiet=True)
+
+    @patch('prestoadmin.package.get_local_sha256', return_value='abc')
+    @patch('prestoadmin.package.sudo')
+    def test_check_remote_rpm(self, mock_sudo, unused_mock_sha256):
+        env.host = 'any_host'
+        mock_sudo.return_value = _AttributeString(
+            'abc  /opt/prestoadmin/packages/test.rpm')
+        mock_sudo.return_value.succeeded = True
+        package.check_remote_rpm('/any/path/test.rpm')
+        mock_sudo.assert_called_with(
+            'sha256sum /opt/prestoadmin/packages/test.rpm', quiet=True)
+
+        mock_sudo.return_value = _AttributeString(
+            'abd  /opt/prestoadmin/packages/test.rpm')
+        mock_sudo.return_value.succeeded = True
+        self.assertRaises(SystemExit, package.check_remote_rpm,
+                          '/any/path/test.rpm')
+
+        mock_sudo.return_value = _AttributeString('No such file or directory')
+        mock_sudo.return_value.succeeded = False
+        self.assertRaises(SystemExit, package.check_remote_rpm,
+                          '/any/path/test.rpm')
@@ -15,21 +15,50 @@
 """
 unit tests for plugin module
 """
+from fabric.api import env
 from mock import patch
 from prestoadmin import plugin
 from tests.unit.base_unit_case import BaseUnitCase
 
 
 class TestPlugin(BaseUnitCase):
-    @patch('prestoadmin.plugin.write')
-    def test_add_jar(self, write_mock):
+    def setUp(self):
+        super(TestPlugin, self).setUp()
+        self.remove_runs_once_flag(plugin.add_jar)
+        env.hosts = ['master', 'slave1']
+
+    @patch('prestoadmin.plugin.execute')
+    def test_add_jar(self, execute_mock):
         plugin.add_jar('/my/local/path.jar', 'hive-hadoop2')
-        write_mock.assert_called_with(
-            '/my/local/path.jar', '/usr/lib/presto/lib/plugin/hive-hadoop2')
+        execute_mock.assert_called_with(
+            plugin.write, '/my/local/path.jar',
+            '/usr/lib/presto/lib/plugin/hive-hadoop2',
+            hosts=['master', 'slave1'])
 
-    @patch('prestoadmin.plugin.write')
-    def test_add_jar_provide_dir(self, write_mock):
+    @patch('prestoadmin.plugin.execute')
+    def test_add_jar_provide_dir(self, execute_mock):
         plugin.add_jar('/my/local/path.jar', 'hive-hadoop2',
                        '/etc/presto/plugin')
-        write_mock.assert_called_with('/my/local/path.jar',
-                                      '/etc/presto/plugin/hive-hadoop2')
+        execute_mock.assert_called_with(
+            plugin.write, '/my/local/path.jar',
+            '/etc/presto/plugin/hive-hadoop2', hosts=['master', 'slave1'])
+
+    @patch('prestoadmin.plugin.needs_chunks', return_value=False)
+    @patch('prestoadmin.plugin.sudo')
+    @patch('prestoadmin.plugin.put')
+    def test_write(self, put_mock, sudo_mock, unused_needs_chunks_mock):
+        plugin.write('/my/local/path.jar', '/etc/presto/plugin/hive-hadoop2')
+        sudo_mock.assert_called_with('mkdir -p /etc/presto/plugin/hive-hadoop2')
+        put_mock.assert_called_with('/my/local/path.jar',
+                                    '/etc/presto/plugin/hive-hadoop2',
+                                    use_sudo=True)
+
+    @patch('prestoadmin.plugin.execute')
+    @patch('prestoadmin.plugin.distribute')
+    def test_add_jar_tree(self, distribute_mock, execute_mock):
+        env.tree = True
+        plugin.add_jar('/my/local/path.jar', 'hive-hadoop2')
+        distribute_mock.assert_called_with(
+            '/my/local/path.jar', '/usr/lib/presto/lib/plugin/hive-hadoop2',
+            ['master', 'slave1'])
+        self.assertFalse(execute_mock.called)
@@ -12,21 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import socket
 from httplib import HTTPException, HTTPConnection
 
 from fabric.operations import _AttributeString
-from mock import patch, PropertyMock
+from mock import patch, PropertyMock, MagicMock
 
-from prestoadmin.prestoclient import URL_TIMEOUT_MS, PrestoClient
+from prestoadmin.prestoclient import URL_TIMEOUT_MS, PrestoClient, \
+    POLL_INITIAL_DELAY, POLL_MAX_DELAY, QueryDeadlineExceeded, get_query_progress, race_endpoints
+from prestoadmin.util.endpoint_cache import get_endpoint_cache
 from prestoadmin.util.exception import InvalidArgumentError
 from tests.base_test_case import BaseTestCase
+from tests.fake_presto_coordinator import FakePrestoCoordinator
 from tests.unit.base_unit_case import PRESTO_CONFIG
 
 
 @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
        return_value=PRESTO_CONFIG)
 class TestPrestoClient(BaseTestCase):
+    def setUp(self):
+        super(TestPrestoClient, self).setUp()
+
     def test_no_sql(self, mock_presto_config):
         client = PrestoClient('any_host', 'any_user')
         self.assertRaisesRegexp(InvalidArgumentError,
@@ -141,3 +148,254 @@ class TestPrestoClient(BaseTestCase):
         PrestoClient._create_auth_headers("Aladdin:1", "open sesame")
         error_message = "LDAP user cannot contain ':': Aladdin:1"
         mock_error.assert_called_once_with(error_message)
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_deadline_cancels_query(self, mock_conn, mock_presto_config):
+        client = PrestoClient('any_host', 'any_user')
+        client._execute_query = lambda sql, schema, catalog: True
+        client.response_from_server = {
+            'id': 'query_id', 'nextUri': 'http://any_host:8080/v1/statement/query_id/1'}
+
+        with patch('prestoadmin.prestoclient.time.time') as mock_time:
+            mock_time.side_effect = [0, 11]
+            self.assertEqual(client.run_sql('any_sql', timeout=10), None)
+
+        mock_conn().request.assert_called_with(
+            'DELETE', '/v1/statement/query_id/1', None,
+            {'X-Presto-User': 'any_user'})
+        self.assertEqual(client.next_uri, '')
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_keyboard_interrupt_cancels_query(self, mock_conn, mock_presto_config):
+        client = PrestoClient('any_host', 'any_user')
+        client._execute_query = lambda sql, schema, catalog: True
+        client.response_from_server = {'nextUri': 'http://any_host:8080/v1/statement/query_id/1'}
+        mock_conn().request.side_effect = [KeyboardInterrupt(), None]
+
+        self.assertRaises(KeyboardInterrupt, client.run_sql, 'any_sql')
+        mock_conn().request.assert_called_with(
+            'DELETE', '/v1/statement/query_id/1', None,
+            {'X-Presto-User': 'any_user'})
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_socket_timeout_bounded_by_deadline(self, mock_conn, mock_presto_config):
+        client = PrestoClient('any_host', 'any_user')
+        with patch('prestoadmin.prestoclient.time.time', return_value=0):
+            client.run_sql('any_sql', timeout=3)
+        mock_conn.assert_called_with('any_host', 8080, False, 3)
+
+    def test_cancel_without_query(self, mock_presto_config):
+        client = PrestoClient('any_host', 'any_user')
+        self.assertFalse(client.cancel())
+
+    def test_poll_delay_backs_off_while_queued(self, mock_presto_config):
+        delay = PrestoClient._next_poll_delay(0, 'QUEUED', False)
+        self.assertEqual(delay, POLL_INITIAL_DELAY)
+        delay = PrestoClient._next_poll_delay(delay, 'PLANNING', False)
+        self.assertEqual(delay, POLL_INITIAL_DELAY * 2)
+        self.assertEqual(
+            PrestoClient._next_poll_delay(POLL_MAX_DELAY, 'QUEUED', False),
+            POLL_MAX_DELAY)
+
+    def test_poll_delay_resets_when_data_flows(self, mock_presto_config):
+        self.assertEqual(
+            PrestoClient._next_poll_delay(POLL_MAX_DELAY, 'QUEUED', True), 0)
+        self.assertEqual(
+            PrestoClient._next_poll_delay(POLL_MAX_DELAY, 'RUNNING', False), 0)
+
+    @patch('prestoadmin.prestoclient.time.sleep')
+    def test_stats_passed_to_callback(self, mock_sleep, mock_presto_config):
+        responses = [
+            {'nextUri': 'http://any_host:8080/v1/statement/1/1',
+             'stats': {'state': 'QUEUED'}},
+            {'nextUri': 'http://any_host:8080/v1/statement/1/2',
+             'stats': {'state': 'QUEUED'}},
+            {'nextUri': 'http://any_host:8080/v1/statement/1/3',
+             'stats': {'state': 'RUNNING'}, 'data': [['row1']]},
+            {'stats': {'state': 'FINISHED'}, 'data': [['row2']]}
+        ]
+        client = PrestoClient('any_host', 'any_user')
+
+        def execute_query(sql, schema, catalog):
+            client.response_from_server = responses.pop(0)
+            return True
+
+        def get_response_from(uri):
+            client.response_from_server = responses.pop(0)
+            return True
+
+        client._execute_query = execute_query
+        client._get_response_from = get_response_from
+        states = []
+
+        rows = client.run_sql('any_sql', stats_callback=lambda stats: states.append(stats['state']))
+
+        self.assertEqual(rows, [['row1'], ['row2']])
+        self.assertEqual(states, ['QUEUED', 'QUEUED', 'RUNNING', 'FINISHED'])
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list],
+                         [POLL_INITIAL_DELAY, POLL_INITIAL_DELAY * 2])
+
+    def test_get_query_progress(self, mock_presto_config):
+        stats = {'state': 'RUNNING', 'completedSplits': 3, 'totalSplits': 10,
+                 'elapsedTimeMillis': 1500, 'processedRows': 42,
+                 'processedBytes': 1024}
+        self.assertEqual(get_query_progress(stats),
+                         'RUNNING, splits 3/10, 1.5s elapsed, 42 rows, 1024 bytes')
+
+    def test_endpoints_from_list(self, mock_presto_config):
+        client = PrestoClient(['coordinator', 'standby:8081'], 'any_user')
+        self.assertEqual(client.endpoints, [('coordinator', 8080), ('standby', 8081)])
+        self.assertEqual((client.server, client.port), ('coordinator', 8080))
+
+    @patch('prestoadmin.prestoclient.socket.create_connection')
+    def test_race_endpoints_first_to_connect_wins(self, mock_create_connection, mock_presto_config):
+        def create_connection(endpoint, timeout):
+            if endpoint[0] == 'down':
+                raise socket.error('Connection refused')
+            return MagicMock()
+        mock_create_connection.side_effect = create_connection
+
+        self.assertEqual(race_endpoints([('down', 8080), ('up', 8080)], head_start=10), ('up', 8080))
+        self.assertEqual(race_endpoints([('down', 8080)], head_start=10), None)
+
+    @patch('prestoadmin.prestoclient.race_endpoints')
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_healthy_endpoint_remembered(self, mock_conn, mock_race, mock_presto_config):
+        mock_race.return_value = ('standby', 8080)
+        mock_conn().getresponse().status = 200
+        mock_conn().getresponse().read.return_value = '{}'
+        client = PrestoClient(['coordinator', 'standby'], 'any_user')
+        client.run_sql('any_sql')
+        PrestoClient(['coordinator', 'standby'], 'any_user').run_sql('any_sql')
+
+        self.assertEqual(mock_race.call_count, 1)
+        mock_conn.assert_called_with('standby', 8080, False, URL_TIMEOUT_MS)
+
+    @patch('prestoadmin.prestoclient.race_endpoints')
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_healthy_endpoint_shared_with_forked_jobs(self, mock_conn, mock_race, mock_presto_config):
+        # fabric forks a job per host for parallel tasks, so the endpoint
+        # one of them found has to reach the others
+        mock_race.return_value = ('standby', 8080)
+        mock_conn().getresponse().status = 200
+        mock_conn().getresponse().read.return_value = '{}'
+        get_endpoint_cache()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                PrestoClient(['coordinator', 'standby'], 'any_user').run_sql('any_sql')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        PrestoClient(['coordinator', 'standby'], 'any_user').run_sql('any_sql')
+
+        self.assertFalse(mock_race.called)
+        mock_conn.assert_called_with('standby', 8080, False, URL_TIMEOUT_MS)
+
+    @patch('prestoadmin.prestoclient.race_endpoints')
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_fail_over_to_next_endpoint(self, mock_conn, mock_race, mock_presto_config):
+        mock_race.side_effect = [('coordinator', 8080), ('standby', 8080)]
+        mock_conn.side_effect = [socket.error('Connection refused'), MagicMock()]
+        client = PrestoClient(['coordinator', 'standby'], 'any_user')
+        client.run_sql('any_sql')
+
+        mock_race.assert_called_with([('standby', 8080)], 5)
+        mock_conn.assert_called_with('standby', 8080, False, URL_TIMEOUT_MS)
+
+
+class TestPrestoClientWithFakeCoordinator(BaseTestCase):
+    def setUp(self):
+        super(TestPrestoClientWithFakeCoordinator, self).setUp()
+
+    def _client(self, coordinator, **kwargs):
+        return PrestoClient(coordinator.host, 'any_user', coordinator.presto_config(), **kwargs)
+
+    def test_pages_through_all_rows(self):
+        with FakePrestoCoordinator(row_count=2500, page_size=1000) as coordinator:
+            rows = self._client(coordinator).run_sql('select * from fake', max_rows=None)
+        self.assertEqual(len(rows), 2500)
+        self.assertEqual(rows[-1], [2499, 'row-2499'])
+
+    def test_max_rows_still_finishes_query(self):
+        with FakePrestoCoordinator(row_count=5000, page_size=1000) as coordinator:
+            rows = self._client(coordinator).run_sql('select * from fake', max_rows=1000)
+            requests = coordinator.request_count
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(rows[-1], [999, 'row-999'])
+        self.assertEqual(requests, 6)
+
+    def test_max_rows_within_a_page(self):
+        with FakePrestoCoordinator(row_count=2500, page_size=300) as coordinator:
+            rows = self._client(coordinator).run_sql('select * from fake', max_rows=1000)
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(rows[-1], [999, 'row-999'])
+
+    @patch('prestoadmin.prestoclient.time.sleep')
+    def test_queued_query(self, mock_sleep):
+        states = []
+        with FakePrestoCoordinator(row_count=10, queued_polls=3) as coordinator:
+            rows = self._client(coordinator).run_sql(
+                'select * from fake', stats_callback=lambda stats: states.append(stats['state']))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(states, ['QUEUED', 'QUEUED', 'QUEUED', 'RUNNING', 'FINISHED'])
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    def test_keep_alive_reuses_connection(self):
+        with FakePrestoCoordinator(row_count=5000, page_size=1000) as coordinator:
+            client = self._client(coordinator, keep_alive=True)
+            self.assertEqual(len(client.run_sql('select * from fake', max_rows=None)), 5000)
+            self.assertEqual(len(client.run_sql('select * from fake', max_rows=None)), 5000)
+            client.close()
+            connections = coordinator.connection_count
+        self.assertEqual(connections, 1)
+
+    def test_keep_alive_against_closing_server(self):
+        with FakePrestoCoordinator(row_count=3000, keep_alive=False) as coordinator:
+            client = self._client(coordinator, keep_alive=True)
+            self.assertEqual(len(client.run_sql('select * from fake', max_rows=None)), 3000)
+            client.close()
+            connections = coordinator.connection_count
+        self.assertEqual(connections, 4)
+
+    def test_deadline_cancels_query_on_server(self):
+        with FakePrestoCoordinator(row_count=100, page_size=1, delay=0.05) as coordinator:
+            rows = self._client(coordinator).run_sql('select * from fake', timeout=0.3)
+            cancelled = coordinator.cancelled_queries
+        self.assertEqual(rows, None)
+        self.assertEqual(len(cancelled), 1)
+
+    @patch('prestoadmin.prestoclient.PrestoConfig.use_https', return_value=True)
+    def test_ldap_credentials_required(self, mock_use_https):
+        with FakePrestoCoordinator(ldap_user='user', ldap_password='password') as coordinator:
+            config = coordinator.presto_config()
+            client = PrestoClient(coordinator.host, 'any_user', config)
+            client._get_https_connection = \
+                lambda timeout: HTTPConnection(coordinator.host, coordinator.port, False, timeout)
+            self.assertEqual(len(client.run_sql('select * from fake')), 1000)
+
+            config.config_properties['internal-communication.authentication.ldap.password'] = 'wrong'
+            self.assertEqual(client.run_sql('select * from fake'), None)
+
+    def test_drain_node(self):
+        with FakePrestoCoordinator(active_tasks=2) as coordinator:
+            client = self._client(coordinator)
+            self.assertEqual(2, client.get_active_task_count())
+            self.assertTrue(client.set_node_state('SHUTTING_DOWN'))
+            self.assertEqual('SHUTTING_DOWN', coordinator.node_state)
+            self.assertEqual(
+                [2, 1, 0], [client.get_active_task_count() for _ in range(3)])
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_node_requests_time_out(self, mock_conn):
+        with FakePrestoCoordinator() as coordinator:
+            client = self._client(coordinator)
+        self.assertRaises(QueryDeadlineExceeded, client.get_active_task_count, timeout=0)
+        self.assertRaises(QueryDeadlineExceeded, client.set_node_state, 'SHUTTING_DOWN', timeout=0)
+        self.assertFalse(mock_conn.called)
+
+        mock_conn().getresponse().status = 200
+        mock_conn().getresponse().read.return_value = '[]'
+        client.get_active_task_count(timeout=30)
+        timeout = mock_conn.call_args[0][3]
+        self.assertTrue(0 < timeout <= 30)
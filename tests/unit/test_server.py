@@ -15,22 +15,41 @@
 """
 Tests the presto install
 """
+import json
 import os
+import shutil
+import socket
 import tempfile
+from StringIO import StringIO
 
 from fabric.api import env
 from fabric.operations import _AttributeString
 from mock import patch, call, MagicMock
 
 from prestoadmin import server
-from prestoadmin.prestoclient import PrestoClient
+from prestoadmin.prestoclient import PrestoClient, QueryDeadlineExceeded
 from prestoadmin.server import INIT_SCRIPTS
 from prestoadmin.util import constants
-from prestoadmin.util.exception import ConfigFileNotFoundError, \
-    ConfigurationError
 from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.host_facts import gather_host_facts, parse_facts, \
+    RPMS, UUIDGEN
 from prestoadmin.util.local_config_util import get_catalog_directory
+from tests.fake_presto_coordinator import FakePrestoCoordinator
 from tests.unit.base_unit_case import BaseUnitCase, PRESTO_CONFIG
+from tests.unit.util.test_host_facts import FACTS_OUTPUT
+
+
+def start_output(version='0.148', port='8080', port_in_use=False,
+                 exit_code=0):
+    lines = ['#presto-admin:version=' + version]
+    if version:
+        lines.append('#presto-admin:port=' + port)
+        if port_in_use:
+            lines.append('#presto-admin:port_in_use=1')
+        else:
+            lines += ['Started as 42',
+                      '#presto-admin:start_exit_code=%d' % exit_code]
+    return _AttributeString('\n'.join(lines))
 
 
 class TestInstall(BaseUnitCase):
@@ -185,6 +204,80 @@ class TestInstall(BaseUnitCase):
             os.close(fd)
             os.remove(absolute_path_valid_rpm)
 
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_cached_rpm_used_without_download(self, mock_rpm_cache, mock_url_handler, unused_mock_check):
+        mock_rpm_cache.return_value.lookup.side_effect = \
+            lambda version=None, url=None, max_age=None: '/cache/presto-server-rpm-0.148.rpm' if version else None
+        self.assertEqual('/cache/presto-server-rpm-0.148.rpm',
+                         server.PrestoRpmFetcher('0.148').get_path_to_presto_rpm())
+        self.assertFalse(mock_url_handler.called)
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_latest_rpm_looked_up_with_max_age(self, mock_rpm_cache, mock_url_handler, unused_mock_check):
+        mock_rpm_cache.return_value.lookup.return_value = '/cache/presto-server-rpm-0.150.rpm'
+        server.PrestoRpmFetcher('latest').get_path_to_presto_rpm()
+        mock_rpm_cache.return_value.lookup.assert_called_with(url=server.LATEST_RPM_URL,
+                                                              max_age=server.LATEST_RPM_MAX_AGE)
+        self.assertFalse(mock_url_handler.called)
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    @patch('prestoadmin.server.PrestoRpmDownloader')
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_downloaded_rpm_added_to_cache(self, mock_rpm_cache, mock_url_handler, mock_downloader,
+                                           unused_mock_check):
+        url = 'http://example.com/presto-server-rpm-0.148.rpm'
+        cache = mock_rpm_cache.return_value
+        cache.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache.cache_dir)
+        cache.lookup.return_value = None
+        cache.add.return_value = '/cache/presto-server-rpm-0.148.rpm'
+        mock_downloader.return_value.download_rpm.return_value = '/cache/download.rpm'
+
+        self.assertEqual('/cache/presto-server-rpm-0.148.rpm', server.PrestoRpmFetcher(url).get_path_to_presto_rpm())
+        mock_downloader.assert_called_with(mock_url_handler.return_value.__enter__.return_value, cache.cache_dir)
+        cache.add.assert_called_with('/cache/download.rpm', url, None)
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted')
+    @patch('prestoadmin.server.PrestoRpmDownloader')
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_corrupted_cached_rpm_downloaded_again(self, mock_rpm_cache, mock_url_handler, mock_downloader,
+                                                   mock_check):
+        cache = mock_rpm_cache.return_value
+        cache.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache.cache_dir)
+        cache.lookup.side_effect = ['/cache/presto-server-rpm-0.148.rpm', None, None]
+        cache.add.return_value = '/cache/presto-server-rpm-0.148.rpm'
+        mock_downloader.return_value.download_rpm.return_value = '/cache/download.rpm'
+        mock_check.side_effect = lambda path: path == '/cache/download.rpm'
+
+        self.assertEqual('/cache/presto-server-rpm-0.148.rpm',
+                         server.PrestoRpmFetcher('0.148').get_path_to_presto_rpm())
+        cache.remove.assert_called_with('/cache/presto-server-rpm-0.148.rpm')
+        self.assertTrue(mock_url_handler.called)
+        self.assertEqual('/cache/download.rpm', cache.add.call_args[0][0])
+        self.assertEqual('0.148', cache.add.call_args[0][2])
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=False)
+    @patch('prestoadmin.server.PrestoRpmDownloader')
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_corrupted_download_not_cached(self, mock_rpm_cache, mock_url_handler, mock_downloader,
+                                           unused_mock_check):
+        cache = mock_rpm_cache.return_value
+        cache.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache.cache_dir)
+        cache.lookup.return_value = None
+        mock_downloader.return_value.download_rpm.return_value = '/cache/download.rpm'
+
+        self.assertRaises(SystemExit, server.PrestoRpmFetcher('http://example.com/presto.rpm').get_path_to_presto_rpm)
+        self.assertFalse(cache.add.called)
+
     def check_version(self, version, expect_valid):
         rpm_fetcher = server.PrestoRpmFetcher(version)
         is_valid_version = rpm_fetcher.check_valid_version()
@@ -224,20 +317,25 @@ class TestInstall(BaseUnitCase):
         self.check_version('1.2.3.4', False)
 
     @staticmethod
-    def set_up_specifier_find_and_download_mocks(mock_download_rpm, mock_find_local, rpm_path, location=None):
+    def set_up_specifier_find_and_download_mocks(mock_download_rpm, mock_find_local, mock_rpm_cache, rpm_path,
+                                                 location=None):
+        mock_rpm_cache.return_value.add.side_effect = lambda path, url, version=None: path
         if location == 'local':
             mock_find_local.return_value = rpm_path
+            mock_rpm_cache.return_value.lookup.return_value = rpm_path
         elif location == 'download':
             mock_download_rpm.return_value = rpm_path
             mock_find_local.return_value = None
+            mock_rpm_cache.return_value.lookup.return_value = None
         elif location == 'none':
             mock_download_rpm.return_value = None
             mock_find_local.return_value = None
+            mock_rpm_cache.return_value.lookup.return_value = None
         else:
             exit('Cannot mock because of invalid location: %s' % location)
 
-    def call_and_assert_install_with_rpm_specifier(self, mock_download_rpm, mock_check_rpm, mock_execute, location,
-                                                   rpm_specifier, rpm_path):
+    def call_and_assert_install_with_rpm_specifier(self, mock_download_rpm, mock_check_rpm, mock_install_bundles,
+                                                   location, rpm_specifier, rpm_path):
         if location == 'local' or location == 'download':
             server.install(rpm_specifier)
             if location == 'local':
@@ -245,27 +343,33 @@ class TestInstall(BaseUnitCase):
             else:
                 self.assertTrue(mock_download_rpm.called)
             mock_check_rpm.assert_called_with(rpm_path)
-            mock_execute.assert_called_with(server.deploy_install_configure,
-                                            rpm_path, hosts=get_host_list())
+            mock_install_bundles.assert_called_with(rpm_path, get_host_list())
         elif location == 'none':
             self.assertRaises(SystemExit, server.install, rpm_specifier)
             mock_check_rpm.assert_not_called()
-            mock_execute.assert_not_called()
+            self.assertFalse(mock_install_bundles.called)
         else:
             exit('Cannot assert because of invalid location: %s' % location)
 
-    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.add_tpch_catalog')
+    @patch('prestoadmin.server.check_preflight')
+    @patch('prestoadmin.server.install_bundles')
     @patch('prestoadmin.server.package.check_if_valid_rpm')
+    @patch('prestoadmin.server.RpmCache')
     @patch('prestoadmin.server.LocalPrestoRpmFinder.find_local_presto_rpm')
     @patch('prestoadmin.server.PrestoRpmDownloader.download_rpm')
-    def check_rpm_specifier_with_location(self, mock_download_rpm, mock_find_local,
-                                          mock_check_rpm, mock_execute, rpm_specifier, location=None):
+    def check_rpm_specifier_with_location(self, mock_download_rpm, mock_find_local, mock_rpm_cache,
+                                          mock_check_rpm, mock_install_bundles, unused_mock_preflight, unused_mock_tpch,
+                                          rpm_specifier, location=None):
         # This function should not mock the UrlHandler class so that urls will be opened
         # This checks that the urls that the installer tries to reach are still valid
         rpm_path = '/path/to/download_or_found/rpm'
-        TestInstall.set_up_specifier_find_and_download_mocks(mock_download_rpm, mock_find_local, rpm_path, location)
-        self.call_and_assert_install_with_rpm_specifier(mock_download_rpm, mock_check_rpm, mock_execute, location,
-                                                        rpm_specifier, rpm_path)
+        mock_rpm_cache.return_value.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mock_rpm_cache.return_value.cache_dir)
+        TestInstall.set_up_specifier_find_and_download_mocks(mock_download_rpm, mock_find_local, mock_rpm_cache,
+                                                             rpm_path, location)
+        self.call_and_assert_install_with_rpm_specifier(mock_download_rpm, mock_check_rpm, mock_install_bundles,
+                                                        location, rpm_specifier, rpm_path)
 
     def test_specifier_as_latest_download(self):
         self.check_rpm_specifier_with_location(rpm_specifier='latest', location='download')
@@ -315,70 +419,55 @@ class TestInstall(BaseUnitCase):
     def test_specifier_as_local_path_with_file_scheme_not_located(self):
         self.check_rpm_specifier_with_location(rpm_specifier='file:///path/to/rpm', location='none')
 
-    @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.package.deploy_install')
-    @patch('prestoadmin.server.update_configs')
-    def test_deploy_install_configure(self, mock_update, mock_install,
-                                      mock_sudo):
-        rpm_specifier = "/any/path/rpm"
-        mock_sudo.side_effect = self.mock_fail_then_succeed()
-
-        server.deploy_install_configure(rpm_specifier)
-        mock_install.assert_called_with(rpm_specifier)
-        self.assertTrue(mock_update.called)
-        mock_sudo.assert_called_with('getent passwd presto', quiet=True)
-
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.package.is_rpm_installed')
+    @patch('prestoadmin.server.get_presto_package')
     @patch('prestoadmin.package.rpm_uninstall')
-    def test_uninstall_is_called(self, mock_package_rpm_uninstall, mock_package_is_rpm_installed, mock_version_check):
+    def test_uninstall_is_called(self, mock_package_rpm_uninstall, mock_get_presto_package, mock_version_check):
         env.host = "any_host"
-        mock_package_is_rpm_installed.side_effect = [False, True]
+        mock_get_presto_package.return_value = {'name': 'presto-server', 'version': '0.115t',
+                                                'install_time': 1451606400}
 
         server.uninstall()
 
         mock_version_check.assert_called_with()
-        mock_package_is_rpm_installed.assert_called_with('presto-server')
-        mock_package_rpm_uninstall.assert_called_with('presto-server')
-        self.assertTrue(mock_package_is_rpm_installed.call_count == 2)
-        self.assertTrue(mock_package_rpm_uninstall.call_count == 1)
+        mock_get_presto_package.assert_called_once_with('any_host', server.UNINSTALL_RPM_NAMES)
+        mock_package_rpm_uninstall.assert_called_once_with('presto-server')
+
+    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.server.get_presto_package', return_value=None)
+    @patch('prestoadmin.package.rpm_uninstall')
+    def test_uninstall_not_installed(self, mock_package_rpm_uninstall, mock_get_presto_package, mock_version_check):
+        env.host = "any_host"
+
+        self.assertRaises(SystemExit, server.uninstall)
+
+        self.assertFalse(mock_package_rpm_uninstall.called)
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch('prestoadmin.util.remote_config_util.lookup_in_config')
-    @patch('prestoadmin.server.run')
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.query_server_for_status')
+    @patch('prestoadmin.server.wait_for_server')
     @patch('prestoadmin.server.warn')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_fail(self, mock_port_in_use,
-                               mock_version_check, mock_warn,
-                               mock_query_for_status, mock_sudo, mock_run, mock_config,
-                               mock_presto_config):
-        mock_query_for_status.return_value = False
+    def test_server_start_fail(self, mock_warn, mock_wait, mock_sudo,
+                               mock_config, mock_presto_config):
+        mock_wait.return_value = None
         env.host = "failed_node1"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
+        mock_sudo.return_value = start_output()
         mock_config.return_value = None
         server.start()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
+        mock_sudo.assert_called_once_with(server.START_SCRIPT)
         mock_warn.assert_called_with(self.SERVER_FAIL_MSG)
 
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_server_status')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start(self, mock_port_in_use, mock_version_check,
-                          mock_check_status, mock_sudo):
+    @patch('prestoadmin.server.wait_for_server')
+    def test_server_start(self, mock_wait, mock_sudo):
         env.host = 'good_node'
-        mock_version_check.return_value = ''
-        mock_check_status.return_value = True
-        mock_port_in_use.return_value = 0
-        server.start()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
+        mock_wait.return_value = 3.5
+        mock_sudo.return_value = start_output()
+        self.assertEqual(3.5, server.start())
+        # The checks and the start are a single remote command
+        mock_sudo.assert_called_once_with(server.START_SCRIPT)
         self.assertEqual('Waiting to make sure we can connect to the Presto '
                          'server on good_node, please wait. This check will '
                          'time out after 2 minutes if the server does not '
@@ -386,90 +475,101 @@ class TestInstall(BaseUnitCase):
                          'good_node\n', self.test_stdout.getvalue())
 
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_bad_presto_version(self, mock_port_in_use,
-                                             mock_version_check, mock_sudo):
+    @patch('prestoadmin.server.wait_for_server')
+    @patch('prestoadmin.server.warn')
+    def test_server_start_bad_presto_version(self, mock_warn, mock_wait,
+                                             mock_sudo):
         env.host = "good_node"
-        mock_version_check.return_value = 'Presto not installed'
+        mock_sudo.return_value = start_output(version='')
         server.start()
-        mock_version_check.assert_called_with()
-        self.assertEqual(False, mock_sudo.called)
+        mock_warn.assert_called_with('Presto is not installed.')
+        self.assertFalse(mock_wait.called)
 
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_port_in_use(self, mock_port_in_use,
-                                      mock_version_check, mock_sudo):
+    @patch('prestoadmin.server.wait_for_server')
+    @patch('prestoadmin.server.error')
+    def test_server_start_port_in_use(self, mock_error, mock_wait, mock_sudo):
         env.host = "good_node"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 1
+        mock_sudo.return_value = start_output(port='1010', port_in_use=True)
         server.start()
-        mock_version_check.assert_called_with()
-        mock_port_in_use.assert_called_with('good_node')
-        self.assertEqual(False, mock_sudo.called)
+        mock_error.assert_called_with('Server failed to start on good_node. '
+                                      'Port 1010 already in use')
+        self.assertFalse(mock_wait.called)
+
+    @patch('prestoadmin.server.sudo')
+    @patch('prestoadmin.server.wait_for_server')
+    @patch('prestoadmin.server.warn')
+    def test_server_start_init_script_fails(self, mock_warn, mock_wait,
+                                            mock_sudo):
+        env.host = "good_node"
+        mock_sudo.return_value = start_output(exit_code=1)
+        self.assertFalse(server.start_presto())
+        mock_warn.assert_called_with('Presto init script failed to start the '
+                                     'server on good_node:\nStarted as 42')
+        self.assertFalse(mock_wait.called)
+
+    def test_parse_start_output(self):
+        self.assertEqual({'version': '0.148', 'port': '', 'port_in_use': False,
+                          'start_exit_code': 0, 'output': ['Started as 42']},
+                         server.parse_start_output(start_output(port='')))
+        self.assertEqual({'version': '', 'port': '', 'port_in_use': False,
+                          'start_exit_code': None, 'output': []},
+                         server.parse_start_output('#presto-admin:version='))
 
     @patch('prestoadmin.server.sudo')
     @patch('prestoadmin.server.check_status_for_control_commands')
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart_port_in_use(self, mock_port_in_use,
-                                        mock_version_check, mock_check_status,
-                                        mock_sudo):
+    @patch('prestoadmin.server.error')
+    def test_server_restart_port_in_use(self, mock_error, mock_version_check,
+                                        mock_check_status, mock_sudo):
         env.host = "good_node"
         mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 1
-        server.restart()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' stop')
+        mock_sudo.side_effect = [start_output(), start_output(port_in_use=True)]
+        server.restart_server()
+        self.assertEqual([call('set -m; ' + INIT_SCRIPTS + ' stop'),
+                          call(server.START_SCRIPT)],
+                         mock_sudo.call_args_list)
         mock_version_check.assert_called_with()
         self.assertEqual(False, mock_check_status.called)
 
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
     @patch('prestoadmin.server.sudo')
-    def test_server_stop(self, mock_sudo, mock_port_in_use,
-                         mock_version_check):
+    def test_server_stop(self, mock_sudo, mock_version_check):
         mock_version_check.return_value = ''
         server.stop()
         mock_version_check.assert_called_with()
-        self.assertEqual(False, mock_port_in_use.called)
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' stop')
+        mock_sudo.assert_called_once_with('set -m; ' + INIT_SCRIPTS + ' stop')
 
     @patch('prestoadmin.util.remote_config_util.lookup_in_config')
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_server_status')
+    @patch('prestoadmin.server.wait_for_server')
     @patch('prestoadmin.server.warn')
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart_fail(self, mock_port_in_use, mock_version_check,
-                                 mock_warn, mock_status, mock_sudo,
-                                 mock_config):
-        mock_status.return_value = False
+    def test_server_restart_fail(self, mock_version_check, mock_warn,
+                                 mock_status, mock_sudo, mock_config):
+        mock_status.return_value = None
         mock_config.return_value = None
         env.host = "failed_node1"
         mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
-        server.restart()
+        mock_sudo.return_value = start_output()
+        server.restart_server()
         mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop')
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' start')
+        mock_sudo.assert_any_call(server.START_SCRIPT)
         mock_version_check.assert_called_with()
 
         mock_warn.assert_called_with(self.SERVER_FAIL_MSG)
 
-    @patch('prestoadmin.util.remote_config_util.lookup_port')
     @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_server_status')
+    @patch('prestoadmin.server.wait_for_server')
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart(self, mock_port_in_use, mock_version_check,
-                            mock_status, mock_sudo, mock_lookup_host):
-        mock_status.return_value = True
+    def test_server_restart(self, mock_version_check, mock_status, mock_sudo):
+        mock_status.return_value = 2.0
         env.host = 'good_node'
         mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
-        server.restart()
+        mock_sudo.return_value = start_output()
+        server.restart_server()
         mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop')
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' start')
+        mock_sudo.assert_any_call(server.START_SCRIPT)
         mock_version_check.assert_called_with()
         self.assertEqual('Waiting to make sure we can connect to the Presto '
                          'server on good_node, please wait. This check will '
@@ -477,22 +577,367 @@ class TestInstall(BaseUnitCase):
                          'respond.\nServer started successfully on: '
                          'good_node\n', self.test_stdout.getvalue())
 
-    @patch('prestoadmin.server.catalog')
-    @patch('prestoadmin.server.configure_cmds.deploy')
+    @patch('prestoadmin.server.execute')
+    def test_server_restart_all_at_once(self, mock_execute):
+        self.remove_runs_once_flag(server.restart)
+        server.restart()
+        mock_execute.assert_called_with(server.restart_server,
+                                        hosts=['master', 'slave1', 'slave2'])
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_coordinator_last(self, mock_execute, mock_sleep):
+        mock_execute.side_effect = lambda task, active, hosts: \
+            dict((host, 1.0) for host in hosts)
+        results = server.rolling_restart(batch_size=2, pause=5)
+        self.assertEqual(
+            [call(server.restart_server, True, hosts=['slave1', 'slave2']),
+             call(server.restart_server, True, hosts=['master'])],
+            mock_execute.call_args_list)
+        mock_sleep.assert_called_once_with(5)
+        self.assertEqual({'master': 1.0, 'slave1': 1.0, 'slave2': 1.0},
+                         results)
+
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_aborts_on_failure(self, mock_execute):
+        mock_execute.side_effect = [{'slave1': None}]
+        self.assertRaises(SystemExit, server.rolling_restart)
+        self.assertEqual(1, mock_execute.call_count)
+
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_abort_threshold(self, mock_execute):
+        mock_execute.side_effect = [{'slave1': Exception('unreachable')},
+                                    {'slave2': 2.0},
+                                    {'master': 3.0}]
+        results = server.rolling_restart(abort_threshold=1)
+        self.assertEqual({'master': 3.0, 'slave1': None, 'slave2': 2.0},
+                         results)
+
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_aborted_host_counts_as_failed(self,
+                                                           mock_execute):
+        mock_execute.side_effect = [{'slave1': SystemExit('aborted')},
+                                    {'slave2': 2.0}]
+        self.assertRaises(SystemExit, server.rolling_restart)
+        self.assertEqual(1, mock_execute.call_count)
+
+        mock_execute.reset_mock()
+        mock_execute.side_effect = [{'slave1': SystemExit('aborted')},
+                                    {'slave2': 2.0},
+                                    {'master': 3.0}]
+        results = server.rolling_restart(abort_threshold=1)
+        self.assertEqual({'master': 3.0, 'slave1': None, 'slave2': 2.0},
+                         results)
+
+    def test_rolling_restart_invalid_batch_size(self):
+        self.assertRaises(SystemExit, server.rolling_restart, 0)
+
+    @patch('prestoadmin.server.check_preflight')
+    @patch('prestoadmin.server.package.check_if_valid_rpm')
+    @patch('prestoadmin.server.execute')
+    def test_upgrade_stages_everywhere_before_stopping(self, mock_execute, mock_check_rpm, mock_preflight):
+        staged = {'master': {'config_tar': '/tmp/m.tar', 'running': True},
+                  'slave1': {'config_tar': '/tmp/s1.tar', 'running': False},
+                  'slave2': {'config_tar': '/tmp/s2.tar', 'running': True}}
+        mock_execute.side_effect = [staged, {'slave1': None},
+                                    {'master': 3.0, 'slave2': 2.5}]
+        self.remove_runs_once_flag(server.upgrade)
+
+        downtimes = server.upgrade('/any/path/presto.rpm')
+
+        mock_check_rpm.assert_called_with('/any/path/presto.rpm')
+        mock_preflight.assert_called_with('/any/path/presto.rpm',
+                                          keep_config=True)
+        self.assertEqual(
+            [call(server.stage_upgrade, '/any/path/presto.rpm',
+                  hosts=['master', 'slave1', 'slave2']),
+             call(server.upgrade_server, 'presto.rpm', staged,
+                  hosts=['slave1']),
+             call(server.upgrade_server, 'presto.rpm', staged,
+                  hosts=['master', 'slave2'])],
+            mock_execute.call_args_list)
+        self.assertEqual({'master': 3.0, 'slave2': 2.5}, downtimes)
+        self.assertEqual('Downtime per node:\n'
+                         '    master: 3.0 seconds\n'
+                         '    slave2: 2.5 seconds\n',
+                         self.test_stdout.getvalue())
+
+    @patch('prestoadmin.server.check_preflight')
+    @patch('prestoadmin.server.package.check_if_valid_rpm')
+    @patch('prestoadmin.server.execute')
+    def test_upgrade_stops_nothing_if_staging_fails(
+            self, mock_execute, unused_mock_check_rpm, unused_mock_preflight):
+        mock_execute.return_value = {
+            'master': {'config_tar': '/tmp/m.tar', 'running': True},
+            'slave1': SystemExit('RPM file not found'),
+            'slave2': {'config_tar': '/tmp/s2.tar', 'running': True}}
+        self.remove_runs_once_flag(server.upgrade)
+
+        self.assertRaises(SystemExit, server.upgrade, '/any/path/presto.rpm')
+
+        self.assertEqual(1, mock_execute.call_count)
+        self.assertTrue('Could not stage the upgrade on slave1' in
+                        self.test_stderr.getvalue())
+
+    @patch('prestoadmin.server.check_preflight')
+    @patch('prestoadmin.server.package.check_if_valid_rpm')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_upgrade(self, mock_execute, unused_mock_check_rpm,
+                             unused_mock_preflight):
+        staged = dict((host, {'config_tar': '/tmp/c.tar', 'running': True})
+                      for host in ['master', 'slave1', 'slave2'])
+        mock_execute.side_effect = [staged, {'slave1': 1.0}, {'slave2': None},
+                                    {'master': 2.0}]
+        self.remove_runs_once_flag(server.upgrade)
+        env.rolling = True
+        env.abort_threshold = 1
+
+        downtimes = server.upgrade('/any/path/presto.rpm')
+
+        self.assertEqual(
+            call(server.upgrade_server, 'presto.rpm', staged, True,
+                 hosts=['master']),
+            mock_execute.call_args_list[-1])
+        self.assertEqual({'master': 2.0, 'slave1': 1.0, 'slave2': None},
+                         downtimes)
+        self.assertTrue('    slave2: did not come back up\n' in
+                        self.test_stdout.getvalue())
+
+    def test_print_downtimes_of_failed_hosts(self):
+        server.print_downtimes({'master': 2.0, 'slave1': SystemExit('failed')})
+        self.assertEqual('Downtime per node:\n'
+                         '    master: 2.0 seconds\n'
+                         '    slave1: did not come back up\n',
+                         self.test_stdout.getvalue())
+
+    @patch('prestoadmin.server.Worker')
+    @patch('prestoadmin.server.Coordinator')
+    @patch('prestoadmin.server.get_facts_of_hosts')
+    def test_preflight(self, mock_facts, mock_coordinator, mock_worker):
+        master_facts = parse_facts(FACTS_OUTPUT)
+        slave_facts = parse_facts(FACTS_OUTPUT)
+        slave_facts[RPMS] = {}
+        slave_facts[UUIDGEN] = None
+        mock_facts.return_value = {'master': master_facts,
+                                   'slave1': slave_facts,
+                                   'slave2': None}
+        mock_coordinator.return_value.get_conf.return_value = {
+            'jvm.config': ['-Xmx8G'],
+            'config.properties': {'http-server.http.port': '8081'}}
+        mock_worker.return_value.get_conf.return_value = {
+            'jvm.config': ['-Xmx8G'], 'config.properties': {}}
+        self.remove_runs_once_flag(server.preflight)
+
+        self.assertRaises(SystemExit, server.preflight)
+
+        mock_facts.assert_called_with(['master', 'slave1', 'slave2'])
+        self.assertEqual(1, mock_worker.return_value.get_conf.call_count)
+        output = self.test_stdout.getvalue()
+        self.assertTrue('master  ok        ok        ok        ok        ok'
+                        '        ok\n' in output)
+        self.assertTrue('slave1: port FAIL: 8080 in use\n' in output)
+        self.assertTrue('slave1: uuidgen FAIL: uuidgen not found\n' in output)
+        self.assertTrue('slave2: host unreachable' in output)
+        self.assertTrue('Preflight checks failed on slave1' in
+                        self.test_stderr.getvalue())
+
+    @patch('prestoadmin.server.Worker')
+    @patch('prestoadmin.server.Coordinator')
+    @patch('prestoadmin.server.get_facts_of_hosts')
+    def test_preflight_with_host_config(self, mock_facts, mock_coordinator,
+                                        mock_worker):
+        facts = parse_facts(FACTS_OUTPUT)
+        facts['config.properties'] = {'http-server.http.port': '8080'}
+        mock_facts.return_value = dict((host, facts) for host in
+                                       ['master', 'slave1', 'slave2'])
+
+        self.assertEqual(['master', 'slave1', 'slave2'],
+                         server.run_preflight(keep_config=True))
+        self.assertFalse(mock_coordinator.called or mock_worker.called)
+        self.assertTrue('heap of 16.0G but only 15.6G' in
+                        self.test_stdout.getvalue())
+
+    @patch('prestoadmin.server.run_preflight')
+    def test_check_preflight(self, mock_run_preflight):
+        mock_run_preflight.return_value = []
+        server.check_preflight('/any/path/presto.rpm', keep_config=False)
+        mock_run_preflight.assert_called_with('/any/path/presto.rpm', False)
+
+        mock_run_preflight.return_value = ['slave1']
+        self.assertRaises(SystemExit, server.check_preflight,
+                          '/any/path/presto.rpm', False)
+
+        env.skip_preflight = True
+        mock_run_preflight.reset_mock()
+        server.check_preflight('/any/path/presto.rpm', False)
+        self.assertFalse(mock_run_preflight.called)
+
+    @patch('prestoadmin.server.sudo')
+    @patch('prestoadmin.server.configure_cmds.gather_config_directory',
+           return_value='/tmp/presto_config-abc.tar')
+    @patch('prestoadmin.server.package')
+    def test_stage_upgrade(self, mock_package, mock_gather, mock_sudo):
+        mock_sudo.return_value = _AttributeString('Running as 42')
+        mock_sudo.return_value.succeeded = True
+
+        staged = server.stage_upgrade('/any/path/presto.rpm')
+
+        mock_package.deploy.assert_called_with('/any/path/presto.rpm')
+        mock_package.check_remote_rpm.assert_called_with('/any/path/presto.rpm')
+        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' status',
+                                     quiet=True)
+        self.assertFalse(mock_package.rpm_upgrade.called)
+        self.assertEqual({'config_tar': '/tmp/presto_config-abc.tar',
+                          'running': True}, staged)
+
+    @patch('prestoadmin.server.time.time', return_value=100.0)
+    @patch('prestoadmin.server.check_status_for_control_commands',
+           return_value=12.5)
+    @patch('prestoadmin.server.start_presto', return_value=True)
+    @patch('prestoadmin.server.configure_cmds.deploy_config_directory')
+    @patch('prestoadmin.server.package.rpm_upgrade')
+    @patch('prestoadmin.server.service')
+    def test_upgrade_server(self, mock_service, mock_rpm_upgrade,
+                            mock_deploy_config, mock_start, mock_check,
+                            mock_time):
+        env.host = 'slave1'
+        steps = MagicMock()
+        steps.attach_mock(mock_service, 'service')
+        steps.attach_mock(mock_time, 'time')
+        steps.attach_mock(mock_rpm_upgrade, 'rpm_upgrade')
+        steps.attach_mock(mock_deploy_config, 'deploy_config_directory')
+        steps.attach_mock(mock_start, 'start_presto')
+        staged = {'slave1': {'config_tar': '/tmp/c.tar', 'running': True}}
+
+        self.assertEqual(12.5, server.upgrade_server('presto.rpm', staged))
+
+        # The downtime doesn't include stopping, or draining, the server
+        self.assertEqual([call.service('stop'),
+                          call.time(),
+                          call.rpm_upgrade('presto.rpm'),
+                          call.deploy_config_directory('/tmp/c.tar'),
+                          call.start_presto()], steps.mock_calls)
+        mock_check.assert_called_with(100.0, False)
+
+    @patch('prestoadmin.server.start_presto')
+    @patch('prestoadmin.server.configure_cmds.deploy_config_directory')
+    @patch('prestoadmin.server.package.rpm_upgrade')
+    @patch('prestoadmin.server.service')
+    def test_upgrade_server_left_stopped(self, mock_service, mock_rpm_upgrade,
+                                         mock_deploy_config, mock_start):
+        env.host = 'slave1'
+        staged = {'slave1': {'config_tar': '/tmp/c.tar', 'running': False}}
+
+        self.assertEqual(None, server.upgrade_server('presto.rpm', staged))
+
+        mock_rpm_upgrade.assert_called_with('presto.rpm')
+        mock_deploy_config.assert_called_with('/tmp/c.tar')
+        self.assertFalse(mock_start.called)
+
+    @patch('prestoadmin.server.drain_server')
+    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.server.sudo')
+    def test_server_stop_drains_first(self, mock_sudo, mock_version_check,
+                                      mock_drain):
+        mock_version_check.return_value = ''
+        calls = MagicMock()
+        calls.attach_mock(mock_drain, 'drain_server')
+        calls.attach_mock(mock_sudo, 'sudo')
+        env.drain = True
+        env.drain_timeout = 60
+        server.stop()
+        self.assertEqual(
+            [call.drain_server(60),
+             call.sudo('set -m; ' + INIT_SCRIPTS + ' stop')],
+            calls.mock_calls[:2])
+
+    @patch('prestoadmin.server.drain_server')
+    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.server.sudo')
+    def test_server_stop_without_drain(self, mock_sudo, mock_version_check,
+                                       mock_drain):
+        mock_version_check.return_value = ''
+        server.stop()
+        self.assertFalse(mock_drain.called)
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.PrestoConfig.node_config')
+    def test_drain_server(self, mock_node_config, mock_sleep):
+        with FakePrestoCoordinator(active_tasks=3) as worker:
+            mock_node_config.return_value = worker.presto_config()
+            env.host = worker.host
+            self.assertTrue(server.drain_server())
+            self.assertEqual('SHUTTING_DOWN', worker.node_state)
+        self.assertEqual(3, mock_sleep.call_count)
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.warn')
+    @patch('prestoadmin.server.PrestoConfig.node_config')
+    @patch('prestoadmin.server.PrestoClient')
+    def test_drain_server_timeout(self, mock_client, mock_node_config,
+                                  mock_warn, mock_sleep):
+        env.host = 'slave1'
+        mock_client.return_value.set_node_state.return_value = True
+        mock_client.return_value.get_active_task_count.return_value = 3
+        self.assertFalse(server.drain_server(0))
+        mock_warn.assert_called_with('The server on slave1 still has active '
+                                     'tasks after 0 seconds, stopping it '
+                                     'anyway')
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.warn')
+    @patch('prestoadmin.server.PrestoConfig.node_config')
+    @patch('prestoadmin.server.PrestoClient')
+    def test_drain_server_request_timeout(self, mock_client, mock_node_config,
+                                          mock_warn, mock_sleep):
+        env.host = 'slave1'
+        client = mock_client.return_value
+        client.set_node_state.return_value = True
+        client.get_active_task_count.side_effect = [3, socket.timeout()]
+        # A request that times out is not a worker that shut itself down
+        self.assertFalse(server.drain_server(60))
+        mock_warn.assert_called_with('The server on slave1 did not drain '
+                                     'within 60 seconds, stopping it anyway')
+        # The requests only get the time left to drain
+        for method in [client.set_node_state, client.get_active_task_count]:
+            timeout = method.call_args[1]['timeout']
+            self.assertTrue(0 < timeout <= 60)
+
+    @patch('prestoadmin.server.warn')
+    @patch('prestoadmin.server.PrestoConfig.node_config')
+    @patch('prestoadmin.server.PrestoClient')
+    def test_drain_server_deadline_exceeded(self, mock_client,
+                                            mock_node_config, mock_warn):
+        env.host = 'slave1'
+        mock_client.return_value.set_node_state.side_effect = \
+            QueryDeadlineExceeded()
+        self.assertFalse(server.drain_server(0))
+        mock_warn.assert_called_with('The server on slave1 did not drain '
+                                     'within 0 seconds, stopping it anyway')
+
+    @patch('prestoadmin.server.PrestoClient')
+    def test_coordinator_not_drained(self, mock_client):
+        env.host = 'master'
+        self.assertFalse(server.drain_server())
+        self.assertFalse(mock_client.called)
+
+    def test_node_active(self):
+        self.assertTrue(server.is_node_active(
+            ['id', 'http://a', 'v1', False, 'active']))
+        self.assertFalse(server.is_node_active(
+            ['id', 'http://a', 'v1', True, 'shutting_down']))
+        self.assertTrue(server.is_node_active(['id', 'http://a', 'v1', True]))
+
     @patch('prestoadmin.server.os.path.exists')
     @patch('prestoadmin.server.os.makedirs')
     @patch('prestoadmin.server.util.filesystem.os.fdopen')
     @patch('prestoadmin.server.util.filesystem.os.open')
-    def test_update_config(self, mock_open, mock_fdopen, mock_makedir,
-                           mock_path_exists, mock_config, mock_connector):
-        e = ConfigFileNotFoundError(
-            message='problems', config_path='config_path')
-        mock_connector.add.side_effect = e
+    def test_add_tpch_catalog(self, mock_open, mock_fdopen, mock_makedir,
+                              mock_path_exists):
         mock_path_exists.side_effect = [False, False]
 
-        server.update_configs()
+        server.add_tpch_catalog()
 
-        mock_config.assert_called_with()
         mock_makedir.assert_called_with(get_catalog_directory())
         mock_open.assert_called_with(os.path.join(get_catalog_directory(),
                                                   'tpch.properties'),
@@ -502,10 +947,9 @@ class TestInstall(BaseUnitCase):
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
-    @patch('prestoadmin.server.run')
     @patch('prestoadmin.server.lookup_string_config')
     @patch.object(PrestoClient, 'run_sql')
-    def test_check_success_status(self, mock_run_sql, string_config_mock, mock_run, mock_presto_config):
+    def test_check_success_status(self, mock_run_sql, string_config_mock, mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
             'worker': ['Node1', 'Node2', 'Node3', 'Node4'],
@@ -519,10 +963,9 @@ class TestInstall(BaseUnitCase):
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
-    @patch('prestoadmin.server.run')
     @patch('prestoadmin.server.lookup_string_config')
-    @patch('prestoadmin.server.query_server_for_status')
-    def test_check_success_fail(self, mock_query_for_status, string_config_mock, mock_run,
+    @patch('prestoadmin.server.NodeListWatcher.wait_for')
+    def test_check_success_fail(self, mock_wait_for, string_config_mock,
                                 mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
@@ -532,17 +975,17 @@ class TestInstall(BaseUnitCase):
         env.hosts = env.roledefs['all']
         env.host = 'Node1'
         string_config_mock.return_value = 'Node1'
-        mock_query_for_status.return_value = False
+        mock_wait_for.return_value = None
         self.assertEqual(server.check_server_status(), False)
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch('prestoadmin.server.execute')
-    @patch('prestoadmin.server.get_presto_version')
+    @patch('prestoadmin.server.get_presto_rpm_version')
     @patch('prestoadmin.server.presto_installed')
     @patch.object(PrestoClient, 'run_sql')
     def test_status_from_each_node(
-            self, mock_run_sql, mock_presto_installed, mock_get_presto_version, mock_execute, mock_presto_config):
+            self, mock_run_sql, mock_presto_installed, mock_rpm_version, mock_execute, mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
             'worker': ['Node1', 'Node2', 'Node3', 'Node4'],
@@ -550,22 +993,21 @@ class TestInstall(BaseUnitCase):
         }
         env.hosts = env.roledefs['all']
 
-        mock_get_presto_version.return_value = '0.97-SNAPSHOT'
+        mock_rpm_version.return_value = '0.97-SNAPSHOT'
         mock_run_sql.side_effect = [
-            [['select * from system.runtime.nodes']],
-            [['hive'], ['system'], ['tpch']],
-            [['http://active/statement', 'presto-main:0.97-SNAPSHOT', True]],
-            [['http://inactive/stmt', 'presto-main:0.99-SNAPSHOT', False]],
-            [[]],
-            [['http://servrdown/statement', 'any', True]]
+            [['id1', 'http://10.0.0.1/statement', 'presto-main:0.97-SNAPSHOT', True],
+             ['id2', 'http://10.0.0.2/stmt', 'presto-main:0.99-SNAPSHOT', False],
+             ['id4', 'http://servrdown/statement', 'any', True]],
+            [['hive'], ['system'], ['tpch']]
         ]
         mock_execute.side_effect = [{
-            'Node1': ('IP1', True, ''),
-            'Node2': ('IP2', True, ''),
-            'Node3': ('IP3', True, ''),
+            'Node1': ('id1', True, ''),
+            'Node2': ('id2', True, ''),
+            'Node3': ('id3', True, ''),
             'Node4': Exception('Timed out trying to connect to Node4')
         }]
-        env.host = 'Node1'
+        # status runs once, not on the coordinator
+        env.host = 'Node3'
         server.status()
 
         expected = self.read_file_output('/resources/server_status_out.txt')
@@ -573,42 +1015,220 @@ class TestInstall(BaseUnitCase):
             expected.splitlines(),
             self.test_stdout.getvalue().splitlines()
         )
+        # One query for all nodes and one for the catalogs, no matter how
+        # many hosts there are
+        self.assertEqual(2, mock_run_sql.call_count)
+        mock_rpm_version.assert_called_once_with('Node1')
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.get_presto_rpm_version')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_status_json(self, mock_run_sql, mock_rpm_version,
+                         mock_execute, mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1', 'Node2'],
+            'all': ['Node1', 'Node2']
+        }
+        env.hosts = env.roledefs['all']
+        env.host = 'Node1'
+        mock_rpm_version.return_value = '0.148'
+        mock_run_sql.side_effect = [
+            [['id1', 'http://10.0.0.1/statement', '0.148', 'active']],
+            [['hive'], ['system']]
+        ]
+        mock_execute.side_effect = [{
+            'Node1': ('id1', True, ''),
+            'Node2': Exception('Timed out trying to connect to Node2')
+        }]
+        server.print_status('json')
+
+        document = json.loads(self.test_stdout.getvalue())
+        self.assertEqual('server status', document['command'])
+        self.assertEqual(['coordinator_query', 'host_probe', 'total'],
+                         sorted(document['timings_ms']))
+        node1, node2 = document['records']
+        self.assertEqual(
+            {'host': 'Node1', 'roles': ['coordinator', 'worker'],
+             'running': True, 'node_id': 'id1', 'external_ip': '10.0.0.1',
+             'node_uri': 'http://10.0.0.1/statement',
+             'presto_version': '0.148', 'node_state': 'active',
+             'catalogs': ['hive', 'system'], 'error': None},
+            dict((key, value) for key, value in node1.items()
+                 if not key.endswith('_ms')))
+        self.assertEqual(sorted(server.STATUS_FIELDS), sorted(node2))
+        self.assertEqual(False, node2['running'])
+        self.assertEqual('Timed out trying to connect to Node2',
+                         node2['error'])
+        self.assertEqual(None, node2['node_state'])
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.get_presto_rpm_version')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_watch_status(self, mock_run_sql, mock_rpm_version,
+                          mock_execute, mock_sleep, mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1', 'Node2'],
+            'all': ['Node1', 'Node2']
+        }
+        env.hosts = env.roledefs['all']
+        env.host = 'Node1'
+        mock_rpm_version.return_value = '0.148'
+        mock_execute.return_value = {'Node1': ('id1', True, ''),
+                                     'Node2': ('id2', True, '')}
+        mock_run_sql.side_effect = [
+            [['jmx'], ['system']],
+            [['id1', '0.148', 'active', 0, 65000, 2048],
+             ['id2', '0.148', 'active', 3, 61000, 2048]],
+            [['id1', '0.148', 'active', 0, 67000, 2048]]
+        ]
+        output = StringIO()
+        server.watch_status(ticks=2, stream=output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(8, len(lines))
+        self.assertEqual(
+            ['Node1  coordinator, worker  active          0.148'
+             '                           00:01:05      0       2.0K',
+             'Node2  worker               active          0.148'
+             '                           00:01:01      3       2.0K'],
+            [line.rstrip() for line in lines[2:4]])
+        self.assertTrue(lines[7].startswith('Node2  worker               '
+                                            'not listed'))
+        # The hosts are contacted once, the coordinator once per refresh
+        self.assertEqual(1, mock_execute.call_count)
+        self.assertEqual(3, mock_run_sql.call_count)
+        self.assertTrue('jmx.current' in mock_run_sql.call_args[0][0])
+        self.assertEqual(1, mock_sleep.call_count)
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.get_presto_rpm_version')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_watch_status_without_failing_jmx_column(
+            self, mock_run_sql, mock_rpm_version, mock_execute,
+            mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1'],
+            'all': ['Node1']
+        }
+        env.hosts = env.roledefs['all']
+        env.host = 'Node1'
+        mock_rpm_version.return_value = '0.148'
+        mock_execute.return_value = {'Node1': ('id1', True, '')}
+        mock_run_sql.side_effect = [
+            [['jmx'], ['system']],
+            # All the columns, without them and each on its own
+            None,
+            [['id1', '0.148', 'active', 0]],
+            [['id1', '0.148', 'active', 0, 65000]],
+            None,
+            [['id1', '0.148', 'active', 0, 65000]]
+        ]
+        output = StringIO()
+        server.watch_status(ticks=1, stream=output)
+
+        self.assertEqual(
+            'Node1  coordinator, worker  active          0.148'
+            '                           00:01:05      0          -',
+            output.getvalue().splitlines()[2].rstrip())
+        sql = mock_run_sql.call_args[0][0]
+        self.assertTrue('r.uptime' in sql)
+        self.assertFalse('memorypool' in sql)
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.get_presto_rpm_version')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_watch_status_keeps_jmx_if_coordinator_down(
+            self, mock_run_sql, mock_rpm_version, mock_execute,
+            mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1'],
+            'all': ['Node1']
+        }
+        env.hosts = env.roledefs['all']
+        env.host = 'Node1'
+        mock_rpm_version.return_value = '0.148'
+        mock_execute.return_value = {'Node1': ('id1', True, '')}
+        mock_run_sql.side_effect = [
+            [['jmx'], ['system']],
+            None,
+            None,
+            [['id1', '0.148', 'active', 0, 65000, 2048]]
+        ]
+        output = StringIO()
+        with patch('prestoadmin.server.time.sleep'):
+            server.watch_status(ticks=2, stream=output)
+
+        self.assertEqual(4, mock_run_sql.call_count)
+        self.assertTrue('memorypool' in mock_run_sql.call_args[0][0])
+
+    def test_watch_sql(self):
+        sql = server.get_watch_sql('active', [])
+        self.assertTrue('n.active' in sql)
+        self.assertFalse('jmx' in sql)
+        sql = server.get_watch_sql('state', ['memory_used'])
+        self.assertTrue(', p.maxbytes - p.freebytes from' in sql)
+        self.assertTrue('memorypool' in sql)
+        self.assertFalse('java.lang:type=runtime' in sql)
+
     @patch('prestoadmin.server.check_presto_version')
     @patch('prestoadmin.server.service')
-    @patch('prestoadmin.server.get_ext_ip_of_node')
-    def test_collect_node_information(self, mock_ext_ip, mock_service,
-                                      mock_version, mock_presto_config):
+    @patch('prestoadmin.server.get_node_id')
+    def test_collect_node_information(self, mock_node_id, mock_service,
+                                      mock_version):
         env.roledefs = {
             'coordinator': ['Node1'],
             'all': ['Node1']
         }
-        mock_ext_ip.side_effect = ['IP1', 'IP3', 'IP4']
+        mock_node_id.side_effect = ['id1', 'id3', Exception('No node.id')]
         mock_service.side_effect = [True, False, Exception('Not running')]
         mock_version.side_effect = ['', 'Presto not installed', '', '']
 
-        self.assertEqual(('IP1', True, ''), server.collect_node_information())
-        self.assertEqual(('Unknown', False, 'Presto not installed'),
+        self.assertEqual(('id1', True, ''), server.collect_node_information())
+        self.assertEqual((None, False, 'Presto not installed'),
                          server.collect_node_information())
-        self.assertEqual(('IP3', False, ''), server.collect_node_information())
-        self.assertEqual(('IP4', False, ''),
+        self.assertEqual(('id3', False, ''), server.collect_node_information())
+        self.assertEqual((None, False, ''),
                          server.collect_node_information())
 
-    @patch('prestoadmin.server.sudo')
-    def test_get_external_ip(self, mock_nodeuuid):
-        client_mock = MagicMock(PrestoClient)
-        client_mock.run_sql.return_value = [['IP']]
-        self.assertEqual(server.get_ext_ip_of_node(client_mock), 'IP')
+    def test_sysnode_info_joined_by_node_id_and_host(self):
+        by_node_id, by_host = server.new_sysnode_processor([
+            ['id1', 'http://10.0.0.1:8080', 'v1', 'active'],
+            ['id2', 'http://10.0.0.1:8081', 'v1', 'shutting_down'],
+            ['id3', 'http://10.0.0.2:8080', 'v2', 'active'],
+            []])
+        self.assertEqual({'id1': ['10.0.0.1'],
+                          'id2': ['10.0.0.1'],
+                          'id3': ['10.0.0.2']},
+                         by_node_id)
+        self.assertEqual(
+            {'10.0.0.1': {'http://10.0.0.1:8080': ['v1', 'active'],
+                          'http://10.0.0.1:8081': ['v1', 'shutting_down']},
+             '10.0.0.2': {'http://10.0.0.2:8080': ['v2', 'active']}},
+            by_host)
+
+    def test_get_external_ip(self):
+        self.assertEqual(
+            server.get_ext_ip_of_node('id1', {'id1': ['IP']}, 'node'), 'IP')
+        self.assertEqual(
+            server.get_ext_ip_of_node('id2', {'id1': ['IP']}, 'node'),
+            'Unknown')
 
-    @patch('prestoadmin.server.sudo')
     @patch('prestoadmin.server.warn')
-    def test_warn_external_ip(self, mock_warn, mock_nodeuuid):
-        env.host = 'node'
-        client_mock = MagicMock(PrestoClient)
-        client_mock.run_sql.return_value = [['IP1'], ['IP2']]
-        server.get_ext_ip_of_node(client_mock)
+    def test_warn_external_ip(self, mock_warn):
+        server.get_ext_ip_of_node('id1', {'id1': ['10.0.0.1', '10.0.0.2']}, 'node')
         mock_warn.assert_called_with("More than one external ip found for "
                                      "node. There could be multiple nodes "
                                      "associated with the same node.id")
@@ -623,76 +1243,37 @@ class TestInstall(BaseUnitCase):
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch.object(PrestoClient, 'run_sql')
-    @patch('prestoadmin.server.run')
+    @patch('prestoadmin.util.host_facts.sudo')
     @patch('prestoadmin.server.warn')
-    def test_warning_presto_version_not_installed(self, mock_warn, mock_run,
+    def test_warning_presto_version_not_installed(self, mock_warn, mock_sudo,
                                                   mock_run_sql, mock_presto_config):
         env.host = 'node1'
         env.roledefs['coordinator'] = ['node1']
         env.roledefs['worker'] = ['node1']
         env.roledefs['all'] = ['node1']
         env.hosts = env.roledefs['all']
-        output = _AttributeString('package presto is not installed')
-        output.succeeded = False
-        mock_run.return_value = output
+        mock_sudo.return_value = _AttributeString(
+            '#presto-admin:rpms\n'
+            'package presto is not installed\n'
+            'package presto-server-rpm is not installed\n'
+            'package presto-server is not installed')
         env.host = 'node1'
         server.collect_node_information()
         installation_warning = 'Presto is not installed.'
         mock_warn.assert_called_with(installation_warning)
 
-    @patch('prestoadmin.server.run')
-    @patch('prestoadmin.server.lookup_port')
-    @patch('prestoadmin.server.error')
-    def test_fail_if_port_is_in_use(self, mock_error, mock_port, mock_run):
-        mock_port.return_value = 1010
-        env.host = 'any_host'
-        mock_run.return_value = 'some_string'
-        server.is_port_in_use(env.host)
-        mock_error.assert_called_with('Server failed to start on any_host. '
-                                      'Port 1010 already in use')
-
-    @patch('prestoadmin.server.run')
-    @patch('prestoadmin.server.lookup_port')
-    @patch('prestoadmin.server.warn')
-    def test_no_warn_if_port_free(self, mock_warn, mock_port, mock_run):
-        mock_port.return_value = 1010
-        env.host = 'any_host'
-        mock_run.return_value = ''
-        server.is_port_in_use(env.host)
-        self.assertEqual(False, mock_warn.called)
-
-    @patch('prestoadmin.server.lookup_port')
-    @patch('prestoadmin.server.warn')
-    def test_no_warn_if_port_lookup_fail(self, mock_warn, mock_port):
-        e = ConfigurationError()
-        mock_port.side_effect = e
+    @patch('prestoadmin.util.host_facts.gather_host_facts',
+           side_effect=gather_host_facts)
+    @patch('prestoadmin.util.host_facts.sudo')
+    def test_multiple_version_rpms(self, mock_sudo, mock_gather):
         env.host = 'any_host'
-        self.assertFalse(server.is_port_in_use(env.host))
-        self.assertEqual(False, mock_warn.called)
-
-    @patch('prestoadmin.server.run')
-    def test_multiple_version_rpms(self, mock_run):
-        output1 = _AttributeString('package presto is not installed')
-        output1.succeeded = False
-        output2 = _AttributeString('presto-server-rpm-0.115t-1.x86_64')
-        output2.succeeded = True
-        output3 = _AttributeString('Presto is not installed.')
-        output3.succeeded = False
-        output4 = _AttributeString('0.111.SNAPSHOT')
-        output4.succeeded = True
-
-        mock_run.side_effect = [output1, output2, output3, output4]
-
-        expected = server.check_presto_version()
-        mock_run.assert_has_calls([
-            call('rpm -q presto'),
-            call('rpm -q presto-server-rpm')
-        ])
-        self.assertEqual(expected, '')
-
-    def mock_fail_then_succeed(self):
-        output1 = _AttributeString()
-        output1.succeeded = False
-        output2 = _AttributeString()
-        output2.succeeded = True
-        return [output1, output2]
+        mock_sudo.return_value = _AttributeString(
+            '#presto-admin:rpms\n'
+            'package presto is not installed\n'
+            'presto-server-rpm 0.115t 1451606400\n'
+            'package presto-server is not installed')
+
+        self.assertEqual(server.check_presto_version(), '')
+        self.assertEqual(server.get_presto_version(), '0.115t')
+        # Both lookups are answered by a single probe of the host
+        self.assertEqual(1, mock_gather.call_count)
@@ -15,6 +15,7 @@
 """
 Tests the presto topology config
 """
+import json
 import unittest
 
 from mock import patch
@@ -95,6 +96,22 @@ class TestTopologyConfig(BaseUnitCase):
                                 config.validate_coordinator,
                                 (["my", "list"]))
 
+    def test_valid_coordinator_endpoints(self):
+        endpoints = ['standby', 'presto-lb:8080', 'FE80::0202:B3FF:FE1E:8329']
+        self.assertEqual(config.validate_coordinator_endpoints(endpoints), endpoints)
+
+    def test_invalid_coordinator_endpoint_port(self):
+        self.assertRaisesRegexp(ConfigurationError,
+                                'Invalid port number abc',
+                                config.validate_coordinator_endpoints,
+                                ['presto-lb:abc'])
+
+    def test_invalid_coordinator_endpoints_type(self):
+        self.assertRaisesRegexp(ConfigurationError,
+                                "coordinator_endpoints must be of type list",
+                                config.validate_coordinator_endpoints,
+                                'standby')
+
     def test_validate_workers_for_prompt(self):
         workers_input = "172.16.1.10 myslave FE80::0202:B3FF:FE1E:8329"
         workers_list = ["172.16.1.10", "myslave", "FE80::0202:B3FF:FE1E:8329"]
@@ -115,6 +132,39 @@ class TestTopologyConfig(BaseUnitCase):
                          "             'b']}\n",
                          self.test_stdout.getvalue())
 
+    def test_show_csv(self):
+        env.roledefs = {'coordinator': ['hello'], 'worker': ['a', 'hello'],
+                        'all': ['a', 'hello']}
+        env.user = 'user'
+        env.port = '22'
+        env.output_format = 'csv'
+
+        self.remove_runs_once_flag(topology.show)
+        topology.show()
+        self.assertEqual('host,roles,ssh_port,username\n'
+                         'hello,coordinator;worker,22,user\n'
+                         'a,worker,22,user\n',
+                         self.test_stdout.getvalue())
+
+    def test_show_json(self):
+        env.roledefs = {'coordinator': ['hello'], 'worker': ['a'],
+                        'all': ['a', 'hello']}
+        env.user = 'user'
+        env.port = '22'
+        env.output_format = 'json'
+
+        self.remove_runs_once_flag(topology.show)
+        topology.show()
+        document = json.loads(self.test_stdout.getvalue())
+        self.assertEqual('topology show', document['command'])
+        self.assertEqual(1, document['format_version'])
+        self.assertTrue('total' in document['timings_ms'])
+        self.assertEqual([{'host': 'hello', 'roles': ['coordinator'],
+                           'ssh_port': 22, 'username': 'user'},
+                          {'host': 'a', 'roles': ['worker'],
+                           'ssh_port': 22, 'username': 'user'}],
+                         document['records'])
+
 
 if __name__ == "__main__":
     unittest.main()
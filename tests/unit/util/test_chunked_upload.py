@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import patch
+
+from prestoadmin.util import chunked_upload
+from prestoadmin.util.chunked_upload import upload_in_chunks, \
+    get_chunk_checksums, prepare_chunks, PROGRESS_SUFFIX, PARTIAL_SUFFIX
+from tests.base_test_case import BaseTestCase
+
+CONTENT = 'abcdefghijklmnopqrstuvwxyz'
+
+
+class TestChunkedUpload(BaseTestCase):
+    """
+    The remote host is a local directory: put writes into it and sudo runs
+    the commands with the local shell.
+    """
+
+    def setUp(self):
+        super(TestChunkedUpload, self).setUp(capture_output=True)
+        env.host = 'master'
+        self.local_dir = tempfile.mkdtemp()
+        self.remote_dir = os.path.join(tempfile.mkdtemp(), 'packages')
+        self.local_path = os.path.join(self.local_dir, 'presto.rpm')
+        with open(self.local_path, 'w') as f:
+            f.write(CONTENT)
+        self.remote_path = os.path.join(self.remote_dir, 'presto.rpm')
+        self.chunks_put = []
+        self.failing_puts = []
+
+        put_patcher = patch('prestoadmin.util.chunked_upload.put',
+                            side_effect=self.fake_put)
+        sudo_patcher = patch('prestoadmin.util.chunked_upload.sudo',
+                             side_effect=self.fake_sudo)
+        # Keep the recorded checksums out of the real config directory
+        config_patcher = patch(
+            'prestoadmin.util.verification_cache.get_config_directory',
+            return_value=os.path.join(self.local_dir, 'config'))
+        for patcher in [put_patcher, sudo_patcher, config_patcher]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+        shutil.rmtree(os.path.dirname(self.remote_dir))
+        super(TestChunkedUpload, self).tearDown()
+
+    def fake_put(self, local_file, remote_path, use_sudo=False):
+        content = local_file.getvalue()
+        self.chunks_put.append(content)
+        if len(self.chunks_put) in self.failing_puts:
+            content = content[:1]
+        with open(remote_path, 'w') as f:
+            f.write(content)
+        result = _AttributeString('')
+        result.succeeded = True
+        return result
+
+    def fake_sudo(self, command):
+        process = subprocess.Popen(['bash', '-c', command],
+                                   stdout=subprocess.PIPE)
+        result = _AttributeString(process.communicate()[0])
+        result.succeeded = process.returncode == 0
+        return result
+
+    def read_remote(self, suffix=''):
+        with open(self.remote_path + suffix) as f:
+            return f.read()
+
+    def test_upload(self):
+        stats = upload_in_chunks(self.local_path, self.remote_dir, 10)
+        self.assertEqual(CONTENT, self.read_remote())
+        self.assertEqual(['abcdefghij', 'klmnopqrst', 'uvwxyz'],
+                         self.chunks_put)
+        self.assertEqual(3, stats['chunks'])
+        self.assertEqual(0, stats['resumed_chunks'])
+        self.assertEqual(len(CONTENT), stats['bytes_sent'])
+        self.assertFalse(os.path.exists(self.remote_path + PROGRESS_SUFFIX))
+        self.assertFalse(os.path.exists(self.remote_path + PARTIAL_SUFFIX))
+
+    def test_resume_after_last_good_chunk(self):
+        os.makedirs(self.remote_dir)
+        # An earlier upload got two chunks in, and was cut off in the middle
+        # of appending the third one
+        with open(self.remote_path + PARTIAL_SUFFIX, 'w') as f:
+            f.write('abcdefghijklmnopqrstuv')
+        checksum = subprocess.check_output(
+            ['sha256sum', self.local_path]).split()[0]
+        with open(self.remote_path + PROGRESS_SUFFIX, 'w') as f:
+            f.write('%s 2\n' % checksum)
+
+        stats = upload_in_chunks(self.local_path, self.remote_dir, 10)
+
+        self.assertEqual(['uvwxyz'], self.chunks_put)
+        self.assertEqual(2, stats['resumed_chunks'])
+        self.assertEqual(6, stats['bytes_sent'])
+        self.assertEqual(CONTENT, self.read_remote())
+        self.assertTrue('[master] Resuming upload of presto.rpm after chunk '
+                        '2 of 3' in self.test_stdout.getvalue())
+
+    def test_progress_of_another_file_is_ignored(self):
+        os.makedirs(self.remote_dir)
+        with open(self.remote_path + PROGRESS_SUFFIX, 'w') as f:
+            f.write('0123 2\n')
+
+        stats = upload_in_chunks(self.local_path, self.remote_dir, 10)
+
+        self.assertEqual(0, stats['resumed_chunks'])
+        self.assertEqual(CONTENT, self.read_remote())
+
+    def test_corrupted_chunk_is_sent_again(self):
+        self.failing_puts = [2]
+        upload_in_chunks(self.local_path, self.remote_dir, 10)
+        self.assertEqual(['abcdefghij', 'klmnopqrst', 'klmnopqrst',
+                          'uvwxyz'], self.chunks_put)
+        self.assertEqual(CONTENT, self.read_remote())
+
+    def test_abort_after_retries(self):
+        self.failing_puts = [2, 3, 4]
+        self.assertRaises(SystemExit, upload_in_chunks, self.local_path,
+                          self.remote_dir, 10)
+        self.assertEqual('%s 1' % subprocess.check_output(
+            ['sha256sum', self.local_path]).split()[0],
+            self.read_remote(PROGRESS_SUFFIX).strip())
+
+    def test_checksums_are_computed_once(self):
+        compute = chunked_upload._compute_chunk_checksums
+        with patch('prestoadmin.util.chunked_upload.CHUNK_SIZE', 10), \
+                patch('prestoadmin.util.chunked_upload.'
+                      '_compute_chunk_checksums',
+                      side_effect=compute) as mock_compute:
+            prepare_chunks(self.local_path)
+            # The jobs forked for each host only see what was recorded on
+            # disk, like this fresh lookup
+            checksums = get_chunk_checksums(self.local_path, 10)
+            upload_in_chunks(self.local_path, self.remote_dir, 10)
+            self.assertEqual(1, mock_compute.call_count)
+
+        self.assertEqual(3, len(checksums[1]))
+        self.assertEqual(subprocess.check_output(
+            ['sha256sum', self.local_path]).split()[0], checksums[0])
+        self.assertEqual(CONTENT, self.read_remote())
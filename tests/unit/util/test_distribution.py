@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import patch
+
+from prestoadmin.util import distribution
+from prestoadmin.util.distribution import distribute, relay_staged, \
+    upload_staged, install_staged
+from tests.base_test_case import BaseTestCase
+
+STAGED_PATH = '/tmp/presto-admin-distribution/abc/presto.rpm'
+
+
+class TestDistribution(BaseTestCase):
+    def setUp(self):
+        super(TestDistribution, self).setUp()
+        self.hosts = ['host%d' % i for i in range(10)]
+        self.relays = []
+        self.bad_hosts = []
+
+    def fake_execute(self, task, *args, **kwargs):
+        hosts = kwargs['hosts']
+        if task is upload_staged:
+            return dict((host, 'abc') for host in hosts)
+        if task is relay_staged:
+            targets = args[0]
+            self.relays.append(targets)
+            return dict((host, 'bad' if targets[host] in self.bad_hosts
+                         else 'abc') for host in hosts)
+        return dict((host, None) for host in hosts)
+
+    @patch('prestoadmin.util.distribution.execute')
+    def test_hosts_with_the_file_double_every_round(self, execute_mock):
+        execute_mock.side_effect = self.fake_execute
+
+        rounds = distribute('/local/presto.rpm', '/opt/packages',
+                            self.hosts, seed_count=2, checksum='abc')
+
+        # 2 seeds, then 4, 8 and all 10 hosts
+        self.assertEqual(3, rounds)
+        self.assertEqual([2, 4, 2], [len(relay) for relay in self.relays])
+        self.assertEqual({'host0': 'host2', 'host1': 'host3'},
+                         self.relays[0])
+        upload_calls = [c for c in execute_mock.call_args_list
+                        if c[0][0] is upload_staged]
+        self.assertEqual(1, len(upload_calls))
+        self.assertEqual(['host0', 'host1'], upload_calls[0][1]['hosts'])
+        execute_mock.assert_called_with(install_staged, STAGED_PATH,
+                                        '/opt/packages', hosts=self.hosts)
+
+    @patch('prestoadmin.util.distribution.execute')
+    def test_bad_relay_falls_back_to_direct_upload(self, execute_mock):
+        execute_mock.side_effect = self.fake_execute
+        self.bad_hosts = ['host3']
+
+        distribute('/local/presto.rpm', '/opt/packages', self.hosts,
+                   seed_count=2, checksum='abc')
+
+        # host3 never relays, and gets the file from the admin host
+        self.assertTrue(all('host3' not in relay for relay in self.relays))
+        upload_calls = [c for c in execute_mock.call_args_list
+                        if c[0][0] is upload_staged]
+        self.assertEqual(['host3'], upload_calls[-1][1]['hosts'])
+
+    @patch('prestoadmin.util.distribution.execute')
+    def test_bad_direct_upload_aborts(self, execute_mock):
+        execute_mock.return_value = {'host0': 'bad'}
+        self.assertRaisesRegexp(SystemExit, 'Checksum mismatch',
+                                distribute, '/local/presto.rpm',
+                                '/opt/packages', ['host0'], checksum='abc')
+
+    @patch('prestoadmin.util.distribution.run')
+    def test_relay_reports_target_checksum(self, run_mock):
+        env.host = 'host0'
+        env.user = 'root'
+        env.port = 22
+        run_mock.return_value = _AttributeString('abc  ' + STAGED_PATH)
+        run_mock.return_value.succeeded = True
+
+        self.assertEqual('abc', relay_staged({'host0': 'host2'}, STAGED_PATH))
+        run_mock.assert_called_with(
+            "cat %s | ssh -p 22 %s root@host2 'mkdir -p "
+            "/tmp/presto-admin-distribution/abc && cat > %s && sha256sum %s'"
+            % (STAGED_PATH, distribution.RELAY_SSH_OPTIONS, STAGED_PATH,
+               STAGED_PATH))
+
+        run_mock.return_value.succeeded = False
+        self.assertEqual(None, relay_staged({'host0': 'host2'}, STAGED_PATH))
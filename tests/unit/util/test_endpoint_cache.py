@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util.endpoint_cache import EndpointCache
+from tests.base_test_case import BaseTestCase
+
+ENDPOINTS = [('coordinator', 8080), ('standby', 8080)]
+
+
+class TestEndpointCache(BaseTestCase):
+    def setUp(self):
+        super(TestEndpointCache, self).setUp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'endpoint_cache')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.cache_dir))
+        super(TestEndpointCache, self).tearDown()
+
+    def test_put_get_forget(self):
+        cache = EndpointCache(self.cache_dir)
+        self.assertEqual(None, cache.get(ENDPOINTS))
+        cache.put(ENDPOINTS, ('standby', 8080))
+        self.assertEqual(('standby', 8080), cache.get(ENDPOINTS))
+        self.assertEqual(None, cache.get(ENDPOINTS[:1]))
+        cache.forget(ENDPOINTS)
+        self.assertEqual(None, cache.get(ENDPOINTS))
+
+    def test_endpoints_are_not_shared_between_runs(self):
+        EndpointCache(self.cache_dir).put(ENDPOINTS, ('standby', 8080))
+        with patch('prestoadmin.util.endpoint_cache.time.time',
+                   return_value=1):
+            self.assertEqual(None, EndpointCache(self.cache_dir).get(ENDPOINTS))
+
+    @patch('prestoadmin.util.endpoint_cache.time.time')
+    def test_old_runs_purged(self, mock_time):
+        mock_time.return_value = 100
+        old_run = EndpointCache(self.cache_dir)
+        old_run.put(ENDPOINTS, ('standby', 8080))
+        os.utime(old_run.path, (100, 100))
+
+        mock_time.return_value = 100 + 24 * 60 * 60 + 1
+        EndpointCache(self.cache_dir).put(ENDPOINTS, ('coordinator', 8080))
+        self.assertFalse(os.path.exists(old_run.path))
@@ -13,6 +13,9 @@
 # limitations under the License.
 
 import errno
+import os
+import tempfile
+
 from mock import patch
 from prestoadmin.util import filesystem
 from tests.base_test_case import BaseTestCase
@@ -42,3 +45,14 @@ class TestFilesystem(BaseTestCase):
         self.assertRaisesRegexp(OSError, 'message',
                                 filesystem.write_to_file_if_not_exists,
                                 'content', 'path/to/anyfile')
+
+    def test_sha256_of_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('presto')
+            self.assertEqual('69c0d2416d173ba6e1c841b566fa4ca3'
+                             '1bb41a3f7440d7fa0bd60beff2669cd1',
+                             filesystem.sha256_of_file(path))
+        finally:
+            os.remove(path)
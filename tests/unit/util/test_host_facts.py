@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fabric.api import env
+from mock import patch
+
+from prestoadmin.util import host_facts
+from prestoadmin.util.host_facts import parse_facts, get_host_facts, \
+    forget_host_facts, get_presto_rpm_version, get_presto_package, \
+    is_package_installed, get_facts_of_hosts, parse_java_version, \
+    NODE_PROPERTIES, CONFIG_PROPERTIES, RPMS, PORTS, PLATFORM, JAVA, \
+    JVM_CONFIG, LOG_PROPERTIES, JAVA_HOMES, DISK, MEMORY, UUIDGEN, PRESTO_USER
+from tests.base_test_case import BaseTestCase
+
+FACTS_OUTPUT = '''#presto-admin:node.properties
+node.environment=presto
+# a comment
+node.id = abc
+node.data-dir:/var/lib/presto/data
+
+#presto-admin:config.properties
+#presto-admin:unreadable
+#presto-admin:jvm.config
+-server
+
+-Xmx16G
+#presto-admin:log.properties
+com.facebook.presto=INFO
+#presto-admin:rpms
+package presto is not installed
+presto-server-rpm 0.130 1451606400
+package presto-server is not installed
+#presto-admin:ports
+Active Internet connections (only servers)
+Proto Recv-Q Send-Q Local Address           Foreign Address         State
+tcp        0      0 0.0.0.0:22              0.0.0.0:*               LISTEN
+tcp6       0      0 :::8080                 :::*                    LISTEN
+#presto-admin:platform
+Linux master 3.10.0 x86_64 GNU/Linux
+#presto-admin:java
+java version "1.8.0_40"
+Java(TM) SE Runtime Environment (build 1.8.0_40-b25)
+#presto-admin:java_homes
+/usr/java/jdk1.7.0_80 java version "1.7.0_80"
+/usr/java/default java version "1.8.0_40"
+/usr/java/jdk1.7.0_80 java version "1.7.0_80"
+#presto-admin:disk
+/opt/prestoadmin/packages /dev/sda1 41152736 3300000 37852736 9% /
+/usr/lib/presto /dev/sda1 41152736 3300000 37852736 9% /
+/var/lib/presto /dev/sdb1 20000000 10000000 10000000 50% /var/lib/presto
+#presto-admin:memory
+MemTotal:       16318808 kB
+#presto-admin:uuidgen
+/usr/bin/uuidgen
+#presto-admin:presto_user
+presto:x:496:494:Presto:/var/lib/presto:/bin/bash
+'''
+
+
+class TestHostFacts(BaseTestCase):
+    def test_parse_facts(self):
+        facts = parse_facts(FACTS_OUTPUT)
+        self.assertEqual({'node.environment': 'presto',
+                          'node.id': 'abc',
+                          'node.data-dir': '/var/lib/presto/data'},
+                         facts[NODE_PROPERTIES])
+        self.assertEqual(None, facts[CONFIG_PROPERTIES])
+        self.assertEqual(['-server', '-Xmx16G'], facts[JVM_CONFIG])
+        self.assertEqual({'com.facebook.presto': 'INFO'},
+                         facts[LOG_PROPERTIES])
+        self.assertEqual({'presto-server-rpm': {'name': 'presto-server-rpm',
+                                                'version': '0.130',
+                                                'install_time': 1451606400}},
+                         facts[RPMS])
+        self.assertEqual([22, 8080], facts[PORTS])
+        self.assertEqual('Linux master 3.10.0 x86_64 GNU/Linux',
+                         facts[PLATFORM])
+        self.assertEqual('java version "1.8.0_40"\n'
+                         'Java(TM) SE Runtime Environment (build 1.8.0_40-b25)',
+                         facts[JAVA])
+        self.assertEqual([{'path': '/usr/java/jdk1.7.0_80',
+                           'version': '1.7.0_80'},
+                          {'path': '/usr/java/default',
+                           'version': '1.8.0_40'}],
+                         facts[JAVA_HOMES])
+        self.assertEqual({'available': 37852736 * 1024, 'mount': '/'},
+                         facts[DISK]['/usr/lib/presto'])
+        self.assertEqual({'available': 10000000 * 1024,
+                          'mount': '/var/lib/presto'},
+                         facts[DISK]['/var/lib/presto'])
+        self.assertEqual(16318808 * 1024, facts[MEMORY])
+        self.assertEqual('/usr/bin/uuidgen', facts[UUIDGEN])
+        self.assertEqual({'name': 'presto', 'uid': 496,
+                          'home': '/var/lib/presto'}, facts[PRESTO_USER])
+
+    def test_parse_facts_of_bare_host(self):
+        facts = parse_facts('#presto-admin:java_homes\n#presto-admin:disk\n'
+                            '#presto-admin:memory\n#presto-admin:uuidgen\n'
+                            '#presto-admin:presto_user\n')
+        self.assertEqual([], facts[JAVA_HOMES])
+        self.assertEqual({}, facts[DISK])
+        self.assertEqual(None, facts[MEMORY])
+        self.assertEqual(None, facts[UUIDGEN])
+        self.assertEqual(None, facts[PRESTO_USER])
+
+    def test_parse_java_version(self):
+        self.assertEqual('1.8.0_40', parse_java_version(
+            'java version "1.8.0_40"\nJava(TM) SE Runtime Environment'))
+        self.assertEqual('1.8.0_131', parse_java_version(
+            'openjdk version "1.8.0_131"'))
+        self.assertEqual(None, parse_java_version('bash: java: not found'))
+        self.assertEqual(None, parse_java_version(None))
+
+    @patch('prestoadmin.util.host_facts.execute')
+    def test_facts_of_hosts_probed_together(self, execute_mock):
+        env.host_facts = {'host1': parse_facts(FACTS_OUTPUT)}
+        execute_mock.return_value = {'host2': FACTS_OUTPUT,
+                                     'host3': Exception('unreachable')}
+
+        facts = get_facts_of_hosts(['host1', 'host2', 'host3'])
+
+        execute_mock.assert_called_once_with(host_facts._probe_facts,
+                                             hosts=['host2', 'host3'])
+        self.assertEqual(['host1', 'host2', 'host3'], sorted(facts))
+        self.assertEqual(facts['host1'], facts['host2'])
+        self.assertEqual(None, facts['host3'])
+        self.assertEqual(facts['host2'], get_host_facts('host2'))
+        self.assertEqual(1, execute_mock.call_count)
+
+    @patch('prestoadmin.util.host_facts.gather_host_facts')
+    def test_facts_cached_until_forgotten(self, gather_mock):
+        gather_mock.return_value = parse_facts(FACTS_OUTPUT)
+        self.assertEqual('0.130', get_presto_rpm_version('host1'))
+        get_host_facts('host1')
+        self.assertEqual(1, gather_mock.call_count)
+
+        get_host_facts('host2')
+        self.assertEqual(2, gather_mock.call_count)
+
+        forget_host_facts('host1')
+        get_host_facts('host1')
+        self.assertEqual(3, gather_mock.call_count)
+
+    @patch('prestoadmin.util.host_facts.gather_host_facts')
+    def test_presto_package_detected_with_one_probe(self, gather_mock):
+        gather_mock.return_value = parse_facts(FACTS_OUTPUT)
+        self.assertEqual('presto-server-rpm',
+                         get_presto_package('host1')['name'])
+        self.assertEqual(None, get_presto_package('host1', ['presto']))
+        self.assertTrue(is_package_installed('host1', 'presto-server-rpm'))
+        self.assertFalse(is_package_installed('host1', 'presto-server'))
+        self.assertEqual(None, is_package_installed('host1', 'other'))
+        self.assertEqual(1, gather_mock.call_count)
+
+    @patch('prestoadmin.util.host_facts.gather_host_facts')
+    def test_unreachable_host_is_not_cached(self, gather_mock):
+        gather_mock.return_value = None
+        self.assertEqual(None, get_presto_rpm_version('host1'))
+        get_host_facts('host1')
+        self.assertEqual(2, gather_mock.call_count)
+
+    def test_script_probes_everything_once(self):
+        for marker in [NODE_PROPERTIES, CONFIG_PROPERTIES, JVM_CONFIG,
+                       LOG_PROPERTIES, RPMS, PORTS, PLATFORM, JAVA,
+                       JAVA_HOMES, DISK, MEMORY, UUIDGEN, PRESTO_USER]:
+            self.assertEqual(
+                1, host_facts.FACTS_SCRIPT.count("'#presto-admin:%s'" % marker))
+
+    @patch('prestoadmin.util.host_facts.shell_env')
+    @patch('prestoadmin.util.host_facts.sudo')
+    def test_script_looks_for_configured_java8_home(self, sudo_mock,
+                                                    shell_env_mock):
+        env.java8_home = None
+        host_facts._run_facts_script()
+        self.assertFalse(shell_env_mock.called)
+        sudo_mock.assert_called_with(host_facts.FACTS_SCRIPT, warn_only=True)
+
+        env.java8_home = '/opt/java8'
+        host_facts._run_facts_script()
+        shell_env_mock.assert_called_with(JAVA8_HOME='/opt/java8')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from prestoadmin.util.node_watcher import NodeListWatcher
+from tests.base_test_case import BaseTestCase
+
+
+class TestNodeListWatcher(BaseTestCase):
+    def setUp(self):
+        super(TestNodeListWatcher, self).setUp()
+        self.state_dir = os.path.join(tempfile.mkdtemp(), 'node_watcher')
+        self.polls = []
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.state_dir))
+        super(TestNodeListWatcher, self).tearDown()
+
+    def watcher(self, nodes_per_poll, interval=0.2):
+        def fetch_nodes(timeout):
+            self.polls.append(time.time())
+            return nodes_per_poll[min(len(self.polls), len(nodes_per_poll)) - 1]
+        return NodeListWatcher(['coordinator', 'user'], fetch_nodes,
+                               interval=interval, state_dir=self.state_dir)
+
+    def test_node_ready_after_it_shows_up(self):
+        watcher = self.watcher([[], [['id2', 'http://b']],
+                                [['id1', 'http://a'], ['id2', 'http://b']]])
+        since = time.time()
+        time_to_ready = watcher.wait_for('id1', since, since + 5)
+        self.assertEqual(3, len(self.polls))
+        self.assertTrue(0 < time_to_ready < 5)
+
+    def test_timeout(self):
+        watcher = self.watcher([[['id2', 'http://b']]])
+        since = time.time()
+        self.assertEqual(None, watcher.wait_for('id1', since, since + 0.5))
+        # Polled once per interval, not in a busy loop
+        self.assertTrue(2 <= len(self.polls) <= 4)
+
+    def test_failed_poll_is_retried_after_interval(self):
+        watcher = self.watcher([None, [['id1', 'http://a']]])
+        since = time.time()
+        self.assertNotEqual(None, watcher.wait_for('id1', since, since + 5))
+        self.assertEqual(2, len(self.polls))
+        self.assertTrue(self.polls[1] - self.polls[0] >= 0.2)
+
+    def test_node_list_from_before_start_does_not_count(self):
+        watcher = self.watcher([[['id1', 'http://a']]])
+        watcher.wait_for('id1', time.time(), time.time() + 5)
+        since = time.time()
+        self.assertTrue(watcher.wait_for('id1', since, since + 5) >= 0)
+        self.assertEqual(2, len(self.polls))
+
+    def test_waiting_hosts_share_polls(self):
+        nodes = [['id%d' % i, 'http://host%d' % i] for i in range(10)]
+        results = {}
+        since = time.time()
+
+        def wait_for(node_id):
+            results[node_id] = self.watcher([nodes]).wait_for(
+                node_id, since, since + 5)
+
+        threads = [threading.Thread(target=wait_for, args=(node[0],))
+                   for node in nodes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(10, len(results))
+        self.assertTrue(None not in results.values())
+        self.assertEqual(1, len(self.polls))
+
+    def test_wait_for_ready_state(self):
+        watcher = self.watcher([[['id1', 'http://a', 'shutting_down']],
+                                [['id1', 'http://a', 'active']]])
+        since = time.time()
+        self.assertNotEqual(None, watcher.wait_for(
+            'id1', since, since + 5, lambda row: row[-1] == 'active'))
+        self.assertEqual(2, len(self.polls))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from StringIO import StringIO
+
+from fabric.state import env
+
+from prestoadmin.util.output_format import get_output_format, print_records
+from tests.base_test_case import BaseTestCase
+
+FIELDS = ['name', 'flag', 'items', 'missing']
+RECORDS = [{'name': u'a,b', 'flag': True, 'items': ['x', 'y'],
+            'ignored': 1}]
+
+
+class TestOutputFormat(BaseTestCase):
+    def test_csv(self):
+        output = StringIO()
+        print_records('csv', 'test', FIELDS, RECORDS, {}, stream=output)
+        self.assertEqual('name,flag,items,missing\n"a,b",true,x;y,\n',
+                         output.getvalue())
+
+    def test_json(self):
+        output = StringIO()
+        print_records('json', 'test', FIELDS, RECORDS, {'total': 5}, 0,
+                      stream=output)
+        self.assertEqual(1, len(output.getvalue().splitlines()))
+        self.assertEqual(
+            {'format_version': 1, 'command': 'test',
+             'collected_at': '1970-01-01T00:00:00Z',
+             'timings_ms': {'total': 5},
+             'records': [{'name': 'a,b', 'flag': True, 'items': ['x', 'y'],
+                          'missing': None}]},
+            json.loads(output.getvalue()))
+
+    def test_get_output_format(self):
+        self.assertEqual('text', get_output_format())
+        env.output_format = 'JSON'
+        self.assertEqual('json', get_output_format())
+        env.output_format = 'xml'
+        self.assertRaises(SystemExit, get_output_format)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prestoadmin.util.host_facts import parse_facts, JAVA_HOMES, JAVA, \
+    DISK, MEMORY, PORTS, RPMS, UUIDGEN, PRESTO_USER
+from prestoadmin.util.preflight import check_host, check_java, check_disk, \
+    check_memory, check_port, check_user, get_max_heap_size, failed_hosts, \
+    format_results, OK, WARN, FAIL, CHECKS, JAVA_CHECK, DISK_CHECK, \
+    MEMORY_CHECK, PORT_CHECK, UUIDGEN_CHECK, USER_CHECK
+from tests.base_test_case import BaseTestCase
+from tests.unit.util.test_host_facts import FACTS_OUTPUT
+
+GB = 1024 * 1024 * 1024
+
+
+class TestPreflight(BaseTestCase):
+    def setUp(self):
+        super(TestPreflight, self).setUp()
+        self.facts = parse_facts(FACTS_OUTPUT)
+
+    def test_ready_host(self):
+        results = check_host(self.facts, ['-server', '-Xmx8G'], 8081,
+                             rpm_size=500 * 1024 * 1024)
+        self.assertEqual(
+            {JAVA_CHECK: (OK, '1.8.0_40'),
+             DISK_CHECK: (OK, '9.5G free'),
+             MEMORY_CHECK: (OK, 'heap of 8.0G of 15.6G'),
+             PORT_CHECK: (OK, '8081 free'),
+             UUIDGEN_CHECK: (OK, '/usr/bin/uuidgen'),
+             USER_CHECK: (OK, 'uid 496')},
+            results)
+
+    def test_unreachable_host_only_warns(self):
+        results = check_host(None, [], 8080)
+        self.assertEqual(set(CHECKS), set(results))
+        self.assertEqual([], failed_hosts({'host1': results}))
+
+    def test_java(self):
+        self.assertEqual((OK, '1.8.0_40'),
+                         check_java(self.facts, '/usr/java/default/'))
+        self.assertEqual((FAIL, 'java8_home /usr/java/jdk1.7.0_80 is '
+                                'Java 1.7.0_80'),
+                         check_java(self.facts, '/usr/java/jdk1.7.0_80'))
+        self.assertEqual((FAIL, 'no Java in java8_home /opt/java'),
+                         check_java(self.facts, '/opt/java'))
+
+        self.facts[JAVA_HOMES] = [{'path': '/usr/java/jdk1.7.0_80',
+                                   'version': '1.7.0_80'}]
+        self.assertEqual((OK, '1.8.0_40'), check_java(self.facts))
+        self.facts[JAVA] = 'bash: java: command not found'
+        self.assertEqual(FAIL, check_java(self.facts)[0])
+
+    def test_disk_adds_up_the_rpm_dirs_on_a_filesystem(self):
+        self.facts[DISK]['/var/lib/presto']['available'] = 10 * GB
+        self.facts[DISK]['/usr/lib/presto']['available'] = 2 * GB
+        self.facts[DISK]['/opt/prestoadmin/packages']['available'] = 2 * GB
+        self.assertEqual((OK, '2.0G free'),
+                         check_disk(self.facts, int(0.5 * GB)))
+        self.assertEqual((FAIL, '2.0G free on /, needs 2.6G'),
+                         check_disk(self.facts, int(0.8 * GB)))
+
+        self.facts[DISK] = {}
+        self.assertEqual(WARN, check_disk(self.facts)[0])
+
+    def test_memory(self):
+        self.assertEqual(16 * GB, get_max_heap_size(['-Xmx4G', '-Xmx16g']))
+        self.assertEqual(512 * 1024 * 1024, get_max_heap_size(['-Xmx512m']))
+        self.assertEqual(None, get_max_heap_size(['-Xms1G']))
+        self.assertEqual(None, get_max_heap_size(None))
+
+        self.assertEqual((FAIL, 'heap of 16.0G but only 15.6G of memory'),
+                         check_memory(self.facts, ['-Xmx16G']))
+        self.assertEqual((OK, '15.6G'), check_memory(self.facts, []))
+        self.facts[MEMORY] = None
+        self.assertEqual(WARN, check_memory(self.facts, ['-Xmx16G'])[0])
+
+    def test_port_may_be_used_by_presto(self):
+        self.assertEqual((OK, '8080 used by Presto'),
+                         check_port(self.facts, 8080))
+        self.facts[RPMS] = {}
+        self.assertEqual((FAIL, '8080 in use'), check_port(self.facts, 8080))
+        self.facts[PORTS] = []
+        self.assertEqual((OK, '8080 free'), check_port(self.facts, 8080))
+
+    def test_uuidgen_and_user(self):
+        self.facts[UUIDGEN] = None
+        self.facts[PRESTO_USER] = None
+        results = check_host(self.facts, [], 8081)
+        self.assertEqual((FAIL, 'uuidgen not found'), results[UUIDGEN_CHECK])
+        self.assertEqual((WARN, 'presto user missing'), results[USER_CHECK])
+
+        self.facts[RPMS] = {}
+        self.assertEqual((OK, 'created by the rpm'), check_user(self.facts))
+
+    def test_results_table(self):
+        results = {'master': check_host(self.facts, ['-Xmx8G'], 8081),
+                   'slave1': check_host(self.facts, ['-Xmx32G'], 8081),
+                   'slave2': check_host(None, [], 8081)}
+        self.assertEqual(['slave1'], failed_hosts(results))
+        self.assertEqual(
+            'host    java      disk      memory    port      uuidgen   user\n'
+            'master  ok        ok        ok        ok        ok        ok\n'
+            'slave1  ok        ok        FAIL      ok        ok        ok\n'
+            'slave2  warn      warn      warn      warn      warn      warn\n'
+            '\n'
+            'slave1: memory FAIL: heap of 32.0G but only 15.6G of memory\n'
+            'slave2: host unreachable',
+            format_results(['master', 'slave1', 'slave2'], results))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import tempfile
+import urllib2
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import patch
+
+from prestoadmin.util.pull_install import FileServer, pull, pull_file
+from tests.base_test_case import BaseTestCase
+
+
+class TestPullInstall(BaseTestCase):
+    def setUp(self):
+        super(TestPullInstall, self).setUp(capture_output=True)
+        fd, self.local_path = tempfile.mkstemp(suffix='.rpm')
+        with os.fdopen(fd, 'wb') as local_file:
+            local_file.write('x' * 3000000)
+        self.addCleanup(os.remove, self.local_path)
+
+    def test_file_server_serves_only_the_file(self):
+        with FileServer(self.local_path) as file_server:
+            base_url = 'http://127.0.0.1:%d' % file_server.port
+            response = urllib2.urlopen(base_url + file_server.path)
+            self.assertEqual('3000000', response.info()['Content-Length'])
+            self.assertEqual('x' * 3000000, response.read())
+
+            for path in ['/', '/' + os.path.basename(self.local_path),
+                         file_server.path + 'x']:
+                try:
+                    urllib2.urlopen(base_url + path)
+                    self.fail('Expected a 404 for %s' % path)
+                except urllib2.HTTPError as e:
+                    self.assertEqual(404, e.code)
+            self.assertEqual(4, file_server.request_count)
+            # The path can't be guessed from the file name
+            self.assertNotEqual(file_server.path,
+                                FileServer(self.local_path).path)
+
+    @patch('prestoadmin.util.pull_install.get_local_address')
+    @patch('prestoadmin.util.pull_install.execute')
+    def test_pull(self, mock_execute, mock_address):
+        addresses = {'a': '10.0.0.1', 'b': '10.0.0.1', 'c': '192.168.0.1'}
+        mock_address.side_effect = lambda host: addresses[host]
+
+        def fake_execute(task, urls, remote_path, checksum, hosts):
+            self.assertEqual(3, env.pool_size)
+            self.assertEqual(['a', 'b', 'c'], hosts)
+            self.assertTrue(urls['a'].startswith('http://10.0.0.1:'))
+            self.assertTrue(urls['c'].startswith('http://192.168.0.1:'))
+            self.assertEqual('/opt/packages/' +
+                             os.path.basename(self.local_path), remote_path)
+            self.assertEqual('abc', checksum)
+            return {'a': True, 'b': False, 'c': True}
+        mock_execute.side_effect = fake_execute
+
+        failed_hosts = pull(self.local_path, '/opt/packages', ['a', 'b', 'c'],
+                            concurrency=3, checksum='abc')
+        self.assertEqual(['b'], failed_hosts)
+        self.assertEqual(pull_file, mock_execute.call_args[0][0])
+        self.assertTrue('to 3 hosts, 3 at a time' in
+                        self.test_stdout.getvalue())
+        self.assertTrue('Could not pull %s to b, pushing it instead' %
+                        self.local_path in self.test_stdout.getvalue())
+
+    @patch('prestoadmin.util.pull_install.get_local_address')
+    @patch('prestoadmin.util.pull_install.execute')
+    def test_unroutable_host_is_pushed_to(self, mock_execute, mock_address):
+        def get_local_address(host):
+            if host == 'b':
+                raise socket.gaierror('Name or service not known')
+            return '10.0.0.1'
+        mock_address.side_effect = get_local_address
+        mock_execute.return_value = {'a': True}
+
+        self.assertEqual(['b'], pull(self.local_path, '/opt/packages',
+                                     ['a', 'b'], checksum='abc'))
+        self.assertEqual(['a'], mock_execute.call_args[1]['hosts'])
+
+    @patch('prestoadmin.util.pull_install.execute')
+    def test_pull_without_hosts(self, mock_execute):
+        self.assertEqual([], pull(self.local_path, '/opt/packages', []))
+        self.assertFalse(mock_execute.called)
+
+    @patch('prestoadmin.util.pull_install.sudo')
+    def test_pull_file(self, mock_sudo):
+        env.host = 'a'
+        mock_sudo.return_value = _AttributeString('')
+        mock_sudo.return_value.succeeded = True
+        urls = {'a': 'http://10.0.0.1:8000/t/presto.rpm'}
+        self.assertTrue(pull_file(urls, '/opt/packages/presto.rpm', 'abc'))
+        mock_sudo.assert_called_with(
+            'mkdir -p /opt/packages && '
+            'curl -fsS --connect-timeout 10 --retry 3 '
+            '-o /opt/packages/presto.rpm.pull '
+            'http://10.0.0.1:8000/t/presto.rpm && '
+            '[ "$(sha256sum < /opt/packages/presto.rpm.pull | cut -c1-64)" = '
+            '"abc" ] && '
+            'mv /opt/packages/presto.rpm.pull /opt/packages/presto.rpm; '
+            'status=$?; rm -f /opt/packages/presto.rpm.pull; exit $status')
+
+        mock_sudo.return_value = _AttributeString('curl: (7) Failed')
+        mock_sudo.return_value.succeeded = False
+        self.assertFalse(pull_file(urls, '/opt/packages/presto.rpm', 'abc'))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch, MagicMock
+
+from prestoadmin.prestoclient import PrestoClient
+from prestoadmin.util.query_cache import QueryResultCache
+from tests.base_test_case import BaseTestCase
+from tests.unit.base_unit_case import PRESTO_CONFIG
+
+
+class TestQueryResultCache(BaseTestCase):
+    def setUp(self):
+        super(TestQueryResultCache, self).setUp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'query_cache')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.cache_dir))
+        super(TestQueryResultCache, self).tearDown()
+
+    def test_put_then_get(self):
+        cache = QueryResultCache(self.cache_dir)
+        cache.put('coordinator:8080', 'user', 'hive', 'default', 'sql', [['row']])
+        self.assertEqual(cache.get('coordinator:8080', 'user', 'hive', 'default', 'sql'), [['row']])
+        self.assertEqual(cache.get('coordinator:8080', 'other_user', 'hive', 'default', 'sql'), None)
+        self.assertEqual(cache.get('coordinator:8080', 'user', 'hive', 'default', 'other_sql'), None)
+
+    def test_missing_directory_is_a_miss(self):
+        cache = QueryResultCache(self.cache_dir)
+        self.assertEqual(cache.get('coordinator:8080', 'user', 'hive', 'default', 'sql'), None)
+
+    @patch('prestoadmin.util.query_cache.time.time')
+    def test_expired_entry_is_a_miss(self, mock_time):
+        mock_time.return_value = 100
+        cache = QueryResultCache(self.cache_dir, ttl=10)
+        cache.put('coordinator:8080', 'user', 'hive', 'default', 'sql', [['row']])
+        mock_time.return_value = 111
+        self.assertEqual(cache.get('coordinator:8080', 'user', 'hive', 'default', 'sql'), None)
+
+    def test_entries_are_not_shared_between_runs(self):
+        QueryResultCache(self.cache_dir).put('coordinator:8080', 'user', 'hive', 'default', 'sql', [['row']])
+        other_run = QueryResultCache(self.cache_dir)
+        other_run.run_id = 'other'
+        self.assertEqual(other_run.get('coordinator:8080', 'user', 'hive', 'default', 'sql'), None)
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    def test_client_uses_cache(self, mock_presto_config):
+        cache = QueryResultCache(self.cache_dir)
+        client = PrestoClient('any_host', 'any_user')
+        client._run_sql = MagicMock(return_value=[['hive']])
+
+        self.assertEqual(client.run_sql('sql', cache=cache), [['hive']])
+        self.assertEqual(client.run_sql('sql', cache=cache), [['hive']])
+        self.assertEqual(client._run_sql.call_count, 1)
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    def test_client_does_not_cache_failures(self, mock_presto_config):
+        cache = QueryResultCache(self.cache_dir)
+        client = PrestoClient('any_host', 'any_user')
+        client._run_sql = MagicMock(return_value=None)
+
+        self.assertEqual(client.run_sql('sql', cache=cache), None)
+        self.assertEqual(client.run_sql('sql', cache=cache), None)
+        self.assertEqual(client._run_sql.call_count, 2)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin import server
+from prestoadmin.util import ranged_download
+from prestoadmin.util.ranged_download import download_in_ranges, \
+    split_ranges, supports_ranges, RangesNotSupportedError, \
+    PARTIAL_SUFFIX, PROGRESS_SUFFIX
+from tests.base_test_case import BaseTestCase
+from tests.fake_rpm_repository import FakeRpmRepository
+
+SIZE = 64 * 1024
+
+
+@patch('prestoadmin.util.ranged_download.MIN_RANGE_SIZE', 1024)
+class TestRangedDownload(BaseTestCase):
+    def setUp(self):
+        super(TestRangedDownload, self).setUp(capture_output=True)
+        self.content = ''.join(chr(i % 251) for i in range(SIZE))
+        self.download_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.download_dir, 'presto-server-rpm.rpm')
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+        super(TestRangedDownload, self).tearDown()
+
+    def read_download(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_split_ranges(self):
+        self.assertEqual([[0, 1024, 0], [1024, 2048, 0], [2048, 3072, 0]],
+                         split_ranges(3072, 3))
+        self.assertEqual([[0, 1500, 0], [1500, 3000, 0]],
+                         split_ranges(3000, 3))
+        self.assertEqual([[0, 1500, 0]], split_ranges(1500, 4))
+        self.assertTrue(supports_ranges('Bytes '))
+        self.assertFalse(supports_ranges('none'))
+        self.assertFalse(supports_ranges(None))
+
+    def test_download_in_parallel_ranges(self):
+        with FakeRpmRepository(self.content) as repository:
+            stats = download_in_ranges(repository.url, self.path, SIZE, 4)
+        self.assertEqual(self.content, self.read_download())
+        self.assertEqual([(0, 16383), (16384, 32767), (32768, 49151),
+                          (49152, 65535)], sorted(repository.ranges))
+        self.assertEqual(4, stats['ranges'])
+        self.assertEqual(SIZE, stats['bytes_read'])
+        self.assertFalse(os.path.exists(self.path + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + PROGRESS_SUFFIX))
+
+    def test_range_retried_where_it_was_cut_off(self):
+        with FakeRpmRepository(self.content, failures=1,
+                               fail_after=1000) as repository:
+            download_in_ranges(repository.url, self.path, SIZE, 2)
+        self.assertEqual(self.content, self.read_download())
+        self.assertEqual(3, len(repository.ranges))
+        self.assertTrue(
+            (1000, SIZE // 2 - 1) in repository.ranges or
+            (SIZE // 2 + 1000, SIZE - 1) in repository.ranges)
+
+    @patch('prestoadmin.util.ranged_download.BLOCK_SIZE', 100)
+    def test_progress_only_records_bytes_on_disk(self):
+        write_progress = ranged_download._write_progress
+
+        def check_progress(path, progress):
+            # Read through a separate file object, which does not see what
+            # is still in the buffers of the downloading one
+            with open(path + PARTIAL_SUFFIX, 'rb') as partial_file:
+                for first, end, done in progress['ranges']:
+                    partial_file.seek(first)
+                    self.assertEqual(self.content[first:first + done],
+                                     partial_file.read(done))
+            write_progress(path, progress)
+
+        with patch('prestoadmin.util.ranged_download._write_progress',
+                   side_effect=check_progress) as mock_write_progress:
+            with FakeRpmRepository(self.content) as repository:
+                download_in_ranges(repository.url, self.path, SIZE, 2)
+        self.assertTrue(mock_write_progress.called)
+        self.assertEqual(self.content, self.read_download())
+
+    @patch('prestoadmin.util.ranged_download.RANGE_RETRIES', 1)
+    def test_failed_download_resumed(self):
+        with FakeRpmRepository(self.content, failures=2,
+                               fail_after=1000) as repository:
+            self.assertRaises(IOError, download_in_ranges, repository.url,
+                              self.path, SIZE, 2)
+            self.assertTrue(os.path.exists(self.path + PROGRESS_SUFFIX))
+            bytes_sent = repository.bytes_sent
+
+            stats = download_in_ranges(repository.url, self.path, SIZE, 8)
+        self.assertEqual(self.content, self.read_download())
+        self.assertEqual(2000, stats['resumed_bytes'])
+        self.assertEqual(SIZE - 2000, repository.bytes_sent - bytes_sent)
+        # The ranges of the interrupted download are kept
+        self.assertEqual(4, len(repository.ranges))
+
+    @patch('prestoadmin.util.ranged_download.RANGE_RETRIES', 1)
+    def test_changed_file_not_resumed(self):
+        with FakeRpmRepository(self.content, failures=2,
+                               fail_after=1000) as repository:
+            self.assertRaises(IOError, download_in_ranges, repository.url,
+                              self.path, SIZE, 2, '"v1"')
+            stats = download_in_ranges(repository.url, self.path, SIZE, 2,
+                                       '"v2"')
+        self.assertEqual(self.content, self.read_download())
+        self.assertEqual(0, stats['resumed_bytes'])
+
+    def test_ranges_not_supported(self):
+        with FakeRpmRepository(self.content,
+                               accept_ranges=False) as repository:
+            self.assertRaises(RangesNotSupportedError, download_in_ranges,
+                              repository.url, self.path, SIZE, 2)
+        self.assertFalse(os.path.exists(self.path + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + PROGRESS_SUFFIX))
+
+    def download_rpm(self, repository, range_count=4):
+        with server.UrlHandler(repository.url) as url_handler:
+            downloader = server.PrestoRpmDownloader(
+                url_handler, self.download_dir, range_count)
+            return downloader.download_rpm('0.148')
+
+    def test_rpm_downloaded_in_ranges(self):
+        with FakeRpmRepository(self.content) as repository:
+            path = self.download_rpm(repository)
+        self.assertEqual(os.path.join(self.download_dir,
+                                      'presto-server-rpm-0.148.rpm'), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(4, len(repository.ranges))
+
+    def test_rpm_downloaded_in_one_stream_without_range_support(self):
+        with FakeRpmRepository(self.content,
+                               accept_ranges=False) as repository:
+            path = self.download_rpm(repository)
+        with open(path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(1, repository.request_count)
+
+    def test_rpm_download_falls_back_when_range_ignored(self):
+        with FakeRpmRepository(self.content) as repository:
+            # The server answers range requests with the whole file, as if
+            # it had advertised ranges by mistake
+            repository.accept_ranges = False
+            with patch('prestoadmin.server.supports_ranges',
+                       return_value=True):
+                path = self.download_rpm(repository)
+        with open(path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
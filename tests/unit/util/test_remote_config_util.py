@@ -15,13 +15,24 @@
 from fabric.operations import _AttributeString
 from mock import patch
 from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.host_facts import UNREADABLE, gather_host_facts
 from prestoadmin.util.remote_config_util import lookup_port,\
-    lookup_string_config, NODE_CONFIG_FILE
+    lookup_string_config, lookup_server_log_file, NODE_CONFIG_FILE
 from tests.base_test_case import BaseTestCase
 
 
+def facts_output(node_properties='', config_properties=''):
+    output = _AttributeString(
+        '#presto-admin:node.properties\n%s\n'
+        '#presto-admin:config.properties\n%s\n'
+        '#presto-admin:rpms\n' % (node_properties, config_properties))
+    output.succeeded = True
+    output.return_code = 0
+    return output
+
+
 class TestRemoteConfigUtil(BaseTestCase):
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_port_failure(self, sudo_mock):
         sudo_mock.return_value = Exception('File not found')
 
@@ -31,12 +42,10 @@ class TestRemoteConfigUtil(BaseTestCase):
             lookup_port, 'any_host'
         )
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_port_not_integer_failure(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'http-server.http.port=hello')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = facts_output(
+            config_properties='http-server.http.port=hello')
 
         self.assertRaisesRegexp(
             ConfigurationError,
@@ -45,20 +54,16 @@ class TestRemoteConfigUtil(BaseTestCase):
             lookup_port, 'any_host'
         )
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_port_not_in_file(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString('')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 1
+        sudo_mock.return_value = facts_output()
         port = lookup_port('any_host')
         self.assertEqual(port, 8080)
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_port_out_of_range(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'http-server.http.port=99999')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = facts_output(
+            config_properties='http-server.http.port=99999')
         self.assertRaisesRegexp(
             ConfigurationError,
             'Invalid port number 99999: port must be a number between 1 and '
@@ -66,30 +71,24 @@ class TestRemoteConfigUtil(BaseTestCase):
             lookup_port, 'any_host'
         )
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_string_config(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'config.to.lookup=/path/hello')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = facts_output(
+            node_properties='config.to.lookup=/path/hello')
         config_value = lookup_string_config('config.to.lookup',
                                             NODE_CONFIG_FILE, 'any_host')
         self.assertEqual(config_value, '/path/hello')
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_string_config_not_in_file(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString('')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 1
+        sudo_mock.return_value = facts_output()
         config_value = lookup_string_config('config.to.lookup',
                                             NODE_CONFIG_FILE, 'any_host')
         self.assertEqual(config_value, '')
 
-    @patch('prestoadmin.util.remote_config_util.sudo')
+    @patch('prestoadmin.util.host_facts.sudo')
     def test_lookup_string_config_file_not_found(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'grep: /etc/presto/node.properties does not exist')
-        sudo_mock.return_value.return_code = 2
+        sudo_mock.return_value = facts_output(node_properties=UNREADABLE)
 
         self.assertRaisesRegexp(
             ConfigurationError,
@@ -97,3 +96,16 @@ class TestRemoteConfigUtil(BaseTestCase):
             lookup_string_config, 'config.to.lookup', NODE_CONFIG_FILE,
             'any_host'
         )
+
+    @patch('prestoadmin.util.host_facts.gather_host_facts',
+           side_effect=gather_host_facts)
+    @patch('prestoadmin.util.host_facts.sudo')
+    def test_lookups_share_one_round_trip(self, sudo_mock, gather_mock):
+        sudo_mock.return_value = facts_output(
+            node_properties='node.id=abc\nnode.server-log-file=/log/server',
+            config_properties='http-server.http.port=8081')
+        self.assertEqual(8081, lookup_port('any_host'))
+        self.assertEqual('abc', lookup_string_config(
+            'node.id', NODE_CONFIG_FILE, 'any_host'))
+        self.assertEqual('/log/server', lookup_server_log_file('any_host'))
+        self.assertEqual(1, gather_mock.call_count)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util.rpm_cache import RpmCache
+from tests.base_test_case import BaseTestCase
+
+URL = 'http://example.com/presto-server-rpm.rpm'
+
+
+class TestRpmCache(BaseTestCase):
+    def setUp(self):
+        super(TestRpmCache, self).setUp(capture_output=True)
+        self.download_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'rpm_cache')
+        self.cache = RpmCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+        shutil.rmtree(os.path.dirname(self.cache_dir))
+        super(TestRpmCache, self).tearDown()
+
+    def download(self, content, name='presto-server-rpm.rpm'):
+        path = os.path.join(self.download_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read_index(self):
+        with open(os.path.join(self.cache_dir, 'index.json')) as f:
+            return json.load(f)
+
+    def test_add_and_lookup_by_version_and_url(self):
+        cached = self.cache.add(self.download('rpm'), URL, '0.148')
+        self.assertEqual(os.path.join(self.cache_dir,
+                                      'presto-server-rpm-0.148.rpm'), cached)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.download_dir, 'presto-server-rpm.rpm')))
+
+        entry = self.read_index()['presto-server-rpm-0.148.rpm']
+        self.assertEqual('0.148', entry['version'])
+        self.assertEqual(URL, entry['url'])
+        self.assertEqual(3, entry['size'])
+        self.assertEqual(hashlib.sha256('rpm').hexdigest(), entry['sha256'])
+
+        self.assertEqual(cached, self.cache.lookup(version='0.148'))
+        self.assertEqual(cached, self.cache.lookup(url=URL))
+        self.assertEqual(None, self.cache.lookup(version='0.149'))
+        self.assertEqual(None, self.cache.lookup(url='http://other'))
+
+    @patch('prestoadmin.util.rpm_cache.get_rpm_version')
+    def test_version_read_from_rpm(self, version_mock):
+        version_mock.return_value = '0.150'
+        cached = self.cache.add(self.download('rpm'), URL)
+        self.assertEqual('presto-server-rpm-0.150.rpm',
+                         os.path.basename(cached))
+        self.assertEqual(cached, self.cache.lookup(version='0.150'))
+
+    def test_missing_or_changed_rpm_dropped(self):
+        missing = self.cache.add(self.download('rpm'), URL, '0.148')
+        changed = self.cache.add(self.download('rpm'), URL, '0.149')
+        os.remove(missing)
+        with open(changed, 'a') as f:
+            f.write('more')
+
+        self.assertEqual(None, self.cache.lookup(url=URL))
+        self.assertEqual({}, self.read_index())
+
+    def test_remove(self):
+        cached = self.cache.add(self.download('rpm'), URL, '0.148')
+        self.cache.remove(cached)
+        self.assertFalse(os.path.exists(cached))
+        self.assertEqual({}, self.read_index())
+        self.assertEqual(None, self.cache.lookup(version='0.148'))
+
+    @patch('prestoadmin.util.rpm_cache.time.time')
+    def test_newest_rpm_for_url_within_max_age(self, time_mock):
+        time_mock.return_value = 1000
+        self.cache.add(self.download('old'), URL, '0.148')
+        time_mock.return_value = 2000
+        newest = self.cache.add(self.download('new'), URL, '0.149')
+
+        self.assertEqual(newest, self.cache.lookup(url=URL))
+        time_mock.return_value = 2500
+        self.assertEqual(newest, self.cache.lookup(url=URL, max_age=600))
+        self.assertEqual(None, self.cache.lookup(url=URL, max_age=300))
+
+    @patch('prestoadmin.util.rpm_cache.time.time')
+    def test_least_recently_used_rpm_evicted(self, time_mock):
+        cache = RpmCache(self.cache_dir, max_size=10)
+        time_mock.return_value = 1000
+        first = cache.add(self.download('1234'), URL, '0.148')
+        time_mock.return_value = 2000
+        second = cache.add(self.download('1234'), URL, '0.149')
+        time_mock.return_value = 3000
+        cache.lookup(version='0.148')
+
+        time_mock.return_value = 4000
+        third = cache.add(self.download('1234'), URL, '0.150')
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+        self.assertEqual(['presto-server-rpm-0.148.rpm',
+                          'presto-server-rpm-0.150.rpm'],
+                         sorted(self.read_index()))
+
+    def test_rpm_larger_than_cache_kept(self):
+        cache = RpmCache(self.cache_dir, max_size=2)
+        cached = cache.add(self.download('1234'), URL, '0.148')
+        self.assertEqual(cached, cache.lookup(version='0.148'))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from StringIO import StringIO
+
+from prestoadmin.util.status_board import StatusBoard, format_duration, \
+    format_bytes
+from tests.base_test_case import BaseTestCase
+
+
+class FakeTerminal(StringIO):
+    def isatty(self):
+        return True
+
+
+class TestStatusBoard(BaseTestCase):
+    def test_redraws_only_changed_lines(self):
+        terminal = FakeTerminal()
+        board = StatusBoard(terminal)
+        self.assertEqual(3, board.update(['a', 'b', 'c']))
+        self.assertEqual('a\nb\nc\n', terminal.getvalue())
+
+        terminal.truncate(0)
+        self.assertEqual(1, board.update(['a', 'B', 'c']))
+        self.assertEqual('\033[2A\r\033[KB\033[2B\r', terminal.getvalue())
+
+        terminal.truncate(0)
+        self.assertEqual(0, board.update(['a', 'B', 'c']))
+        self.assertEqual('', terminal.getvalue())
+
+    def test_redraws_everything_when_line_count_changes(self):
+        terminal = FakeTerminal()
+        board = StatusBoard(terminal)
+        board.update(['a', 'b'])
+        terminal.truncate(0)
+        self.assertEqual(3, board.update(['a', 'b', 'c']))
+        self.assertEqual('\033[2A\r\033[Ja\nb\nc\n', terminal.getvalue())
+
+    def test_no_escapes_when_not_a_terminal(self):
+        output = StringIO()
+        board = StatusBoard(output)
+        board.update(['a', 'b'])
+        board.update(['a', 'b'])
+        board.update(['a', 'c'])
+        self.assertEqual('a\nb\na\nc\n', output.getvalue())
+
+    def test_format(self):
+        self.assertEqual('00:01:05', format_duration(65999))
+        self.assertEqual('2d 03:00:00', format_duration(183600000))
+        self.assertEqual('-', format_duration(None))
+        self.assertEqual('512B', format_bytes(512))
+        self.assertEqual('1.5G', format_bytes(1.5 * 1024 ** 3))
+        self.assertEqual('-', format_bytes(None))
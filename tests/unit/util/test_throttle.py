@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+from StringIO import StringIO
+
+from fabric.api import env
+from mock import patch, MagicMock, call
+
+from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.throttle import TokenBucket, ThrottledSFTPClient, \
+    set_bandwidth_limits, get_buckets, throttled, MB
+from tests.base_test_case import BaseTestCase
+
+
+class FakeSFTPClient(object):
+    """
+    Sends and receives 100 bytes in blocks of 10, like paramiko does in
+    blocks of 32 KB.
+    """
+
+    def putfo(self, fl, remotepath, file_size=0, callback=None,
+              confirm=True):
+        for size in range(10, 101, 10):
+            callback(size, file_size)
+        return 'attributes'
+
+    def open(self, remotepath, mode):
+        return FakeRemoteFile()
+
+
+class FakeRemoteFile(StringIO):
+    def __init__(self):
+        StringIO.__init__(self, 'x' * 100)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        return StringIO.read(self, 10)
+
+
+def _reserve_in_child(bucket):
+    bucket.reserve(100)
+
+
+@patch('prestoadmin.util.throttle.time')
+class TestThrottle(BaseTestCase):
+    def setUp(self):
+        super(TestThrottle, self).setUp(capture_output=True)
+        env.host = 'master'
+
+    def tearDown(self):
+        set_bandwidth_limits()
+        super(TestThrottle, self).tearDown()
+
+    def test_bucket_allows_burst_then_waits(self, time_mock):
+        time_mock.time.return_value = 1000
+        bucket = TokenBucket(100)
+        self.assertEqual(0, bucket.reserve(60))
+        self.assertEqual(0, bucket.reserve(40))
+        self.assertEqual(0.5, bucket.reserve(50))
+
+        time_mock.time.return_value = 1001
+        self.assertEqual(0, bucket.reserve(50))
+        # The bucket never holds more than a second worth of tokens
+        time_mock.time.return_value = 1100
+        self.assertEqual(1.0, bucket.reserve(200))
+
+    def test_bucket_shared_with_forked_processes(self, time_mock):
+        time_mock.time.return_value = 1000
+        bucket = TokenBucket(100)
+        child = multiprocessing.Process(target=_reserve_in_child,
+                                        args=(bucket,))
+        child.start()
+        child.join()
+        self.assertEqual(0.5, bucket.reserve(50))
+
+    def test_limits(self, time_mock):
+        time_mock.time.return_value = 1000
+        self.assertEqual([], get_buckets('master'))
+        set_bandwidth_limits(host_bandwidth=2, total_bandwidth=3)
+        master_buckets = get_buckets('master')
+        self.assertEqual([2 * MB, 3 * MB],
+                         [bucket.rate for bucket in master_buckets])
+        self.assertEqual(master_buckets, get_buckets('master'))
+        slave_buckets = get_buckets('slave1')
+        self.assertNotEqual(master_buckets[0], slave_buckets[0])
+        self.assertEqual(master_buckets[1], slave_buckets[1])
+
+        self.assertRaises(ConfigurationError, set_bandwidth_limits, 0)
+
+    def test_put_and_get_wait_for_tokens(self, time_mock):
+        time_mock.time.return_value = 1000
+
+        def sleep(seconds):
+            time_mock.time.return_value += seconds
+        time_mock.sleep.side_effect = sleep
+        client = ThrottledSFTPClient(FakeSFTPClient(),
+                                     [TokenBucket(50), TokenBucket(40)])
+        self.assertEqual('attributes', client.putfo(StringIO(), 'remote'))
+        # 40 bytes of the burst, then every 10 bytes wait for the slowest
+        # bucket
+        self.assertEqual([call(0.25)] * 6, time_mock.sleep.call_args_list)
+        self.assertEqual(100, client.bytes)
+        self.assertEqual(1.5, client.waited)
+
+        local_file = StringIO()
+        self.assertEqual(100, client.getfo('remote', local_file))
+        self.assertEqual('x' * 100, local_file.getvalue())
+        self.assertEqual(200, client.bytes)
+
+    def test_throttled_only_with_limits(self, time_mock):
+        time_mock.time.return_value = 1000
+        sftp = MagicMock()
+        ftp = sftp.ftp
+        with throttled(sftp, 'Sent', 'file'):
+            self.assertEqual(ftp, sftp.ftp)
+
+        set_bandwidth_limits(total_bandwidth=1)
+        with throttled(sftp, 'Sent', 'file'):
+            self.assertTrue(isinstance(sftp.ftp, ThrottledSFTPClient))
+            sftp.ftp.transferred(100)
+        self.assertEqual(ftp, sftp.ftp)
+        self.assertTrue('[master] Sent file: 100 bytes' in
+                        self.test_stdout.getvalue())
+        self.assertTrue('bandwidth limit of 1.0 MB/s in total' in
+                        self.test_stdout.getvalue())
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util.verification_cache import VerificationCache
+from tests.base_test_case import BaseTestCase
+
+
+class TestVerificationCache(BaseTestCase):
+    def setUp(self):
+        super(TestVerificationCache, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = VerificationCache(
+            os.path.join(self.temp_dir, 'config', 'verified_files.json'))
+        self.rpm_path = os.path.join(self.temp_dir, 'presto.rpm')
+        with open(self.rpm_path, 'w') as f:
+            f.write('rpm')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestVerificationCache, self).tearDown()
+
+    def test_record_and_lookup(self):
+        self.assertEqual(None, self.cache.lookup(self.rpm_path))
+        self.assertFalse(self.cache.is_verified(self.rpm_path))
+        self.cache.record(self.rpm_path, valid=True)
+        self.assertTrue(self.cache.is_verified(self.rpm_path))
+        self.assertEqual(hashlib.sha256('rpm').hexdigest(),
+                         self.cache.get_sha256(self.rpm_path))
+        self.assertTrue(self.cache.lookup(self.rpm_path)['valid'])
+
+    @patch('prestoadmin.util.verification_cache.sha256_of_file',
+           return_value='abc')
+    def test_sha256_computed_until_file_changes(self, mock_sha256):
+        self.assertEqual('abc', self.cache.get_sha256(self.rpm_path))
+        self.assertEqual('abc', VerificationCache(self.cache.path)
+                         .get_sha256(self.rpm_path))
+        self.assertEqual(1, mock_sha256.call_count)
+
+        with open(self.rpm_path, 'a') as f:
+            f.write('changed')
+        self.cache.get_sha256(self.rpm_path)
+        self.assertEqual(2, mock_sha256.call_count)
+
+    def test_replaced_file_not_verified(self):
+        self.cache.record(self.rpm_path, valid=True)
+        stat = os.stat(self.rpm_path)
+        # Same size and modification time, but a different inode
+        os.rename(self.rpm_path, self.rpm_path + '.old')
+        with open(self.rpm_path, 'w') as f:
+            f.write('RPM')
+        os.utime(self.rpm_path, (stat.st_atime, stat.st_mtime))
+        self.assertFalse(self.cache.is_verified(self.rpm_path))
+
+    def test_missing_file_not_recorded(self):
+        missing_path = os.path.join(self.temp_dir, 'missing.rpm')
+        self.cache.record(missing_path, valid=True)
+        self.assertFalse(self.cache.is_verified(missing_path))
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    @patch('prestoadmin.util.verification_cache.MAX_ENTRIES', 2)
+    @patch('prestoadmin.util.verification_cache.time.time')
+    def test_oldest_entries_dropped(self, time_mock):
+        paths = []
+        for i in range(3):
+            time_mock.return_value = 1000 + i
+            path = os.path.join(self.temp_dir, '%d.rpm' % i)
+            with open(path, 'w') as f:
+                f.write(str(i))
+            self.cache.record(path, valid=True)
+            paths.append(path)
+        self.assertEqual([False, True, True],
+                         [self.cache.is_verified(rpm_path) for rpm_path in paths])